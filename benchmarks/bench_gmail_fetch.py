@@ -0,0 +1,47 @@
+# Offline benchmark: serial vs batched vs concurrent gmail_fetch against FakeGmailService
+# usage: python benchmarks/bench_gmail_fetch.py [n_messages] [latency_seconds]
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.email_fetcher import email_fetcher_api
+from src.email_fetcher.fake_service import FakeGmailService, make_fake_mailbox
+from src.utils.mail_store import MailStore
+
+
+def run(n, latency, batch_size, workers=None):
+    service = FakeGmailService(make_fake_mailbox(n, attachment_every=10), latency=latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        email_fetcher_api.fetcher_temp_path = tmp
+        start = time.perf_counter()
+        # the fake service is thread-safe, the workers can share it
+        email_fetcher_api.gmail_fetch("me", "newer_than:3d", service=service, batch_size=batch_size,
+                                      incremental=False, workers=workers, service_factory=lambda: service)
+        elapsed = time.perf_counter() - start
+        saved = len(MailStore(tmp))
+    return elapsed, service.round_trips, saved
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    results = {}
+    modes = [
+        ("serial", None, None),
+        ("batched", email_fetcher_api.BATCH_SIZE, None),
+        ("8 workers", None, 8),
+    ]
+    for label, batch_size, workers in modes:
+        results[label] = run(n, latency, batch_size, workers)
+    print("\n" + "=" * 55)
+    print(f"{n} messages, {latency * 1000:.0f}ms per round trip")
+    for label, (elapsed, round_trips, saved) in results.items():
+        print(f"{label:>10}: {elapsed:7.2f}s  {round_trips:5d} round trips  {saved} mails saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Benchmark: html_extractor vs UnstructuredHTMLLoader on saved mails
+# usage: python benchmarks/bench_html_extract.py [temp/mails or a directory of .html files] [max_files]
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.summarizer.mail_loader import HTML_LOADERS
+from src.utils.catalog import CATALOG_FILE
+from src.utils.mail_store import get_store
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def html_files(path):
+    if os.path.exists(os.path.join(path, CATALOG_FILE)):
+        store = get_store(path)
+        return [store.path(entry["html_path"]) for entry in store.entries() if entry.get("html_path")]
+    found = []
+    for root, _, filenames in os.walk(path):
+        found.extend(os.path.join(root, name) for name in sorted(filenames) if name.lower().endswith(".html"))
+    return found
+
+
+def similarity(a, b):
+    """Jaccard similarity of the word sets"""
+    a, b = set(_WORD_RE.findall((a or "").lower())), set(_WORD_RE.findall((b or "").lower()))
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def run(loader, files):
+    texts, start = [], time.perf_counter()
+    for path in files:
+        try:
+            texts.append(loader(path))
+        except ImportError:
+            raise
+        except Exception as e:
+            print(f"Error extracting {path}: {e}")
+            texts.append(None)
+    return texts, time.perf_counter() - start
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "temp", "mails")
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    files = html_files(path)[:limit]
+    if not files:
+        print(f"No html files found in {path}")
+        return
+    size = sum(os.path.getsize(f) for f in files) / 1e6
+
+    results = {}
+    for name, loader in HTML_LOADERS.items():
+        try:
+            results[name] = run(loader, files)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+
+    print("\n" + "=" * 55)
+    print(f"{len(files)} html files, {size:.1f} MB")
+    for name, (texts, elapsed) in results.items():
+        chars = sum(len(t or "") for t in texts)
+        print(f"{name:<14}{elapsed:8.2f}s {len(files) / elapsed:8.1f} files/s {size / elapsed:6.2f} MB/s "
+              f"{chars / len(files):8.0f} chars/file")
+    if "fast" in results and "unstructured" in results:
+        scores = [similarity(a, b) for a, b in zip(results["fast"][0], results["unstructured"][0])]
+        scores.sort()
+        print(f"word-set similarity fast vs unstructured: mean {sum(scores) / len(scores):.3f}, "
+              f"min {scores[0]:.3f}, median {scores[len(scores) // 2]:.3f}")
+        print(f"speedup: {results['unstructured'][1] / results['fast'][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Benchmark: time until the Gradio app and the command line tools are ready
+# usage: python benchmarks/bench_startup.py [runs]
+# 每次测量都在新的解释器中进行; 同时检查导入时没有创建任何模型、客户端或索引
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# (name, import statement) - main_gradio builds the whole Blocks UI when imported
+TARGETS = [
+    ("gradio app", "import main_gradio"),
+    ("summarizer", "import src.summarizer.summarizer"),
+    ("mails sorter", "import src.utils.mails_sorter"),
+    ("document loader", "import src.summarizer.document_loader"),
+    ("retrieval", "import src.summarizer.retrieval"),
+    ("podcast generator", "import src.podcast_generator.podcast_generater"),
+    ("mail ingest CLI", "import src.email_fetcher.sources"),
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+from src.utils import providers
+heavy = [name for name in ("torch", "TTS", "langchain_deepseek", "langchain_ollama", "langgraph",
+                           "langchain_community", "googleapiclient.discovery") if name in sys.modules]
+print(elapsed, ",".join(providers.built()) or "-", ",".join(heavy) or "-")
+"""
+
+
+def measure(statement, runs):
+    env = dict(os.environ)
+    # a module that asks for the API key at import would block here instead of timing out
+    env.pop("DEEPSEEK_API_KEY", None)
+    times, built, heavy = [], "-", "-"
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement)], cwd=ROOT, env=env,
+                                stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        elapsed, built, heavy = result.stdout.strip().splitlines()[-1].split(" ")
+        times.append(float(elapsed))
+    return times, (built, heavy)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'target':<20}{'median':>9}{'max':>9}  built at import / heavy modules loaded")
+    for name, statement in TARGETS:
+        times, info = measure(statement, runs)
+        if times is None:
+            print(f"{name:<20}  skipped: {info}")
+            continue
+        built, heavy = info
+        print(f"{name:<20}{statistics.median(times):8.3f}s{max(times):8.3f}s  {built} / {heavy}")
+
+
+if __name__ == "__main__":
+    main()
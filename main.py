@@ -1,7 +1,7 @@
 import os
 from time import sleep
 from src.email_fetcher.email_fetcher_api import gmail_fetch
-from src.summarizer.summarizer import run_summarizer, save_script
+from src.summarizer.summarizer import run_summarizer
 from src.podcast_generator.podcast_generater import gen_podcast
 
 
@@ -12,15 +12,15 @@ def main():
     query = '("job alert" OR "medium" OR "联合早报" OR "eCHO") newer_than:3d'
     print("Starting email fetching...")
     # Step 1: Fetch emails
-    gmail_fetch(user_id, query)
+    # 只获取元数据, 正文在生成文稿时按需下载
+    gmail_fetch(user_id, query, lazy_bodies=True)
     
     print("Emails fetched successfully!")
     
     print("\nStarting summarization...")
     # Step 2: Generate podcast script
     topic = "news, tech blogs, Job alerts"
-    script = run_summarizer(topic)
-    save_script(script)
+    run_summarizer(topic)  # 同时写入 podcast_script.txt
     print("Podcast script generated successfully!")
     
     # Step 3: Generate audio
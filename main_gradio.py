@@ -1,8 +1,10 @@
 import os
 from time import sleep
-from typing import Tuple, Optional, Dict, List
+from typing import Tuple, Optional, Dict, List, Iterator
 from src.email_fetcher.email_fetcher_api import gmail_fetch, fetcher_temp_path
-from src.summarizer.summarizer import run_summarizer, save_script
+from src.email_fetcher.sync_state import reset_sync_state
+from src.utils.mail_store import get_store
+from src.summarizer.summarizer import run_summarizer, stream_summarizer, script_path as default_script_path
 from src.podcast_generator.podcast_generater import gen_podcast
 from src.utils.mails_sorter import MailSorter
 import gradio as gr
@@ -52,8 +54,7 @@ def main():
     print("\nStarting summarization...")
     # Step 2: Generate podcast script
     topic = "news, tech blogs, Job alerts"
-    script = run_summarizer(topic)
-    save_script(script)
+    run_summarizer(topic)  # 同时写入 podcast_script.txt
     print("Podcast script generated successfully!")
     
     # Step 3: Generate audio
@@ -70,10 +71,12 @@ def main():
 def run_pipeline(user_id_input: str, query_input: str, topic_input: str):
     """Simplified version with minimal type hints to avoid Pydantic schema issues"""
     status_messages = []
+    classification_result, classification_stats = None, None
 
     try:
         status_messages.append("Starting email fetching...")
-        gmail_fetch(user_id_input, query_input)
+        # 只获取元数据, 分类后生成文稿时再下载正文
+        gmail_fetch(user_id_input, query_input, lazy_bodies=True)
         status_messages.append("Emails fetched successfully!")
 
         # 添加邮件分类步骤
@@ -82,34 +85,20 @@ def run_pipeline(user_id_input: str, query_input: str, topic_input: str):
         status_messages.append("Email classification completed!")
         status_messages.append("\n分类结果：")
         status_messages.append(classification_result)
+        yield "\n".join(status_messages), None, None, classification_result, classification_stats
 
         status_messages.append("\nStarting summarization...")
-        script = run_summarizer(topic_input)
-        returned_path = save_script(script)
-        script_path = None
-        script_content = script  # 保存脚本内容
-        
-        # 处理脚本文件路径
-        if isinstance(returned_path, str) and os.path.exists(returned_path):
-            script_path = returned_path
-            # 读取保存的文件内容
-            with open(script_path, 'r', encoding='utf-8') as f:
-                script_content = f.read()
-        else:
-            potential_script_path = os.path.join("temp", "podcast_script.txt")
-            if os.path.exists(potential_script_path):
-                script_path = potential_script_path
-                # 读取保存的文件内容
-                with open(script_path, 'r', encoding='utf-8') as f:
-                    script_content = f.read()
-            else:
-                # 如果找不到文件，尝试直接保存脚本内容
-                script_path = os.path.join("temp", "podcast_script.txt")
-                os.makedirs(os.path.dirname(script_path), exist_ok=True)
-                with open(script_path, "w", encoding="utf-8") as f:
-                    f.write(script)
+        # 文稿边生成边显示, 同时逐行写入 podcast_script.txt
+        script_content = ""
+        for line in stream_summarizer(topic_input):
+            script_content += line
+            yield "\n".join(status_messages), None, script_content, classification_result, classification_stats
+        if not script_content:
+            raise RuntimeError("No email content found to summarize!")
+        script_path = default_script_path
         
         status_messages.append(f"Podcast script generated and saved to {script_path}!")
+        yield "\n".join(status_messages), None, script_content, classification_result, classification_stats
 
         status_messages.append("\nStarting audio generation...")
         gen_podcast()
@@ -136,12 +125,12 @@ def run_pipeline(user_id_input: str, query_input: str, topic_input: str):
         result = "\n".join(status_messages)
         
         # 返回所有需要的值：状态、音频、脚本内容、分类结果、分类统计
-        return result, output_audio_path, script_content, classification_result, classification_stats
+        yield result, output_audio_path, script_content, classification_result, classification_stats
             
     except Exception as e:
         error_msg = f"Error during processing: {str(e)}"
         print(error_msg)  # 打印错误信息以便调试
-        return error_msg, None, None, None, None
+        yield error_msg, None, None, None, None
 
 def fetch_emails_step(user_id_input: str, query_input: str) -> str:
     """单步执行：获取邮件"""
@@ -151,14 +140,19 @@ def fetch_emails_step(user_id_input: str, query_input: str) -> str:
     except Exception as e:
         return f"邮件获取失败：{str(e)}"
 
-def generate_script_step(topic_input: str) -> Tuple[str, str]:
-    """单步执行：生成文稿"""
+def generate_script_step(topic_input: str) -> Iterator[Tuple[str, str]]:
+    """单步执行：生成文稿, 逐行显示生成的内容"""
+    script = ""
     try:
-        script = run_summarizer(topic_input)
-        script_path = save_script(script)
-        return "文稿生成成功！", script
+        for line in stream_summarizer(topic_input):
+            script += line
+            yield "文稿生成中...", script
+        if not script:
+            yield "文稿生成失败：没有可总结的邮件", ""
+            return
+        yield "文稿生成成功！", script
     except Exception as e:
-        return f"文稿生成失败：{str(e)}", ""
+        yield f"文稿生成失败：{str(e)}", script
 
 def generate_audio_step() -> Tuple[str, str]:
     """单步执行：生成播客音频"""
@@ -185,8 +179,8 @@ def delete_local_emails() -> str:
     """删除本地下载的邮件"""
     try:
         if os.path.exists(fetcher_temp_path):
-            shutil.rmtree(fetcher_temp_path)
-            os.makedirs(fetcher_temp_path)  # 重新创建空目录
+            get_store(fetcher_temp_path).clear()  # 清空邮件库及其索引
+            reset_sync_state()  # 下次获取时重新全量同步
             return "成功删除本地邮件！"
         return "没有找到本地邮件目录。"
     except Exception as e:
@@ -8,16 +8,15 @@ import os.path
 from pyexpat.errors import messages
 from time import process_time_ns
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+# the google auth and discovery clients are imported when the service is built
 from googleapiclient.errors import HttpError
 
-from google.oauth2 import service_account
-
 # for encoding/decoding messages in base64
 import base64
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # for dealing with attachement MIME types
 from email.mime.text import MIMEText
@@ -27,6 +26,9 @@ from email.mime.audio import MIMEAudio
 from email.mime.base import MIMEBase
 from mimetypes import guess_type as guess_mime_type
 
+from ..utils.mail_store import get_store
+from .rate_limit import TokenBucket, FetchStats, execute_with_retry, is_retryable, QUOTA_COST, QUOTA_UNITS_PER_SECOND
+
 
 # Get the current file's directory path
 current_dir = os.path.dirname(__file__)
@@ -47,10 +49,29 @@ fetcher_temp_path = os.path.join(temp_path, "mails")
 # SCOPE 
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
+# First fetch tier: headers only, restricted to the fields the catalog needs.
+# Bodies and attachments are fetched later for the selected messages only.
+METADATA_HEADERS = ["From", "To", "Subject", "Date"]
+METADATA_FIELDS = "id,threadId,internalDate,snippet,sizeEstimate,payload/headers"
 
+# Attachments larger than this are not downloaded
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024
 
+# Size of the base64 chunks decoded while writing an attachment to disk
+DECODE_CHUNK_SIZE = 1024 * 1024
+
+# Number of requests per Gmail batch request. Gmail accepts up to 100 but
+# recommends no more than 50 to avoid rate limiting.
+BATCH_SIZE = 50
+
+
+
+
+def get_credentials():
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
 
-def authenticate():
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, SCOPES)
@@ -65,10 +86,20 @@ def authenticate():
     # Save the credentials for the next run
         with open(token_path, "w") as token:
             token.write(creds.to_json())
+    return creds
+
+
+def build_service(creds):
+    from googleapiclient.discovery import build
+
     return build(
         "gmail", "v1", credentials=creds
         )
 
+
+def authenticate():
+    return build_service(get_credentials())
+
 # NOTE For query, we can use Gmail search operators like from:, subject:, and more. See https://support.google.com/mail/answer/7190 for for imformation.  
 def search_messages(service, user_id, query):
     # Use the Gmail API to search for messages
@@ -105,15 +136,22 @@ def get_size_format(b, factor=1024, suffix="B"):
     return f"{b:.2f}Y{suffix}"
 
 def clean(text):
-    # clean text for creating a folder
+    # clean text for creating a file name
     return "".join(c if c.isalnum() else "_" for c in text)
 
 
 
-def parse_parts(service, user_id, parts, folder_name, message):
+def parse_parts(service, user_id, parts, mail_name, message, attachment_requests=None,
+                max_attachment_size=MAX_ATTACHMENT_SIZE):
     """
-    Parse the conntent of an email partition
+    Parse the conntent of an email partition and write it to the mail store
+
+    If `attachment_requests` is a list, attachments are not downloaded here:
+    (attachment_id, message_id, filename) tuples are appended to it so that
+    the caller can fetch them later in a batch. Attachments larger than
+    `max_attachment_size` are skipped.
     """
+    store = get_store(fetcher_temp_path)
     if not parts:
         return print("No parts found in message")
     else:
@@ -127,20 +165,21 @@ def parse_parts(service, user_id, parts, folder_name, message):
             if part.get("parts"):
                 # recursively call this function when we see that a part
                 # has parts inside
-                parse_parts(service, user_id, part.get("parts"), folder_name, message)
+                parse_parts(service, user_id, part.get("parts"), mail_name, message, attachment_requests,
+                            max_attachment_size)
             if mimeType == "text/plain":
-                if data:
-                    text = base64.urlsafe_b64decode(data).decode()
-                    print(text)
+                if data and not filename:
+                    # keep the plain alternative next to the html, loaders use it
+                    # instead of parsing the html when it is complete
+                    filepath = store.write_file(message["id"], mail_name + ".txt", base64.urlsafe_b64decode(data))
+                    print("Saving text to", filepath)
             elif mimeType == "text/html":
                 if not filename:
                     # creat dir for every html
                     # filename = "index.html"
-                    filename = folder_name + ".html"
-                    filepath = os.path.join(fetcher_temp_path, folder_name, filename)
+                    filename = mail_name + ".html"
+                    filepath = store.write_file(message["id"], filename, base64.urlsafe_b64decode(data))
                     print("Saving HTML to", filepath)
-                    with open(filepath, "wb+") as f:
-                        f.write(base64.urlsafe_b64decode(data))
             else:
                 for part_header in part_headers:
                     part_header_name = part_header.get("name")
@@ -150,29 +189,80 @@ def parse_parts(service, user_id, parts, folder_name, message):
                             # we got an attachment
                             print("Attachment:", filename)
                             print("Attachment Size:", get_size_format(size))
+                            if max_attachment_size is not None and size > max_attachment_size:
+                                print(f"Skipping attachment larger than {get_size_format(max_attachment_size)}")
+                                continue
                             attachment_id = body.get("attachmentId")
+                            if attachment_requests is not None:
+                                attachment_requests.append((attachment_id, message["id"], filename))
+                                continue
                             attachment = service.users() \
                             .messages() \
                             .attachments() \
                             .get(id = attachment_id, userId = user_id, messageId = message["id"]) \
                             .execute()
-                            data = attachment.get("data")
-                            filepath = os.path.join(fetcher_temp_path, folder_name, filename)
-                            if data:
-                                with open(filepath, "wb") as f:
-                                    f.write(base64.urlsafe_b64decode(data))
+                            save_attachment(attachment, message["id"], filename)
+
+
+def iter_decoded(data, chunk_size=DECODE_CHUNK_SIZE):
+    """Decode urlsafe base64 data chunk by chunk"""
+    chunk_size -= chunk_size % 4
+    for start in range(0, len(data), chunk_size):
+        yield base64.urlsafe_b64decode(data[start:start + chunk_size])
 
 
-def read_message(service, user_id, msg_id):
+def save_attachment(attachment, msg_id, filename):
+    """
+    Stream the data of an attachments().get() response to the mail store
+    """
+    data = attachment.get("data")
+    if data:
+        get_store(fetcher_temp_path).write_chunks(msg_id, filename, iter_decoded(data))
+
+
+def find_body_data(parts, mime_type="text/html"):
+    """base64 data of the first inline part of `mime_type`, searched recursively"""
+    for part in parts or []:
+        data = part.get("body", {}).get("data")
+        if part.get("mimeType") == mime_type and data and not part.get("filename"):
+            return data
+        data = find_body_data(part.get("parts"), mime_type)
+        if data:
+            return data
+    return None
+
+
+def get_message_request(service, user_id, msg_id, metadata_only=False):
+    """
+    messages().get request of the first (metadata) or second (full) tier
+    """
+    messages = service.users().messages()
+    if metadata_only:
+        return messages.get(userId=user_id, id=msg_id, format="metadata",
+                            metadataHeaders=METADATA_HEADERS, fields=METADATA_FIELDS)
+    return messages.get(userId=user_id, id=msg_id, format="full")
+
+
+def read_message(service, user_id, msg_id, **save_options):
     """
     Get a message from its id
     """
-    message = service.users().messages().get(userId=user_id, id=msg_id['id'], format="full").execute()
+    message = get_message_request(service, user_id, msg_id['id'], save_options.get("metadata_only")).execute()
+    return save_message(service, user_id, message, **save_options)
+
+
+def save_message(service, user_id, message, attachment_requests=None, metadata_only=False,
+                 max_attachment_size=MAX_ATTACHMENT_SIZE):
+    """
+    Save a message to the mail store, returns the directory it was saved to
+    relative to temp/mails. With `metadata_only` the message was fetched
+    with format="metadata": only the catalog entry is written and its body
+    is marked as pending (see fetch_bodies).
+    """
     payload = message["payload"]
     headers = payload.get("headers")
     parts = payload.get("parts")
-    folder_name = "INBOX"
-    is_subjected = False
+    subject, sender, date = "", "", ""
     if headers:
         for header in headers:
             name = header.get("name")
@@ -180,6 +270,7 @@ def read_message(service, user_id, msg_id):
             
             if name.lower() == "from":
                 # From somewhere
+                sender = value
                 print("From:", value)
             
             if name.lower() == "to":
@@ -188,40 +279,313 @@ def read_message(service, user_id, msg_id):
             
             if name.lower() == "subject":
                 # The subject
-                is_subjected = True
-                folder_name = clean(value)
-                folder_counter = 0
-                while os.path.isdir(os.path.join(fetcher_temp_path, folder_name)):
-                    folder_counter += 1
-                    
-                    if folder_name[-1].isdigit() and folder_name[-2] == "_":
-                        folder_name = f"{folder_name[:-2]}_{folder_counter}"
-                    
-                    elif folder_name[-2:].isdigit() and folder_name[-3] == "_":
-                        folder_name = f"{folder_name[:-3]}_{folder_counter}"
-                    
-                    else:
-                        folder_name = f"{folder_name}_{folder_counter}"
-
-                os.mkdir(os.path.join(fetcher_temp_path, folder_name))
+                subject = value
                 print("Subject:", value)
                 
             if name.lower() == "date":
                 # The date when the message was sent
+                date = value
                 print("Date:", value)
 
-    if not is_subjected:
-        if not os.path.isdir(os.path.join(fetcher_temp_path, folder_name)):
-            os.mkdir(os.path.join(fetcher_temp_path, folder_name))
-
-    parse_parts(service, user_id, parts, folder_name, message)
+    # the html file keeps the subject-derived name, the folder is keyed by message id
+    mail_name = clean(subject) if subject else "INBOX"
+    store = get_store(fetcher_temp_path)
+    key = None
+    if metadata_only:
+        existing = store.get(message["id"])
+        if existing and existing["body_status"] == "fetched":
+            # the body is already on disk, keep its hash and dedup key
+            print("="*55)
+            return existing["dir"]
+    else:
+        # check the dedup index before writing anything
+        body_data = find_body_data(parts) or find_body_data(parts, "text/plain")
+        key = content_key(base64.urlsafe_b64decode(body_data)) if body_data else None
+        duplicate_of = find_duplicate_of(store, key)
+        if duplicate_of and duplicate_of != message["id"]:
+            print(f"Skipping duplicate of {duplicate_of}: {subject}")
+            if message["id"] in store:
+                # only the metadata was saved (lazy_bodies), drop it like any other duplicate
+                store.remove(message["id"])
+            print("="*55)
+            return store.get(duplicate_of)["dir"]
+        parse_parts(service, user_id, parts, mail_name, message, attachment_requests, max_attachment_size)
+    internal_date = message.get("internalDate")
+    entry = store.add(
+        message["id"], subject=subject, sender=sender, date=date, name=mail_name,
+        thread_id=message.get("threadId"),
+        timestamp=int(internal_date) // 1000 if internal_date else None,
+        body_status="pending" if metadata_only else "fetched",
+        snippet=message.get("snippet"),
+        size_estimate=message.get("sizeEstimate"),
+        content_key=key,
+        user_id=user_id,
+    )
     print("="*55)
+    return entry["dir"]
+
+
+def execute_in_batches(service, requests, callback, batch_size=BATCH_SIZE, max_retries=5,
+                       base_delay=0.5, max_delay=32.0):
+    """
+    Send (request_id, HttpRequest) pairs as Gmail batch requests of
+    `batch_size` items. `callback(request_id, response, exception)` is
+    called once per item, so one failing item does not abort the batch.
+    Items throttled inside a batch (429, 5xx, rateLimitExceeded) are sent
+    again in a later batch with exponential backoff, up to `max_retries`
+    times, before their error is passed to the callback.
+    """
+    pending = list(requests)
+    for attempt in range(max_retries + 1):
+        requests_by_id = dict(pending)
+        throttled = []
+
+        def on_item(request_id, response, exception):
+            if exception is not None and attempt < max_retries and is_retryable(exception):
+                throttled.append((request_id, requests_by_id[request_id]))
+                return
+            callback(request_id, response, exception)
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=on_item)
+            for request_id, request in pending[start:start + batch_size]:
+                batch.add(request, request_id=request_id)
+            batch.execute()
+        if not throttled:
+            return
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        print(f"{len(throttled)} batched requests throttled, retrying in {delay:.2f}s...")
+        time.sleep(delay)
+        pending = throttled
+
+
+def read_messages_batched(service, user_id, msg_ids, batch_size=BATCH_SIZE, **save_options):
+    """
+    Batched version of read_message: message gets and attachment gets are
+    sent in Gmail batch requests. Returns ({message_id: folder_name},
+    {message_id: error}) for the saved and the failed items.
+    """
+    saved = {}
+    errors = {}
+    attachment_requests = []
+
+    def on_message(request_id, response, exception):
+        msg_id = msg_ids[int(request_id)]["id"]
+        if exception is not None:
+            print(f"An error occurred while fetching message {msg_id}: {exception}")
+            errors[msg_id] = exception
+            return
+        try:
+            saved[msg_id] = save_message(service, user_id, response, attachment_requests, **save_options)
+        except Exception as e:
+            print(f"An error occurred while saving message {msg_id}: {e}")
+            errors[msg_id] = e
+
+    message_requests = [
+        (str(i), get_message_request(service, user_id, msg_id["id"], save_options.get("metadata_only")))
+        for i, msg_id in enumerate(msg_ids)
+    ]
+    execute_in_batches(service, message_requests, on_message, batch_size)
+
+    def on_attachment(request_id, response, exception):
+        attachment_id, msg_id, filename = attachment_requests[int(request_id)]
+        if exception is not None:
+            print(f"An error occurred while fetching attachment {filename}: {exception}")
+            errors[msg_id] = exception
+            return
+        try:
+            save_attachment(response, msg_id, filename)
+        except (IOError, OSError) as e:
+            print(f"An error occurred while saving attachment {filename}: {e}")
+            errors[msg_id] = e
+
+    attachment_gets = [
+        (str(i), service.users().messages().attachments().get(id=attachment_id, userId=user_id, messageId=msg_id))
+        for i, (attachment_id, msg_id, _) in enumerate(attachment_requests)
+    ]
+    execute_in_batches(service, attachment_gets, on_attachment, batch_size)
+
+    print(f"Fetched {len(msg_ids) - len(errors)}/{len(msg_ids)} messages "
+          f"and {len(attachment_requests)} attachments in batches of {batch_size}.")
+    return saved, errors
+
+
+def read_messages_concurrently(service_factory, user_id, msg_ids, workers=8,
+                               quota_units=QUOTA_UNITS_PER_SECOND, max_retries=5, **save_options):
+    """
+    Fetch and save messages with a pool of `workers` threads.
+
+    Every thread builds its own service with `service_factory()` (httplib2
+    is not thread-safe). All threads share a token bucket of `quota_units`
+    per second, and throttled requests are retried with backoff, so a
+    failing message is skipped instead of aborting the fetch. Returns
+    {message_id: folder_name} for the saved messages.
+    """
+    bucket = TokenBucket(rate=quota_units)
+    stats = FetchStats()
+    local = threading.local()
+
+    def fetch(msg_id):
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        service = local.service
+        try:
+            message = execute_with_retry(
+                get_message_request(service, user_id, msg_id["id"], save_options.get("metadata_only")),
+                bucket, QUOTA_COST["messages.get"], stats, max_retries)
+            attachment_requests = []
+            folder_name = save_message(service, user_id, message, attachment_requests, **save_options)
+            for attachment_id, message_id, filename in attachment_requests:
+                attachment = execute_with_retry(
+                    service.users().messages().attachments().get(id=attachment_id, userId=user_id, messageId=message_id),
+                    bucket, QUOTA_COST["messages.attachments.get"], stats, max_retries)
+                save_attachment(attachment, message_id, filename)
+            return msg_id["id"], folder_name
+        except Exception as e:
+            print(f"An error occurred while fetching message {msg_id['id']}: {e}")
+            stats.add(failures=1)
+            return msg_id["id"], None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fetch, msg_ids))
+
+    saved = {msg_id: folder_name for msg_id, folder_name in results if folder_name is not None}
+    stats.report(len(saved))
+    return saved
+
+
+def read_messages(service, user_id, msg_ids, batch_size=BATCH_SIZE, workers=None,
+                  quota_units=QUOTA_UNITS_PER_SECOND, service_factory=None, **save_options):
+    """
+    Fetch and save messages: with a worker pool if `workers` is set,
+    otherwise batched unless batch_size is None. The workers build their
+    services with `service_factory`; without one, `service` cannot be
+    shared by several threads and the messages are fetched serially.
+    `save_options` are passed to save_message (metadata_only,
+    max_attachment_size). Returns {message_id: folder_name} for the saved
+    messages.
+    """
+    if workers and workers > 1 and service_factory is None:
+        print("No service factory for the workers, fetching with the given service only.")
+        workers = None
+    if workers:
+        return read_messages_concurrently(service_factory or (lambda: service), user_id, msg_ids,
+                                          workers, quota_units, **save_options)
+    if batch_size:
+        saved, _ = read_messages_batched(service, user_id, msg_ids, batch_size, **save_options)
+        return saved
+    return {msg_id["id"]: read_message(service, user_id, msg_id, **save_options) for msg_id in msg_ids}
+
+
+def list_history(service, user_id, start_history_id):
+    """
+    List the ids of the messages added and deleted since `start_history_id`.
+    Raises HttpError 404 when the history is too old to be listed.
+    """
+    added, deleted = set(), set()
+    page_token = None
+    while True:
+        result = service.users().history().list(
+            userId=user_id,
+            startHistoryId=start_history_id,
+            historyTypes=["messageAdded", "messageDeleted"],
+            pageToken=page_token,
+        ).execute()
+        for record in result.get("history", []):
+            for item in record.get("messagesAdded", []):
+                added.add(item["message"]["id"])
+            for item in record.get("messagesDeleted", []):
+                deleted.add(item["message"]["id"])
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return added - deleted, deleted
+
+
+def remove_local_message(msg_id):
+    store = get_store(fetcher_temp_path)
+    if msg_id in store:
+        print(f"Removing deleted mail: {store.get(msg_id)['name']}")
+        store.remove(msg_id)
+
+
+def sync_messages(service, user_id, query, batch_size=BATCH_SIZE, **fetch_options):
+    """
+    Incrementally fetch the messages matching `query`.
+
+    The Gmail history since the last run tells whether anything was added or
+    deleted; if nothing was added the search is skipped entirely. Messages
+    that were already downloaded are never fetched again, messages that
+    failed to download are kept in the sync state and fetched again on the
+    next run. A full query is used on the first run, when the query changed
+    or when the stored historyId is too old. Returns the number of newly
+    saved messages.
+    """
+    state = load_sync_state(user_id)
+    if state["query"] != query or not len(get_store(fetcher_temp_path)):
+        # the stored state belongs to another query or the mails were deleted
+        state = empty_sync_state()
+    seen = state["messages"]
+    failed = [msg_id for msg_id in state["failed"] if msg_id not in seen]
+
+    # record the history id before listing so that nothing is missed
+    history_id = service.users().getProfile(userId=user_id).execute()["historyId"]
+
+    added = None
+    if state["history_id"]:
+        try:
+            added, deleted = list_history(service, user_id, state["history_id"])
+            print(f"History since {state['history_id']}: {len(added)} added, {len(deleted)} deleted.")
+            for msg_id in deleted:
+                if seen.pop(msg_id, None) is not None:
+                    remove_local_message(msg_id)
+            failed = [msg_id for msg_id in failed if msg_id not in deleted]
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            print("Stored historyId is too old, falling back to a full query.")
+
+    to_fetch = []
+    if added is None or added - seen.keys():
+        results = search_messages(service, user_id, query)
+        to_fetch = [m for m in results if m["id"] not in seen]
+        print(f"Found {len(results)} results, {len(to_fetch)} new.")
+    if added is not None:
+        # a full query already lists the failed messages that still match
+        listed = {m["id"] for m in to_fetch}
+        to_fetch += [{"id": msg_id} for msg_id in failed if msg_id not in listed]
+
+    saved = read_messages(service, user_id, to_fetch, batch_size, **fetch_options)
+    seen.update(saved)
+    failed = [m["id"] for m in to_fetch if m["id"] not in saved]
+    if failed:
+        print(f"{len(failed)} messages could not be fetched, they are retried on the next sync.")
+    state.update(history_id=history_id, query=query, messages=seen, failed=failed)
+    save_sync_state(user_id, state)
+    return len(saved)
 
 
 # TODO 
-from ..utils.clean_duplicate_mails import delete_duplicate_mails
+from ..utils.clean_duplicate_mails import delete_duplicate_mails, content_key, find_duplicate_of
+from .sync_state import load_sync_state, save_sync_state, empty_sync_state
 
-def gmail_fetch(user_id, query, service=None):
+def gmail_fetch(user_id, query, service=None, batch_size=BATCH_SIZE, incremental=True,
+                workers=None, quota_units=QUOTA_UNITS_PER_SECOND, lazy_bodies=False,
+                max_attachment_size=MAX_ATTACHMENT_SIZE, service_factory=None):
+    """
+    Fetch the messages matching `query` into temp/mails.
+
+    Messages are fetched in Gmail batch requests of `batch_size` items,
+    pass batch_size=None to fetch them one by one. With `incremental`, only
+    messages that were not downloaded by a previous run are fetched (see
+    sync_messages). With `workers`, messages are fetched by a thread pool
+    limited to `quota_units` per second instead (see
+    read_messages_concurrently). With `lazy_bodies` only the metadata is
+    fetched, bodies and attachments are fetched by fetch_bodies once the
+    messages are selected. `service` can be any object with the Gmail API
+    interface, e.g. fake_service.FakeGmailService; the workers build their
+    own with `service_factory`, by default from the stored credentials when
+    no service is given.
+    """
     # TODO for multiple users
 
     # TEST 
@@ -232,7 +596,11 @@ def gmail_fetch(user_id, query, service=None):
 
     try:
         if service is None:
-            service = authenticate()
+            creds = get_credentials()
+            service = build_service(creds)
+            service_factory = service_factory or (lambda: build_service(creds))
+        fetch_options = dict(workers=workers, quota_units=quota_units, service_factory=service_factory,
+                             metadata_only=lazy_bodies, max_attachment_size=max_attachment_size)
 
         # # Call the Gmail API
         # results = service.users().labels().list(userId = user_id).execute()
@@ -244,13 +612,15 @@ def gmail_fetch(user_id, query, service=None):
         # for label in labels:
         #     print(label["name"])
 
-        results = search_messages(service, user_id, query)
-        print(f"Found {len(results)} results.")
-
-        for message in results:
-            read_message(service, user_id, message)
+        if incremental:
+            fetched = sync_messages(service, user_id, query, batch_size, **fetch_options)
+        else:
+            results = search_messages(service, user_id, query)
+            print(f"Found {len(results)} results.")
+            fetched = len(read_messages(service, user_id, results, batch_size, **fetch_options))
 
-        delete_duplicate_mails(fetcher_temp_path)
+        if fetched:
+            delete_duplicate_mails(fetcher_temp_path)
 
 
     except HttpError as error:
@@ -258,6 +628,49 @@ def gmail_fetch(user_id, query, service=None):
         print(f"An error occurred: {error}")
 
 
+def fetch_bodies(user_id, msg_ids, service=None, batch_size=BATCH_SIZE,
+                 max_attachment_size=MAX_ATTACHMENT_SIZE):
+    """
+    Second fetch tier: download the bodies and attachments of messages that
+    were fetched with lazy_bodies. Returns {message_id: folder_name}.
+    """
+    if not msg_ids:
+        return {}
+    try:
+        if service is None:
+            service = authenticate()
+        print(f"Fetching bodies of {len(msg_ids)} messages...")
+        return read_messages(service, user_id, [{"id": msg_id} for msg_id in msg_ids], batch_size,
+                             max_attachment_size=max_attachment_size)
+    except HttpError as error:
+        print(f"An error occurred: {error}")
+        return {}
+
+
+def fetch_pending_bodies(store, entries, user_id="me", service=None):
+    """
+    Make sure the selected catalog entries have their body on disk,
+    returns the refreshed entries without the ones whose body turned out
+    to be a duplicate of another message. Bodies are fetched from the account
+    recorded with each entry, `user_id` is used for entries saved before
+    the account was recorded.
+    """
+    pending = {}
+    for entry in entries:
+        if entry.get("body_status") == "pending":
+            pending.setdefault(entry.get("user_id") or user_id, []).append(entry["id"])
+    if not pending:
+        return entries
+    for account, msg_ids in pending.items():
+        fetch_bodies(account, msg_ids, service)
+    refreshed = []
+    for entry in entries:
+        if entry.get("body_status") != "pending":
+            refreshed.append(entry)
+        elif entry["id"] in store:
+            refreshed.append(store.get(entry["id"]))
+    return refreshed
+
 
 if __name__ == "__main__":
     gmail_fetch(user_id="me", query='("job alert" OR "medium" OR "联合早报" OR "eCHO") newer_than:3d')
\ No newline at end of file
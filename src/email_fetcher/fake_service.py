@@ -0,0 +1,238 @@
+# In-memory stand-in for the Gmail API service returned by authenticate()
+# 用于离线测试和基准测试的假 Gmail service, 可通过 gmail_fetch(service=...) 注入
+
+import base64
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def _b64(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def make_fake_message(msg_id, subject, html, plain=None, sender="newsletter@example.com",
+                      date="Mon, 1 Jan 2024 08:00:00 +0000", attachments=None):
+    """
+    Build a message resource like messages().get(format="full") returns.
+    `attachments` is a list of (filename, bytes).
+    """
+    parts = []
+    if plain is not None:
+        parts.append({"mimeType": "text/plain", "filename": "", "headers": [],
+                      "body": {"size": len(plain), "data": _b64(plain)}})
+    parts.append({"mimeType": "text/html", "filename": "", "headers": [],
+                  "body": {"size": len(html), "data": _b64(html)}})
+    for i, (filename, data) in enumerate(attachments or []):
+        parts.append({
+            "mimeType": "application/octet-stream",
+            "filename": filename,
+            "headers": [{"name": "Content-Disposition", "value": f'attachment; filename="{filename}"'}],
+            "body": {"size": len(data), "attachmentId": f"{msg_id}-att{i}", "_data": _b64(data)},
+        })
+    return {
+        "id": msg_id,
+        "threadId": msg_id,
+        "internalDate": "1704096000000",
+        "snippet": (plain or html)[:100],
+        "sizeEstimate": len(html) + len(plain or "") + sum(len(data) for _, data in attachments or []),
+        "payload": {
+            "mimeType": "multipart/mixed",
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "To", "value": "me@example.com"},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": date},
+            ],
+            "parts": parts,
+        },
+    }
+
+
+def make_fake_mailbox(n, attachment_every=0):
+    """Build n newsletter-like messages, every `attachment_every`-th with an attachment"""
+    messages = []
+    for i in range(n):
+        attachments = None
+        if attachment_every and i % attachment_every == 0:
+            attachments = [(f"report_{i}.pdf", b"%PDF-1.4 fake" * 64)]
+        messages.append(make_fake_message(
+            msg_id=f"{i:016x}",
+            subject=f"Job alert {i}",
+            html=f"<html><body><h1>Job alert {i}</h1><p>Software engineer #{i}</p></body></html>",
+            plain=f"Job alert {i}\nSoftware engineer #{i}",
+            attachments=attachments,
+        ))
+    return messages
+
+
+class FakeRequest:
+    """Lazy request object, the counterpart of googleapiclient's HttpRequest"""
+
+    def __init__(self, service, func, *args):
+        self.service = service
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        self.service.round_trips += 1
+        self.service.wait()
+        return self.func(*self.args)
+
+
+class FakeBatch:
+    """Counterpart of googleapiclient's BatchHttpRequest"""
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        self.service.round_trips += 1
+        self.service.batches += 1
+        self.service.wait()
+        for request_id, request, callback in self.requests:
+            response, exception = None, None
+            try:
+                response = request.func(*request.args)
+            except HttpError as e:
+                exception = e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeGmailService:
+    """
+    Minimal Gmail service: users().messages().list/get,
+    users().messages().attachments().get, users().history().list,
+    users().getProfile() and new_batch_http_request().
+
+    `latency` is added to every HTTP round trip (a batch counts as one) and
+    `fail_ids` are message ids whose get returns a 500 error and
+    `throttle_ids` are message ids whose first get returns a 429. History
+    records older than `history_limit` changes are expired, like Gmail does.
+    """
+
+    def __init__(self, messages=(), latency=0.0, page_size=100, fail_ids=(), throttle_ids=(),
+                 history_limit=1000):
+        self.messages_by_id = {m["id"]: m for m in messages}
+        self.latency = latency
+        self.page_size = page_size
+        self.fail_ids = set(fail_ids)
+        self.throttle_ids = set(throttle_ids)
+        self.history_limit = history_limit
+        # [(history_id, "messagesAdded" | "messagesDeleted", message_id)]
+        self.history = []
+        self.history_id = 1
+        self.round_trips = 0
+        self.batches = 0
+        self.calls = 0
+
+    def add_message(self, message):
+        self.messages_by_id[message["id"]] = message
+        self._record("messagesAdded", message["id"])
+
+    def delete_message(self, msg_id):
+        self.messages_by_id.pop(msg_id, None)
+        self._record("messagesDeleted", msg_id)
+
+    def _record(self, kind, msg_id):
+        self.history_id += 1
+        self.history.append((self.history_id, kind, msg_id))
+        del self.history[:-self.history_limit]
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _error(self, status, reason):
+        return HttpError(httplib2.Response({"status": str(status), "reason": reason}), reason.encode())
+
+    # API surface
+    def users(self):
+        return _Resource(messages=self._messages, history=self._history, getProfile=self._get_profile)
+
+    def _history(self):
+        return _Resource(list=self._list_history)
+
+    def _messages(self):
+        return _Resource(list=self._list, get=self._get, attachments=self._attachments)
+
+    def _attachments(self):
+        return _Resource(get=self._get_attachment)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    # handlers
+    def _list(self, userId, q=None, pageToken=None, **kwargs):
+        return FakeRequest(self, self._do_list, pageToken)
+
+    def _do_list(self, page_token):
+        self.calls += 1
+        ids = list(self.messages_by_id)
+        start = int(page_token or 0)
+        result = {"messages": [{"id": i, "threadId": i} for i in ids[start:start + self.page_size]]}
+        if start + self.page_size < len(ids):
+            result["nextPageToken"] = str(start + self.page_size)
+        return result
+
+    def _get_profile(self, userId, **kwargs):
+        return FakeRequest(self, lambda: {"emailAddress": "me@example.com", "historyId": str(self.history_id)})
+
+    def _list_history(self, userId, startHistoryId, pageToken=None, **kwargs):
+        return FakeRequest(self, self._do_list_history, int(startHistoryId))
+
+    def _do_list_history(self, start_history_id):
+        self.calls += 1
+        oldest = self.history[0][0] if self.history else self.history_id
+        if start_history_id < oldest - 1:
+            raise self._error(404, "Not Found")
+        records = [
+            {"id": str(history_id), kind: [{"message": {"id": msg_id}}]}
+            for history_id, kind, msg_id in self.history if history_id > start_history_id
+        ]
+        return {"history": records, "historyId": str(self.history_id)}
+
+    def _get(self, userId, id, format="full", **kwargs):
+        return FakeRequest(self, self._do_get, id, format)
+
+    def _do_get(self, msg_id, format="full"):
+        self.calls += 1
+        if msg_id in self.fail_ids:
+            raise self._error(500, "Backend Error")
+        if msg_id in self.throttle_ids:
+            self.throttle_ids.discard(msg_id)
+            raise self._error(429, "Too Many Requests")
+        if msg_id not in self.messages_by_id:
+            raise self._error(404, "Not Found")
+        message = self.messages_by_id[msg_id]
+        if format == "metadata":
+            message = {**message, "payload": {"headers": message["payload"]["headers"]}}
+        return message
+
+    def _get_attachment(self, id, userId, messageId, **kwargs):
+        return FakeRequest(self, self._do_get_attachment, messageId, id)
+
+    def _do_get_attachment(self, msg_id, attachment_id):
+        self.calls += 1
+        message = self._do_get(msg_id)
+        for part in message["payload"].get("parts", []):
+            body = part.get("body", {})
+            if body.get("attachmentId") == attachment_id:
+                return {"size": body["size"], "data": body["_data"]}
+        raise self._error(404, "Not Found")
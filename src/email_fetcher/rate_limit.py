@@ -0,0 +1,100 @@
+# Quota-aware rate limiting and retries for concurrent Gmail API calls
+# 令牌桶限流 + 指数退避重试, 避免一个被限流的请求中断整个获取过程
+
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+# Gmail allows 250 quota units per user per second, see
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS_PER_SECOND = 250
+
+# Quota cost of the calls used by the fetcher
+QUOTA_COST = {
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.attachments.get": 5,
+    "history.list": 2,
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second"""
+
+    def __init__(self, rate=QUOTA_UNITS_PER_SECOND, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, returns the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class FetchStats:
+    """Counters shared by the fetch workers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.quota_units = 0
+        self.throttled_seconds = 0.0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self, messages):
+        elapsed = time.perf_counter() - self.start
+        rate = messages / elapsed if elapsed else 0.0
+        print(f"Fetched {messages} messages in {elapsed:.2f}s ({rate:.1f} msg/s): "
+              f"{self.requests} requests, {self.retries} retries, {self.failures} failures, "
+              f"{self.quota_units} quota units, {self.throttled_seconds:.2f}s waiting for quota.")
+
+
+def is_retryable(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in RETRYABLE_STATUS:
+        return True
+    # Gmail reports per-user rate limits as 403 rateLimitExceeded
+    return error.resp.status == 403 and b"rateLimitExceeded" in (error.content or b"")
+
+
+def execute_with_retry(request, bucket, cost, stats, max_retries=5, base_delay=0.5, max_delay=32.0):
+    """
+    Execute a request after taking `cost` quota units from the bucket.
+    429/5xx responses are retried with exponential backoff and full jitter.
+    """
+    for attempt in range(max_retries + 1):
+        stats.add(throttled_seconds=bucket.acquire(cost), quota_units=cost, requests=1)
+        try:
+            return request.execute()
+        except HttpError as error:
+            if attempt == max_retries or not is_retryable(error):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Request throttled ({error.resp.status}), retrying in {delay:.2f}s...")
+            stats.add(retries=1)
+            time.sleep(delay)
@@ -0,0 +1,245 @@
+# Mail sources: everything that can put mails into the mail store
+# 邮件来源接口: Gmail API 是其中一种实现, 另外支持本地的 mbox、Maildir 和 .eml 目录,
+# 用于重新处理归档邮件或对总结/TTS 阶段进行压测
+
+import argparse
+from abc import ABC, abstractmethod
+import email
+import email.policy
+import hashlib
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from .email_fetcher_api import gmail_fetch, clean, fetcher_temp_path
+from ..utils.mail_store import get_store
+from ..utils.clean_duplicate_mails import delete_duplicate_mails, content_key, find_duplicate_of
+
+
+class MailSource(ABC):
+    """Base class of the mail sources"""
+
+    @abstractmethod
+    def ingest(self, store=None):
+        """Write the mails of the source into the store, returns how many were added"""
+
+
+class GmailSource(MailSource):
+    """Live Gmail mailbox, see gmail_fetch for the options"""
+
+    def __init__(self, user_id, query, **fetch_options):
+        self.user_id = user_id
+        self.query = query
+        self.fetch_options = fetch_options
+
+    def ingest(self, store=None):
+        # gmail_fetch always writes to the store under temp/mails
+        if store is None:
+            store = get_store(fetcher_temp_path)
+        before = {entry["id"] for entry in store.entries()}
+        gmail_fetch(self.user_id, self.query, **self.fetch_options)
+        # a sync also removes the mails deleted in Gmail, count the new ids only
+        return sum(1 for entry in store.entries() if entry["id"] not in before)
+
+
+def decode_text_part(part, encoding="utf-8"):
+    """Payload of a text part, converted from the charset it was sent in"""
+    payload = part.get_payload(decode=True) or b""
+    try:
+        text = payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        # unknown charset name
+        text = payload.decode("utf-8", errors="replace")
+    return text.encode(encoding)
+
+
+def parse_raw_message(raw):
+    """
+    Decode one RFC 822 message into the files parse_parts would write (html,
+    plain text alternative and attachments). Runs in a worker
+    process, so everything returned must be picklable.
+    """
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    subject = str(message.get("Subject") or "")
+    mail_name = clean(subject) if subject else "INBOX"
+    message_id = str(message.get("Message-ID") or "").strip()
+    # local mails have no Gmail id: derive a stable one from Message-ID (or the raw bytes)
+    key = message_id.encode("utf-8") if message_id else raw
+    files = {}
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        filename = part.get_filename()
+        if part.is_attachment() and filename:
+            files[os.path.basename(filename)] = part.get_payload(decode=True) or b""
+        elif content_type == "text/html" and mail_name + ".html" not in files:
+            # the BOM overrides a <meta charset> naming the original encoding
+            files[mail_name + ".html"] = decode_text_part(part, "utf-8-sig")
+        elif content_type == "text/plain" and mail_name + ".txt" not in files:
+            files[mail_name + ".txt"] = decode_text_part(part)
+    digest = hashlib.sha256()
+    for filename in sorted(files):
+        digest.update(files[filename])
+    body = files.get(mail_name + ".html") or files.get(mail_name + ".txt")
+    return {
+        "id": "local-" + hashlib.sha1(key).hexdigest()[:16],
+        "thread_id": None,
+        "subject": subject,
+        "sender": str(message.get("From") or ""),
+        "date": str(message.get("Date") or ""),
+        "name": mail_name,
+        "files": files,
+        "body_hash": digest.hexdigest(),
+        "content_key": content_key(body) if body else None,
+    }
+
+
+def parse_raw_message_safely(raw):
+    """parse_raw_message that returns (parsed, None) or (None, error) so one bad message does not stop the pool"""
+    try:
+        return parse_raw_message(raw), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+# "From " lines in the body are escaped as ">From " (">>From " for ">From " in mboxrd)
+FROM_ESCAPE_RE = re.compile(rb"^>(>*From )", re.MULTILINE)
+
+
+def unescape_mbox_body(raw):
+    """Undo the "From " escaping of a message read from an mbox file"""
+    return FROM_ESCAPE_RE.sub(rb"\1", raw)
+
+
+def read_mapped(path):
+    """Read a file through mmap"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+class LocalMailSource(MailSource):
+    """
+    Base class of the local archive readers. Raw messages are decoded in a
+    process pool, at most `max_in_flight` messages are held in memory.
+    """
+
+    def __init__(self, path, processes=None, chunksize=64, max_in_flight=4096):
+        self.path = path
+        self.processes = processes
+        self.chunksize = chunksize
+        self.max_in_flight = max_in_flight
+
+    @abstractmethod
+    def iter_raw_messages(self):
+        """The raw RFC 822 bytes of each message of the archive"""
+
+    def iter_parsed_messages(self):
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            window = []
+            for raw in self.iter_raw_messages():
+                window.append(raw)
+                if len(window) >= self.max_in_flight:
+                    yield from executor.map(parse_raw_message_safely, window, chunksize=self.chunksize)
+                    window = []
+            if window:
+                yield from executor.map(parse_raw_message_safely, window, chunksize=self.chunksize)
+
+    def ingest(self, store=None):
+        if store is None:
+            store = get_store(fetcher_temp_path)
+        added, failed, duplicates = 0, 0, 0
+        for parsed, error in self.iter_parsed_messages():
+            if error is not None:
+                print(f"Error decoding message: {error}")
+                failed += 1
+                continue
+            if parsed["id"] in store:
+                continue
+            if find_duplicate_of(store, parsed["content_key"]):
+                duplicates += 1
+                continue
+            for filename, data in parsed["files"].items():
+                store.write_file(parsed["id"], filename, data)
+            store.add(parsed["id"], subject=parsed["subject"], sender=parsed["sender"], date=parsed["date"],
+                      name=parsed["name"], body_hash=parsed["body_hash"], content_key=parsed["content_key"])
+            added += 1
+            if added % 1000 == 0:
+                print(f"Ingested {added} messages from {self.path}")
+        print(f"Ingested {added} messages from {self.path} ({duplicates} duplicates skipped, {failed} failed)")
+        if added:
+            delete_duplicate_mails(store.root)
+        return added
+
+
+class MboxSource(LocalMailSource):
+    """Single mbox file, split on "From " lines of the memory-mapped file"""
+
+    def iter_raw_messages(self):
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:5] == b"From ":
+                    start = 0
+                else:
+                    start = mm.find(b"\nFrom ")
+                    if start == -1:
+                        return
+                    start += 1
+                while True:
+                    # skip the "From sender date" envelope line
+                    body_start = mm.find(b"\n", start) + 1
+                    if body_start == 0:
+                        return
+                    end = mm.find(b"\nFrom ", body_start)
+                    if end == -1:
+                        yield unescape_mbox_body(mm[body_start:])
+                        return
+                    yield unescape_mbox_body(mm[body_start:end + 1])
+                    start = end + 1
+
+
+class MaildirSource(LocalMailSource):
+    """Maildir folder, reads the messages in cur/ and new/"""
+
+    def iter_raw_messages(self):
+        for sub_dir in ("cur", "new"):
+            folder = os.path.join(self.path, sub_dir)
+            if not os.path.isdir(folder):
+                continue
+            for filename in sorted(os.listdir(folder)):
+                path = os.path.join(folder, filename)
+                if os.path.isfile(path):
+                    yield read_mapped(path)
+
+
+class EmlDirSource(LocalMailSource):
+    """Directory tree of .eml files"""
+
+    def iter_raw_messages(self):
+        for root, _, filenames in os.walk(self.path):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".eml"):
+                    yield read_mapped(os.path.join(root, filename))
+
+
+LOCAL_SOURCES = {
+    "mbox": MboxSource,
+    "maildir": MaildirSource,
+    "eml": EmlDirSource,
+}
+
+
+if __name__ == "__main__":
+    # python -m src.email_fetcher.sources mbox path/to/archive.mbox
+    parser = argparse.ArgumentParser(description="Ingest a local mail archive into temp/mails")
+    parser.add_argument("kind", choices=sorted(LOCAL_SOURCES))
+    parser.add_argument("path")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+    LOCAL_SOURCES[args.kind](args.path, processes=args.processes).ingest()
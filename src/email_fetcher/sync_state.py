@@ -0,0 +1,56 @@
+# Persistent per-user sync state for incremental Gmail fetching
+# 每个用户保存上次同步的 historyId 和已下载的邮件 id, 下次只拉取新增/删除的邮件
+
+import json
+import os
+
+# Get the current file's directory path
+current_dir = os.path.dirname(__file__)
+
+sync_state_dir = os.path.join(current_dir, "..", "..", "temp", "sync_state")
+
+
+def sync_state_path(user_id):
+    safe_user_id = "".join(c if c.isalnum() else "_" for c in user_id)
+    return os.path.join(sync_state_dir, f"{safe_user_id}.json")
+
+
+def empty_sync_state():
+    # messages: {message_id: folder_name}, failed: ids of the messages to fetch again
+    return {"history_id": None, "query": None, "messages": {}, "failed": []}
+
+
+def load_sync_state(user_id):
+    """Load the sync state of a user, an empty state if there is none"""
+    path = sync_state_path(user_id)
+    if not os.path.exists(path):
+        return empty_sync_state()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        print(f"Ignoring unreadable sync state {path}: {e}")
+        return empty_sync_state()
+    return {**empty_sync_state(), **state}
+
+
+def save_sync_state(user_id, state):
+    """Write the sync state atomically (temp file + rename)"""
+    os.makedirs(sync_state_dir, exist_ok=True)
+    path = sync_state_path(user_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def reset_sync_state(user_id=None):
+    """Forget the sync state of one user, or of all users"""
+    if not os.path.isdir(sync_state_dir):
+        return
+    paths = [sync_state_path(user_id)] if user_id else [
+        os.path.join(sync_state_dir, f) for f in os.listdir(sync_state_dir)
+    ]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,26 +1,17 @@
 import os
-import getpass
 import re
 import shutil
 
-import torch
-from TTS.api import TTS
-import gradio as gr
-from pydub import AudioSegment
-
-# Get device
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# torch, TTS and pydub are imported when a podcast is generated
+from ..utils import providers
 
 # 获取当前文件所在目录
 current_dir = os.path.dirname(__file__)
 
 # path of temp_dir
 tmp_dir = os.path.join(current_dir, "..", "..", "temp")
-# Ensure tmp_dir exists for temporary audio files
-os.makedirs(tmp_dir, exist_ok=True)
-# Define a dedicated directory for audio segments within tmp_dir
+# Define a dedicated directory for audio segments within tmp_dir (created by gen_podcast)
 segment_dir = os.path.join(tmp_dir, "audio_segments")
-os.makedirs(segment_dir, exist_ok=True)
 
 podcast_path = os.path.join(current_dir, "..", "podcast_generator")
 
@@ -118,6 +109,30 @@ def load_script(file_path):
     # print("Parsed Script:", parsed_script) # For debugging
     return parsed_script
 
+@providers.provider("tts")
+def load_tts_model(model_name=MODEL_NAME):
+    """The TTS model on the best device, downloaded first if necessary; kept loaded for the next podcast"""
+    import torch
+    from TTS.api import TTS
+
+    # Get device
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # First check if model exists and download if necessary
+    print("Checking model availability...")
+    TTS.list_models()  # This ensures the model cache is updated
+    manager = TTS()  # Initialize manager
+    if not any(model_name in m for m in manager.list_models()):
+        print(f"Model {model_name} not found locally. Downloading...")
+        manager.download_model(model_name)
+        print("Model downloaded successfully!")
+
+    # Initialize FastPitch model
+    print("Loading model...")
+    tts = TTS(model_name)
+    tts.to(device)
+    return tts
+
 def gen_podcast(script_path=os.path.join(podcast_path, "podcast_script.txt"),
                 output_filename=os.path.join(tmp_dir, "podcast_output.wav")):
     """Generates a podcast from a script file with multiple speakers using FastPitch."""
@@ -129,19 +144,7 @@ def gen_podcast(script_path=os.path.join(podcast_path, "podcast_script.txt"),
 
     print(f"Initializing TTS model: {MODEL_NAME}")
     try:
-        # First check if model exists and download if necessary
-        print("Checking model availability...")
-        TTS.list_models()  # This ensures the model cache is updated
-        manager = TTS()  # Initialize manager
-        if not any(MODEL_NAME in m for m in manager.list_models()):
-            print(f"Model {MODEL_NAME} not found locally. Downloading...")
-            manager.download_model(MODEL_NAME)
-            print("Model downloaded successfully!")
-
-        # Initialize FastPitch model
-        print("Loading model...")
-        tts = TTS(MODEL_NAME)
-        tts.to(device)
+        tts = providers.get("tts", model_name=MODEL_NAME)
         
         # Print available speakers for debugging
         print("Available speakers:", tts.speakers)
@@ -151,6 +154,8 @@ def gen_podcast(script_path=os.path.join(podcast_path, "podcast_script.txt"),
         print("Please ensure you have a stable internet connection and try again.")
         return
 
+    from pydub import AudioSegment
+
     segment_files = []
     combined_audio = AudioSegment.empty()
 
@@ -188,6 +193,7 @@ def gen_podcast(script_path=os.path.join(podcast_path, "podcast_script.txt"),
 
     print("\nCombining audio segments...")
     try:
+        os.makedirs(os.path.dirname(output_filename) or ".", exist_ok=True)
         # Export the final combined audio
         combined_audio.export(output_filename, format="wav")
         print(f"Successfully generated podcast: {output_filename}")
@@ -0,0 +1,128 @@
+# Prompt context preprocessing for the summarizer
+# 去掉在多封邮件中重复出现的行（退订说明、地址、"View in browser"、法律声明等）,
+# 然后按 token 预算把邮件内容装入 prompt, 优先保留更重要的类别和更新的邮件
+
+import hashlib
+import re
+
+from langchain_core.documents import Document
+
+# a line is boilerplate when it appears in at least this fraction of the mails of the catalog
+# (and in MIN_BOILERPLATE_DOCS of them)
+BOILERPLATE_FRACTION = 0.3
+MIN_BOILERPLATE_DOCS = 3
+
+# token budget of the {context} part of the script prompt
+CONTEXT_TOKEN_BUDGET = 48000
+
+# a mail that does not fit is truncated if at least this many tokens are left
+MIN_TRUNCATED_TOKENS = 200
+
+# lower comes first when the budget is tight
+CATEGORY_PRIORITY = {"技术": 0, "新闻": 1, "工作": 2, "其他": 3}
+
+TOKENIZER_ENCODING = "cl100k_base"
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACE_RE = re.compile(r"\s+")
+
+_encoding = None
+
+
+def _get_encoding():
+    """tiktoken encoding, False when tiktoken or its vocabulary is not available"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"Token counting falls back to an estimate ({type(e).__name__}: {e})")
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # rough estimate: ~4 characters per token for latin text, 1 per CJK character
+    cjk = sum(1 for c in text if "\u4e00" <= c <= "\u9fff")
+    return cjk + (len(text) - cjk) // 4
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _line_key(line):
+    """Lines that differ only in numbers or spacing count as the same line"""
+    return _DIGITS_RE.sub("0", _SPACE_RE.sub(" ", line.strip().lower()))
+
+
+def line_hash(line):
+    """Short hash of the line key, the form in which the catalog counts the lines of the mails"""
+    return hashlib.sha1(_line_key(line).encode("utf-8")).hexdigest()[:16]
+
+
+def line_hashes(text):
+    """Distinct hashes of the non-empty lines of a mail text"""
+    return {line_hash(line) for line in text.split("\n") if line.strip()}
+
+
+def strip_boilerplate(docs, boilerplate):
+    """
+    Remove the lines whose hash is in `boilerplate`, the lines that repeat
+    across many mails of the catalog (see MailCatalog.frequent_lines).
+    Returns (new documents, number of lines removed).
+    """
+    stripped, removed = [], 0
+    for doc in docs:
+        lines = doc.page_content.split("\n")
+        kept = [line for line in lines if not line.strip() or line_hash(line) not in boilerplate]
+        removed += len(lines) - len(kept)
+        stripped.append(Document(page_content="\n".join(kept), metadata=dict(doc.metadata)))
+    return stripped, removed
+
+
+def _priority(doc):
+    # important categories first, then the most recent mails
+    return CATEGORY_PRIORITY.get(doc.metadata.get("category"), len(CATEGORY_PRIORITY)), -(doc.metadata.get("date") or 0)
+
+
+def pack_context(docs, texts=None, budget=CONTEXT_TOKEN_BUDGET, separator="\n\n"):
+    """
+    Join texts (the documents' page_content by default) into a context of
+    at most `budget` tokens. Mails are taken in priority order, the first
+    one that does not fit is truncated, the rest are dropped. The packed
+    mails keep their original order. Returns (context, report dict).
+    """
+    texts = texts if texts is not None else [doc.page_content for doc in docs]
+    tokens = [count_tokens(text) for text in texts]
+    separator_tokens = count_tokens(separator)
+    order = sorted(range(len(docs)), key=lambda i: _priority(docs[i]))
+
+    packed, used = {}, 0
+    for i in order:
+        cost = tokens[i] + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed[i] = texts[i]
+            used += cost
+            continue
+        left = budget - used - (separator_tokens if packed else 0)
+        if left >= MIN_TRUNCATED_TOKENS:
+            packed[i] = truncate_tokens(texts[i], left)
+            used += left + (separator_tokens if len(packed) > 1 else 0)
+        break
+
+    context = separator.join(packed[i] for i in sorted(packed))
+    report = {
+        "mails": len(docs),
+        "packed_mails": len(packed),
+        "input_tokens": sum(tokens),
+        "context_tokens": count_tokens(context),
+    }
+    return context, report
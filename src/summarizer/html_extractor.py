@@ -0,0 +1,83 @@
+# Fast HTML-to-text extraction for newsletter mails
+# 基于 lxml 的正文提取, 代替每封邮件创建一个 UnstructuredHTMLLoader:
+# 去掉 script/style、隐藏的预览文本（preheader）和表格布局产生的空白, 保留链接文字
+
+import re
+
+from lxml import etree
+from lxml.html import document_fromstring
+
+# 提取规则改变时增加版本号, 解析结果的缓存会随之失效
+EXTRACTOR_VERSION = "lxml-2"
+
+DROP_TAGS = ["script", "style", "head", "title", "meta", "link", "noscript", "template", "svg", "img",
+             "iframe", "object", "form", "button", "input", "select", "textarea"]
+
+# 这些标签结束时换行, 其余（a, span, b...）是行内元素
+BLOCK_TAGS = {"p", "div", "tr", "li", "ul", "ol", "table", "section", "article", "header", "footer",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr", "center", "dl", "dt", "dd"}
+
+_HIDDEN_STYLE_RE = re.compile(
+    r"display\s*:\s*none|visibility\s*:\s*hidden|(?:max-height|font-size|opacity)\s*:\s*0(?![.\d])|"
+    r"mso-hide\s*:\s*all",
+    re.IGNORECASE,
+)
+# 整个 class 名称匹配: mobile-hidden, hidden-xs, overflow-hidden 等只在部分屏幕上隐藏或与可见性无关
+HIDDEN_CLASSES = {"preheader", "preview-text", "hidden"}
+
+# zero-width and filler characters used to pad preheaders
+_INVISIBLE_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u034f\u00ad\u2800]")
+_SPACE_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+
+
+def _is_hidden(element):
+    if element.get("hidden") is not None or element.get("aria-hidden") == "true":
+        return True
+    if _HIDDEN_STYLE_RE.search(element.get("style") or ""):
+        return True
+    return any(name.lower() in HIDDEN_CLASSES for name in (element.get("class") or "").split())
+
+
+def html_to_text(html):
+    """Visible text of an html mail (str or bytes), one block per line"""
+    if isinstance(html, str):
+        # lxml refuses str input with an encoding declaration
+        html = html.encode("utf-8")
+    try:
+        root = document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return ""
+    etree.strip_elements(root, etree.Comment, etree.ProcessingInstruction, *DROP_TAGS, with_tail=False)
+    for element in root.xpath("//*[@style or @class or @hidden or @aria-hidden]"):
+        if _is_hidden(element) and element.getparent() is not None:
+            element.drop_tree()  # keeps the tail text
+
+    parts = []
+    for event, element in etree.iterwalk(root, events=("start", "end")):
+        if event == "start":
+            if element.tag == "br":
+                parts.append("\n")
+            if element.text:
+                parts.append(element.text)
+        else:
+            if element.tag in BLOCK_TAGS:
+                parts.append("\n")
+            elif element.tag in ("td", "th"):
+                # 表格布局: 单元格之间用空格分开, 每行结束时换行
+                parts.append(" ")
+            if element.tail and element is not root:
+                parts.append(element.tail)
+
+    lines, previous = [], None
+    for line in "".join(parts).split("\n"):
+        line = _SPACE_RE.sub(" ", _INVISIBLE_RE.sub("", line)).strip()
+        # 跳过空行和布局造成的重复行
+        if line and line != previous:
+            lines.append(line)
+        previous = line or previous
+    return "\n".join(lines)
+
+
+def extract_file(html_file_path):
+    with open(html_file_path, "rb") as f:
+        return html_to_text(f.read())
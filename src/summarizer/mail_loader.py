@@ -0,0 +1,201 @@
+# Mail text loading shared by summarizer.py and document_loader.py
+# 优先使用完整的纯文本部分, 只有在没有可用纯文本时才解析 HTML
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .html_extractor import extract_file
+from .text_cache import get_text_cache, TextCache
+
+# HTML 解析方式: "fast" 使用 html_extractor, "unstructured" 使用原来的 UnstructuredHTMLLoader
+HTML_EXTRACTOR = "fast"
+
+# 需要解析的 HTML 少于该数量时不启动进程池
+MIN_PARALLEL_MAILS = 32
+
+# 每个进程一次处理的邮件数量, 以及同时提交的最大邮件数量
+CHUNKSIZE = 8
+MAX_IN_FLIGHT = 1024
+
+
+class LoadStats:
+    """Per-mail load times and how many html parses were avoided"""
+
+    def __init__(self):
+        self.plain = 0
+        self.html = 0
+        self.cached = 0
+        self.empty = 0
+        self.seconds = []
+
+    def record(self, source, seconds):
+        setattr(self, source, getattr(self, source) + 1)
+        self.seconds.append(seconds)
+
+    def report(self):
+        loaded = self.plain + self.html + self.cached
+        if not self.seconds:
+            print("Loaded 0 mails")
+            return
+        avoided = (self.plain + self.cached) / loaded if loaded else 0.0
+        average = sum(self.seconds) / len(self.seconds)
+        print(f"Loaded {loaded} mails ({self.plain} plain text, {self.html} html parsed, "
+              f"{self.cached} html from cache, {self.empty} empty), "
+              f"{avoided:.0%} of html parses avoided, "
+              f"{average * 1000:.1f}ms per mail on average, {max(self.seconds) * 1000:.1f}ms max")
+
+
+def load_html_text_unstructured(html_file_path):
+    from langchain_community.document_loaders import UnstructuredHTMLLoader
+    loader = UnstructuredHTMLLoader(html_file_path)
+    # loader = BSHTMLLoader(html_file_path)
+    documents = loader.load()
+    return documents[0].page_content if documents else None
+
+
+HTML_LOADERS = {
+    "fast": extract_file,
+    "unstructured": load_html_text_unstructured,
+}
+
+
+def load_html_text(html_file_path, extractor=None):
+    return HTML_LOADERS[extractor or HTML_EXTRACTOR](html_file_path)
+
+
+def load_plain_text(text_file_path):
+    with open(text_file_path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def mail_text_job(store, entry, prefer_plain=True, extractor=None):
+    """(source, absolute path, extractor) of the text to load for a catalog entry, picklable"""
+    if prefer_plain and entry.get("plain_complete") and entry.get("text_path"):
+        return "plain", store.path(entry["text_path"]), extractor
+    if entry.get("html_path"):
+        return "html", store.path(entry["html_path"]), extractor
+    return "empty", None, extractor
+
+
+def run_mail_text_job(job):
+    """
+    Load the text of one job, returns (text, source, seconds, error). Runs
+    in the worker processes, errors are returned instead of raised so one
+    corrupt file does not fail the batch.
+    """
+    source, path, extractor = job
+    start = time.perf_counter()
+    text, error = None, None
+    try:
+        if source == "plain":
+            text = load_plain_text(path)
+        elif source == "html":
+            text = load_html_text(path, extractor)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    if not text:
+        source = "empty"
+    return text, source, time.perf_counter() - start, error
+
+
+def load_mail_text(store, entry, stats=None, prefer_plain=True, extractor=None, use_cache=True):
+    """
+    Text of a catalog entry: the plain alternative when the fetcher marked
+    it complete, otherwise the html parsed with `extractor` (HTML_EXTRACTOR
+    by default), read through the parsed text cache
+    """
+    for _, text in iter_mail_texts(store, [entry], stats, prefer_plain, extractor, processes=1, use_cache=use_cache):
+        return text
+
+
+def _run_job_isolated(job):
+    """run_mail_text_job in a new single-worker process, a crash fails this job only"""
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(run_mail_text_job, job).result()
+    except BrokenProcessPool:
+        return None, "empty", time.perf_counter() - start, "the worker process crashed"
+
+
+def _run_jobs_parallel(jobs, processes, chunksize):
+    """run_mail_text_job over a process pool, results in job order"""
+    done = 0
+    while done < len(jobs):
+        try:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for start in range(done, len(jobs), MAX_IN_FLIGHT):
+                    window = jobs[start:start + MAX_IN_FLIGHT]
+                    for result in executor.map(run_mail_text_job, window, chunksize=chunksize):
+                        done += 1
+                        yield result
+        except BrokenProcessPool:
+            # a worker crashed (e.g. the parser segfaulted): the first job without a result runs
+            # alone, so that a crash there is its own, then the rest continue in a new pool
+            print("Process pool failed, retrying the remaining mails in a new pool")
+            yield _run_job_isolated(jobs[done])
+            done += 1
+
+
+def _lookup_cached(cache, jobs):
+    """(keys, {key: text}): cache keys of the html jobs (None for the others) and the cached texts"""
+    keys = [None] * len(jobs)
+    for i, (source, path, extractor) in enumerate(jobs):
+        if source != "html":
+            continue
+        try:
+            with open(path, "rb") as f:
+                keys[i] = TextCache.key(f.read(), extractor or HTML_EXTRACTOR)
+        except OSError:
+            pass  # reported when the job runs
+    return keys, cache.get_many(key for key in keys if key)
+
+
+def iter_mail_texts(store, entries, stats=None, prefer_plain=True, extractor=None, processes=None,
+                    chunksize=CHUNKSIZE, use_cache=True):
+    """
+    Yield (entry, text) for the entries in their original order. HTML
+    already parsed with the same extractor version is read from the parsed
+    text cache. When at least MIN_PARALLEL_MAILS html files have to be
+    parsed and processes != 1, parsing is spread over a ProcessPoolExecutor.
+    Mails that fail to load yield None and are reported, the others are
+    unaffected.
+    """
+    jobs = [mail_text_job(store, entry, prefer_plain, extractor) for entry in entries]
+    cache = get_text_cache(store.root) if use_cache else None
+    keys, cached = [None] * len(jobs), {}
+    lookup_seconds = 0.0
+    if cache is not None:
+        start = time.perf_counter()
+        keys, cached = _lookup_cached(cache, jobs)
+        lookup_seconds = (time.perf_counter() - start) / max(len(cached), 1)
+
+    pending = [job for job, key in zip(jobs, keys) if key not in cached]
+    html_jobs = sum(1 for source, _, _ in pending if source == "html")
+    if processes == 1 or html_jobs < MIN_PARALLEL_MAILS or (os.cpu_count() or 1) == 1:
+        results = map(run_mail_text_job, pending)
+    else:
+        results = _run_jobs_parallel(pending, processes, chunksize)
+
+    parsed = {}
+    try:
+        for entry, key in zip(entries, keys):
+            if key in cached:
+                text, source, seconds, error = cached[key], "cached", lookup_seconds, None
+            else:
+                text, source, seconds, error = next(results)
+                if key is not None and source == "html" and text:
+                    parsed[key] = text
+            if error is not None:
+                print(f"Error loading {entry.get('name')}: {error}")
+            if stats is not None:
+                stats.record(source, seconds if source != "cached" else lookup_seconds)
+            yield entry, text
+    finally:
+        if cache is not None:
+            cache.put_many(parsed)
+            if len(entries) > 1:
+                misses = sum(1 for key in keys if key is not None and key not in cached)
+                print(f"Parsed text cache: {len(cached)} hits, {misses} misses")
@@ -1,44 +1,33 @@
 import os
-import getpass
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
-from langchain_deepseek import ChatDeepSeek
-from langchain import hub
-from langgraph.graph import START, StateGraph
 from typing_extensions import TypedDict
 
-from langchain_community.vectorstores import FAISS
-
-embeddings = OllamaEmbeddings(model="nomic-embed-text")
-
-# Initialize LLM and DeepSeek API key
-local_llm = OllamaLLM(model="qwen2.5:0.5b")
-
-if not os.environ.get("DEEPSEEK_API_KEY"):
-    os.environ["DEEPSEEK_API_KEY"] = getpass.getpass("Enter API key for Deepseek: ")
-
-llm = ChatDeepSeek(
-    model="deepseek-chat",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+from ..utils import providers
+from .vector_index import index_dir
 
 # 获取当前文件所在目录
 current_dir = os.path.dirname(__file__)
 
 tmp_dir = os.path.join(current_dir, "..", "..", "temp")
 
-vector_store_dir = os.path.join(tmp_dir, "vector_store_faiss")
+vector_store_dir = index_dir
 
-# Load and prepare documents (call the function from document_loader.py)
+# The index is built by document_loader.load_and_prepare_documents
 base_dir = os.path.join(os.path.dirname(__file__), "..", "..", "temp", "mails")
-# vector_store, all_splits = load_and_prepare_documents(base_dir)
-vector_store = FAISS.load_local(
-    vector_store_dir, embeddings, allow_dangerous_deserialization=True
-)
-# Load the RAG prompt
-prompt = hub.pull("rlm/rag-prompt")
+
+# The vector store, the RAG prompt and the LLM are created on first use
+LOCAL_MODEL = "qwen2.5:0.5b"
+RAG_PROMPT = "rlm/rag-prompt"
+
+def get_vector_store():
+    return providers.get("faiss_index", path=vector_store_dir)
+
+def get_prompt():
+    # Load the RAG prompt
+    return providers.get("hub_prompt", name=RAG_PROMPT)
+
+def get_local_llm():
+    # temperature 0 makes the answers repeatable, so they are served from the LLM response cache
+    return providers.get("ollama", model=LOCAL_MODEL, temperature=0)
 
 class State(TypedDict):
     question: str
@@ -46,19 +35,27 @@ class State(TypedDict):
     answer: str
 
 def retrieve(state: State):
-    retrieved_docs = vector_store.similarity_search(state["question"], k = 20)
+    retrieved_docs = get_vector_store().similarity_search(state["question"], k = 20)
     return {"context": retrieved_docs}
 
 def generate(state: State):
     docs_content = "\n\n".join(doc.page_content for doc in state["context"])
-    messages = prompt.invoke({"question": state["question"], "context": docs_content})
-    response = local_llm.invoke(messages)
+    messages = get_prompt().invoke({"question": state["question"], "context": docs_content})
+    response = get_local_llm().invoke(messages)
     return {"answer": response}
 
-# Compile application and test
-graph_builder = StateGraph(State).add_sequence([retrieve, generate])
-graph_builder.add_edge(START, "retrieve")
-graph = graph_builder.compile()
+def build_graph():
+    from langgraph.graph import START, StateGraph
+
+    graph_builder = StateGraph(State).add_sequence([retrieve, generate])
+    graph_builder.add_edge(START, "retrieve")
+    return graph_builder.compile()
+
+def run_retrieval(question="Draft a podcast script based on the content."):
+    answer = build_graph().invoke({"question": question})["answer"]
+    providers.report_llm_cache()
+    return answer
 
-response = graph.invoke({"question": "Draft a podcast script based on the content."})
-print(response["answer"])
+if __name__ == "__main__":
+    # Compile application and test
+    print(run_retrieval())
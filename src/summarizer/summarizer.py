@@ -1,10 +1,12 @@
 import os
-import getpass
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 # NOTE 
 # There are 2 methods to load html file. For details, please see https://python.langchain.com/docs/integrations/document_loaders/
-from langchain_community.document_loaders import UnstructuredHTMLLoader
+# HTML loading lives in mail_loader.py, which uses the plain text alternative when it is complete
 # from langchain_community.document_loaders import BSHTMLLoader
 # from langchain_community.document_loaders import MHTMLLoader
 
@@ -12,38 +14,16 @@ from langchain_community.document_loaders import UnstructuredHTMLLoader
 from langchain_core.documents import Document
 from typing_extensions import TypedDict
 
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
-#embeddings = OllamaEmbeddings(model="nomic-embed-text")
-# local_llm = OllamaLLM(model="llama3.2", temperature=0.6)
-# local_llm = OllamaLLM(model="llama3.2")
-local_llm = OllamaLLM(model="deepscaler")
-# local_llm = OllamaLLM(model="openthinker")
-# local_llm = OllamaLLM(model="qwen2.5:0.5b")
-# local_llm = OllamaLLM(model="deepseek-r1:1.5b")
+# 模型在第一次使用时才创建, 见 get_llm()
+# local_llm: providers.get("ollama", model="deepscaler") (llama3.2, openthinker, qwen2.5:0.5b, deepseek-r1:1.5b...)
 
-from langchain_deepseek import ChatDeepSeek
-if not os.environ.get("DEEPSEEK_API_KEY"):
-    os.environ["DEEPSEEK_API_KEY"] = getpass.getpass("Enter API key for Deepseek: ")
-
-llm = ChatDeepSeek(
-    model="deepseek-chat",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    streaming=True
-    # other params..
-)
-
-from langchain import hub
-
-from langsmith import traceable
-
-from langgraph.graph import START, StateGraph
-
-from bs4 import BeautifulSoup
-
-from langchain_core.prompts import PromptTemplate
+from ..utils import providers
+from ..utils.mail_store import get_store
+from .mail_loader import load_mail_text, iter_mail_texts, LoadStats
+from ..email_fetcher.email_fetcher_api import fetch_pending_bodies
+from ..utils.near_duplicates import select_representatives, DEFAULT_THRESHOLD
+from .context_packing import (strip_boilerplate, line_hashes, pack_context, count_tokens, CONTEXT_TOKEN_BUDGET,
+                              BOILERPLATE_FRACTION, MIN_BOILERPLATE_DOCS)
 
 # 获取当前文件所在目录
 current_dir = os.path.dirname(__file__)
@@ -56,28 +36,19 @@ base_dir = os.path.join(tmp_dir, "mails")
 
 podcast_path = os.path.join(current_dir, "..", "podcast_generator")
 
-def load_page_content(email_dir):
-    html_files = [f for f in os.listdir(email_dir) if f.endswith('.html')]
-    if not html_files:
-        return None
-        
-    html_file_path = os.path.join(email_dir, html_files[0])
-    
-    loader = UnstructuredHTMLLoader(html_file_path)
-    # loader = BSHTMLLoader(html_file_path)
+script_path = os.path.join(podcast_path, "podcast_script.txt")
 
-    documents = loader.load()
+def load_page_content(store, entry, stats=None, page_content=None):
+    if page_content is None:
+        page_content = load_mail_text(store, entry, stats)
+    if not page_content:
+        return None
 
-    subject = os.path.basename(email_dir)
+    subject = entry["name"]
 
     # print("tile:", subject)
-    # tests
-    # print(50*'*')
-    # for doc in documents:
-    #     print(doc)
-    # print(50*'*')
 
-    content = Document(page_content=documents[0].page_content, metadata={"subject": subject})
+    content = Document(page_content=page_content, metadata={"subject": subject})
     # content = Document(page_content=documents[0].page_content)
     
     # test
@@ -88,7 +59,12 @@ def load_page_content(email_dir):
     return content
 
 
-def load_all_page_content(base_dir):
+def load_all_page_content(base_dir, processes=None, **filters):
+    """
+    Load the mails selected from the catalog, see MailCatalog.query for the
+    filters. HTML parsing runs in `processes` worker processes (all cores
+    by default, 1 loads in this process).
+    """
     all_content = []
     print(f"\nChecking directory: {base_dir}")
     # 确保目录存在
@@ -96,27 +72,27 @@ def load_all_page_content(base_dir):
         print(f"Directory {base_dir} does not exist")
         return all_content
         
-    # 遍历每个邮件目录
-    dir_items = os.listdir(base_dir)
-    print(f"Found {len(dir_items)} items in directory")
+    # 遍历邮件库中的每封邮件
+    store = get_store(base_dir)
+    entries = store.entries(**filters)
+    print(f"Found {len(entries)} mails in catalog")
+    # 只获取了元数据的邮件在这里才下载正文
+    entries = fetch_pending_bodies(store, entries)
+    stats = LoadStats()
     
-    for email_dir in dir_items:
-        full_path = os.path.join(base_dir, email_dir)
-        
-        # 只处理目录
-        if not os.path.isdir(full_path):
-            print(f"Skipping non-directory: {email_dir}")
-            continue
-            
-        print(f"Processing directory: {email_dir}")
-        content = load_page_content(full_path)
+    for entry, page_content in iter_mail_texts(store, entries, stats, processes=processes):
+        email_name = entry["name"]
+        print(f"Processing mail: {email_name}")
+        content = load_page_content(store, entry, stats, page_content=page_content)
         if content:
+            content.metadata.update(id=entry["id"], category=entry.get("category"), date=entry.get("date"))
             all_content.append(content)
-            print(f"Added content from: {email_dir}")
+            print(f"Added content from: {email_name}")
         else:
-            print(f"No content found in: {email_dir}")
+            print(f"No content found in: {email_name}")
             
     print(f"Total content items found: {len(all_content)}")
+    stats.report()
     return all_content
     
 prompt_template = """Generate a detailed podcast script in English for two hosts (Host 1 and Host 2) based on the provided email content and topic.
@@ -140,48 +116,228 @@ Podcast Script:
 """
 
 
-prompt = PromptTemplate(template=prompt_template, input_variables=["context", "topic"])
+map_prompt_template = """Summarize the following email for the hosts of a podcast.
+
+Instructions:
+1. Write at most 5 short bullet points in English with the facts worth talking about (news, articles, job openings, companies, dates).
+2. Leave out greetings, footers, unsubscribe text, links and tracking information.
+3. Return only the bullet points.
+
+Email Subject:
+{subject}
+
+Email Content:
+{content}
+
+Summary:
+"""
+
+# 同时进行的单封邮件总结请求数量
+MAP_CONCURRENCY = 8
+
+# 单封邮件总结的缓存键包含提示词版本, 修改提示词后旧的总结自动失效
+MAP_PROMPT_VERSION = hashlib.sha1(map_prompt_template.encode("utf-8")).hexdigest()[:12]
+
+def get_llm():
+    """The chat model that summarizes the mails and writes the script, created on first use"""
+    return providers.get("deepseek", model="deepseek-chat", temperature=0, max_tokens=None, timeout=None,
+                         max_retries=2, streaming=True)
 
 class State(TypedDict):
     topic: str
     answer: str
     content: list
-
-def run_summarizer(topic):
+    summaries: list
+
+def boilerplate_lines(store, docs):
+    """
+    Hashes of the lines that repeat across the mails of the catalog. The
+    lines of the mails that were not counted yet are added to the catalog
+    first: the loaded docs directly, the other mails through the parsed
+    text cache. The result does not depend on which mails are selected.
+    """
+    catalog = store.catalog
+    entries = catalog.unindexed_line_entries()
+    if entries:
+        loaded = {doc.metadata["id"]: doc.page_content for doc in docs}
+        mails = [(entry["id"], entry["body_hash"], line_hashes(loaded[entry["id"]]))
+                 for entry in entries if entry["id"] in loaded]
+        others = [entry for entry in entries if entry["id"] not in loaded]
+        for entry, text in iter_mail_texts(store, others):
+            mails.append((entry["id"], entry["body_hash"], line_hashes(text or "")))
+        catalog.index_lines(mails)
+        print(f"Boilerplate: counted the lines of {len(mails)} new emails")
+    return catalog.frequent_lines(BOILERPLATE_FRACTION, MIN_BOILERPLATE_DOCS)
+
+def summary_cache_key(doc):
+    """单封邮件总结的缓存键: 邮件正文的哈希 + 模型 + 提示词版本"""
+    body_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+    llm = get_llm()
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+    return hashlib.sha256("\0".join([body_hash, model, MAP_PROMPT_VERSION]).encode("utf-8")).hexdigest()
+
+def summarize_email(doc, content=None):
+    """map: 总结一封邮件, content 默认为邮件正文"""
+    prompt_text = providers.prompt(map_prompt_template).format(subject=doc.metadata.get("subject", ""),
+                                                               content=doc.page_content if content is None else content)
+    response = get_llm().invoke(prompt_text)
+    return response.content if hasattr(response, 'content') else str(response)
+
+def summarize_emails(docs, contents=None, concurrency=MAP_CONCURRENCY):
+    """
+    并发总结每封邮件（最多 concurrency 个请求同时进行）, 返回与 docs 顺序一致的总结列表。
+    contents 是放入提示词的正文（例如去掉重复行后的）, 默认为 docs 的正文;
+    总结按 docs 的正文哈希和模型缓存在邮件目录中, 只有新的或改变的邮件才会请求 LLM;
+    某封邮件总结失败时只跳过这一封（返回 None）, 下次运行再重试
+    """
+    catalog = get_store(base_dir).catalog
+    keys = [summary_cache_key(doc) for doc in docs]
+    cached = catalog.cached_summaries(set(keys))
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    print(f"Summary cache: {len(docs) - len(missing)} hits, {len(missing)} emails to summarize")
+
+    def run(i):
+        try:
+            summary = summarize_email(docs[i], contents[i] if contents is not None else None)
+        except Exception as e:
+            print(f"Error summarizing {docs[i].metadata.get('subject')}: {e}")
+            return None
+        catalog.cache_summary(keys[i], summary)
+        return summary
+
+    summaries = [cached.get(key) for key in keys]
+    if missing:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i, summary in zip(missing, executor.map(run, missing)):
+                summaries[i] = summary
+    return summaries
+
+def stream_summarizer(topic, category=None, since_hours=None, near_duplicate_threshold=DEFAULT_THRESHOLD,
+                      mode="map_reduce", token_budget=CONTEXT_TOKEN_BUDGET, by_line=True, file_path=None):
+    """
+    Generate the podcast script from the fetched mails and yield it while
+    the LLM writes it: line by line, or token by token with by_line=False.
+    Every piece is appended to `file_path` (podcast_script.txt by default)
+    as soon as it arrives. `category` and
+    `since_hours` select the mails through the catalog indexes, e.g.
+    run_summarizer(topic, category="技术", since_hours=24).
+    Mails whose text is at least `near_duplicate_threshold` similar are
+    summarized once, None keeps every mail.
+    mode="map_reduce" summarizes every mail separately (cached) and writes
+    the script from the summaries; mode="stuff" puts the full mail bodies
+    into a single prompt.
+    Lines repeated across many mails of the catalog (footers, "view in
+    browser"...) are removed from the mails before they are summarized or
+    put into the script prompt, whose context is packed into
+    `token_budget` tokens.
+    """
     print("\nStarting summarization process...")
     # Load content here instead of at module level
-    all_mail_content = load_all_page_content(base_dir)
+    filters = {"category": category}
+    if since_hours is not None:
+        filters["since"] = int(time.time() - since_hours * 3600)
+    all_mail_content = load_all_page_content(base_dir, **filters)
     
     if not all_mail_content:
         print("No email content found to summarize!")
-        return None
+        return
     
+    loaded_ids = [doc.metadata["id"] for doc in all_mail_content]
+    boilerplate = boilerplate_lines(get_store(base_dir), all_mail_content)
+    if near_duplicate_threshold is not None:
+        all_mail_content, clusters = select_representatives(all_mail_content, near_duplicate_threshold)
+        print(f"Near-duplicate check: {len(loaded_ids)} emails in {len(clusters)} clusters")
+
+    raw_tokens = sum(count_tokens(doc.page_content) for doc in all_mail_content)
+    stripped_content, removed_lines = strip_boilerplate(all_mail_content, boilerplate)
+    stripped_tokens = sum(count_tokens(doc.page_content) for doc in stripped_content)
+    print(f"Boilerplate: removed {removed_lines} repeated lines, {raw_tokens - stripped_tokens} tokens "
+          f"({raw_tokens} -> {stripped_tokens})")
     print(f"Found {len(all_mail_content)} emails to process")
     
     # Create graph with content
+    def summarize(state: State, **kwargs):
+        print("Summarizing emails...")
+        # 提示词使用去掉重复行的正文, 缓存键使用原始正文（重复行表会随着新邮件变化）
+        return {"summaries": summarize_emails(all_mail_content, [doc.page_content for doc in stripped_content])}
+
     def generate(state: State, **kwargs):
         print("Generating content from emails...")
-        docs_content = "\n\n".join(doc.page_content for doc in all_mail_content)
+        if state.get("summaries") is not None:
+            # reduce: 由每封邮件的总结生成文稿
+            docs = [Document(page_content=f"{doc.metadata.get('subject', '')}:\n{summary}", metadata=dict(doc.metadata))
+                    for doc, summary in zip(all_mail_content, state["summaries"]) if summary]
+        else:
+            docs = stripped_content
+        docs_content, report = pack_context(docs, budget=token_budget)
         messages = {"context": docs_content, "topic": state["topic"]}
+        prompt_text = providers.prompt(prompt_template).format(**messages)
+        print(f"Context: {report['packed_mails']}/{report['mails']} emails packed, "
+              f"{report['context_tokens']}/{token_budget} context tokens, "
+              f"{raw_tokens - report['context_tokens']} tokens saved vs. the raw emails, "
+              f"prompt size {count_tokens(prompt_text)} tokens")
         print("Calling LLM for summary generation...")
-        response = llm.invoke(prompt.format(**messages))
+        response = get_llm().invoke(prompt_text)
         return {"answer": response.content if hasattr(response, 'content') else str(response)}
 
-    graph_builder = StateGraph(State).add_sequence([generate])
-    graph_builder.add_edge(START, "generate")
+    from langgraph.graph import START, StateGraph
+
+    nodes = [summarize, generate] if mode == "map_reduce" else [generate]
+    graph_builder = StateGraph(State).add_sequence(nodes)
+    graph_builder.add_edge(START, nodes[0].__name__)
     graph = graph_builder.compile()
     
     print("Running graph to generate summary...")
-    response = graph.invoke({"topic": topic})
+    file_path = file_path or script_path
+    answer, streamed, pending = None, False, ""
+    with open(file_path, "w", encoding="utf-8") as f:
+        # "messages" 模式逐个返回节点中 LLM 生成的 token, 只转发 generate 节点的
+        for stream_mode, data in graph.stream({"topic": topic}, stream_mode=["messages", "values"]):
+            if stream_mode == "values":
+                answer = data.get("answer", answer)
+                continue
+            chunk, metadata = data
+            text = chunk.content if isinstance(getattr(chunk, "content", None), str) else ""
+            if metadata.get("langgraph_node") != "generate" or not text:
+                continue
+            streamed = True
+            f.write(text)
+            f.flush()
+            if not by_line:
+                yield text
+                continue
+            pending += text
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line + "\n"
+        if not streamed and answer:
+            # the model did not stream: write and split the complete answer
+            f.write(answer)
+            if not by_line:
+                yield answer
+            else:
+                pending = answer
+        if pending and by_line:
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line + "\n"
+            if pending:
+                yield pending
     print("Summary generation completed!")
-    
-    script = response["answer"]
-    save_script(script)
-    print("Script saved successfully!")
-    
-    return script
-
-def save_script(script, file_path= os.path.join(podcast_path, "podcast_script.txt")):
+    print(f"Script saved to {file_path}")
+    providers.report_llm_cache()
+    # the dropped near-duplicates are covered by their representative
+    get_store(base_dir).catalog.set_summary_status(loaded_ids, "summarized")
+
+def run_summarizer(topic, **options):
+    """
+    Generate the podcast script and return it (None when there is nothing
+    to summarize), see stream_summarizer for the options
+    """
+    script = "".join(stream_summarizer(topic, **options))
+    return script or None
+
+def save_script(script, file_path=script_path):
     if os.path.exists(file_path):
         print(f"File '{file_path}' already exists, overwriting previous content...")
     if not isinstance(script, str):
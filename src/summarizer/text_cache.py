@@ -0,0 +1,102 @@
+# Cache of the text extracted from html mails
+# 解析结果缓存: 以 HTML 内容的哈希 + 提取器版本为键, 压缩后保存在邮件目录的 SQLite 文件中,
+# 总大小超过上限时按最近使用时间淘汰; 邮件没有变化时重新加载只需要读文件和查表
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from .html_extractor import EXTRACTOR_VERSION
+from ..utils.cache_eviction import evict_least_recently_used
+
+CACHE_FILE = "text_cache.sqlite3"
+
+# compressed bytes kept in the cache
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parsed_text (
+    key TEXT PRIMARY KEY,
+    text BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_parsed_text_used ON parsed_text(used_at);
+"""
+
+EXTRACTOR_VERSIONS = {
+    "fast": EXTRACTOR_VERSION,
+    "unstructured": "unstructured-1",
+}
+
+
+class TextCache:
+    def __init__(self, path, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(html, extractor):
+        """sha256 of the html bytes + the extractor version"""
+        return f"{hashlib.sha256(html).hexdigest()}:{EXTRACTOR_VERSIONS.get(extractor, extractor)}"
+
+    def get_many(self, keys):
+        """{key: text} for the cached keys, marks them as recently used"""
+        found, keys = {}, list(keys)
+        with self.lock, self.conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, text FROM parsed_text WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                found.update((key, zlib.decompress(text).decode("utf-8")) for key, text in rows)
+            now = time.time()
+            self.conn.executemany("UPDATE parsed_text SET used_at = ? WHERE key = ?", [(now, key) for key in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, texts):
+        """texts: {key: text}; evicts the least recently used entries when the cache is over max_bytes"""
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        for key, text in texts.items():
+            data = zlib.compress(text.encode("utf-8"), 6)
+            rows.append((key, data, len(data), now))
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO parsed_text (key, text, size, used_at) VALUES (?, ?, ?, ?)",
+                                  rows)
+            evict_least_recently_used(self.conn, "parsed_text", self.max_bytes)
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM parsed_text")
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Parsed text cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_text_cache(root):
+    """The TextCache next to the catalog of the mail store at root"""
+    path = os.path.join(os.path.abspath(root), CACHE_FILE)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = TextCache(path)
+        return _caches[path]
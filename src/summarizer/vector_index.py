@@ -0,0 +1,145 @@
+# Incremental FAISS index of the mail chunks
+# 每封邮件单独分块, 块 ID = 邮件 ID + 块在正文中的偏移, 在邮件内容不变时保持稳定;
+# 更新索引时只嵌入新的或内容改变的邮件, 删除已不在邮件库中的邮件的块,
+# 索引先写入临时目录再替换旧的索引, 中途失败不会留下损坏的索引
+
+import hashlib
+import os
+import shutil
+
+from ..utils import providers
+
+current_dir = os.path.dirname(__file__)
+
+index_dir = os.path.join(current_dir, "..", "..", "temp", "vector_store_faiss")
+
+EMBEDDING_MODEL = "nomic-embed-text"
+
+# 邮件通常比普通文本更短，适当增大块大小; 适当的重叠以保持上下文
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+
+
+def chunk_id(msg_id, offset):
+    return f"{msg_id}:{offset}"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_mails(docs):
+    """
+    Chunks of the mails (documents with metadata["id"]), each with a
+    stable id and the hash of the whole mail text in its metadata
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", " ", ""],  # 按换行、空格优先拆分
+        add_start_index=True    # 记录原始位置
+    )
+    chunks, ids = [], []
+    for doc in docs:
+        digest = content_hash(doc.page_content)
+        seen = set()
+        for chunk in text_splitter.split_documents([doc]):
+            chunk_key = chunk_id(doc.metadata["id"], chunk.metadata["start_index"])
+            if chunk_key in seen:
+                continue  # repeated text can be found at the same offset twice
+            seen.add(chunk_key)
+            chunk.metadata["content_hash"] = digest
+            chunks.append(chunk)
+            ids.append(chunk_key)
+    return chunks, ids
+
+
+def load_index(path=index_dir, embeddings=None):
+    """The saved index, None if there is none"""
+    from langchain_community.vectorstores import FAISS
+
+    if not os.path.exists(path) and os.path.exists(f"{path}.old"):
+        # interrupted between the two renames of save_index
+        os.replace(f"{path}.old", path)
+    if not os.path.exists(os.path.join(path, "index.faiss")):
+        return None
+    embeddings = embeddings or providers.get("ollama_embeddings", model=EMBEDDING_MODEL)
+    return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+
+def save_index(vector_store, path=index_dir):
+    """Write the index next to the old one, then swap the directories"""
+    tmp_path, old_path = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    vector_store.save_local(tmp_path)
+    if os.path.exists(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def indexed_mails(vector_store):
+    """{message id: (content hash, [chunk ids])} of the mails in the index"""
+    mails = {}
+    for doc in vector_store.get_by_ids(list(vector_store.index_to_docstore_id.values())):
+        # chunks of indexes built before the chunk ids (one merged document) have no message id
+        digest, ids = mails.setdefault(doc.metadata.get("id"), (doc.metadata.get("content_hash"), []))
+        ids.append(doc.id)
+    return mails
+
+
+def update_index(docs, path=index_dir, embeddings=None):
+    """
+    Bring the index at path up to date with docs, the current mails
+    (documents with metadata["id"]). Unchanged mails are not embedded
+    again, changed mails replace their chunks, mails that are no longer
+    in docs are removed. Returns (vector store or None, report dict).
+    """
+    from langchain_community.vectorstores import FAISS
+
+    embeddings = embeddings or providers.get("ollama_embeddings", model=EMBEDDING_MODEL)
+    vector_store = load_index(path, embeddings)
+    indexed = indexed_mails(vector_store) if vector_store is not None else {}
+
+    current = {doc.metadata["id"]: doc for doc in docs}
+    changed = [doc for msg_id, doc in current.items()
+               if indexed.get(msg_id, (None,))[0] != content_hash(doc.page_content)]
+    changed_ids = {doc.metadata["id"] for doc in changed}
+    stale = [msg_id for msg_id in indexed if msg_id not in current or msg_id in changed_ids]
+    report = {
+        "added": len(changed_ids - indexed.keys()),
+        "updated": len(changed_ids & indexed.keys()),
+        "removed": sum(1 for msg_id in indexed if msg_id not in current),
+        "unchanged": len(current) - len(changed),
+        "embedded_chunks": 0,
+    }
+
+    deleted_ids = [chunk for msg_id in stale for chunk in indexed[msg_id][1]]
+    if deleted_ids:
+        vector_store.delete(deleted_ids)
+    chunks, ids = split_mails(changed)
+    if chunks:
+        if vector_store is None:
+            vector_store = FAISS.from_documents(chunks, embeddings, ids=ids)
+        else:
+            vector_store.add_documents(chunks, ids=ids)
+        report["embedded_chunks"] = len(chunks)
+        if hasattr(embeddings, "report"):
+            embeddings.report()
+    if deleted_ids or chunks:
+        save_index(vector_store, path)
+        # retrieval loads the new index on its next use
+        providers.reset("faiss_index")
+    report["chunks"] = len(vector_store.index_to_docstore_id) if vector_store is not None else 0
+    return vector_store, report
+
+
+@providers.provider("faiss_index")
+def faiss_index(path=index_dir, embedding_model=EMBEDDING_MODEL):
+    vector_store = load_index(path, providers.get("ollama_embeddings", model=embedding_model))
+    if vector_store is None:
+        raise FileNotFoundError(f"No vector index in {path}, build it with document_loader first")
+    return vector_store
@@ -0,0 +1,24 @@
+# Size-capped eviction shared by the SQLite caches (parsed text, LLM responses)
+# 缓存总大小超过上限时按最近使用时间淘汰, 一次淘汰到上限的 80%, 避免每次写入都要淘汰
+
+# fraction of the limit a full cache is trimmed to
+EVICT_TO_FRACTION = 0.8
+
+
+def evict_least_recently_used(conn, table, max_bytes):
+    """
+    Delete the least recently used rows of `table` (which has size and
+    used_at columns) until their total size is at EVICT_TO_FRACTION of
+    max_bytes, if it is over max_bytes. rowid orders the rows used at the
+    same time, which would otherwise all go at once. Runs in the caller's
+    transaction, returns the number of rows deleted.
+    """
+    total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+    excess = total - int(max_bytes * EVICT_TO_FRACTION)
+    count = conn.execute(
+        f"SELECT COUNT(*) + 1 FROM (SELECT SUM(size) OVER (ORDER BY used_at, rowid) AS freed FROM {table}) "
+        "WHERE freed < ?", (excess,)).fetchone()[0]
+    return conn.execute(f"DELETE FROM {table} WHERE rowid IN "
+                        f"(SELECT rowid FROM {table} ORDER BY used_at, rowid LIMIT ?)", (count,)).rowcount
@@ -0,0 +1,311 @@
+# SQLite message catalog shared by every pipeline stage
+# 邮件目录: 记录每封邮件的 id、会话、发件人、主题、日期、内容哈希、分类、总结状态和文件位置,
+# 各阶段通过索引查询, 不再遍历 temp/mails
+
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+CATALOG_FILE = "catalog.sqlite3"
+
+CATEGORIES = ["工作", "技术", "新闻", "其他"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    name TEXT,
+    date INTEGER,
+    date_header TEXT,
+    body_hash TEXT,
+    category TEXT,
+    summary_status TEXT NOT NULL DEFAULT 'pending',
+    dir TEXT,
+    html_path TEXT,
+    text_path TEXT,
+    added_at INTEGER,
+    body_status TEXT NOT NULL DEFAULT 'fetched',
+    snippet TEXT,
+    size_estimate INTEGER,
+    plain_complete INTEGER,
+    content_key TEXT,
+    category_source TEXT,
+    user_id TEXT,
+    lines_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date);
+CREATE INDEX IF NOT EXISTS idx_messages_category ON messages(category, date);
+CREATE INDEX IF NOT EXISTS idx_messages_body_hash ON messages(body_hash);
+CREATE TABLE IF NOT EXISTS dedup_index (
+    dir TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS classification_cache (
+    key TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    used_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_used ON classification_cache(used_at);
+CREATE TABLE IF NOT EXISTS summary_cache (
+    key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mail_lines (
+    id TEXT NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (id, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mail_lines_line ON mail_lines(line);
+"""
+
+# created after the migrations, content_key may be a new column
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_messages_content_key ON messages(content_key);
+"""
+
+COLUMNS = [
+    "id", "thread_id", "sender", "subject", "name", "date", "date_header", "body_hash",
+    "category", "summary_status", "dir", "html_path", "text_path", "added_at",
+    "body_status", "snippet", "size_estimate", "plain_complete", "content_key",
+    "category_source", "user_id", "lines_hash",
+]
+
+# Columns added after the first version of the schema: {column: definition}
+ADDED_COLUMNS = {
+    "body_status": "TEXT NOT NULL DEFAULT 'fetched'",
+    "snippet": "TEXT",
+    "size_estimate": "INTEGER",
+    "plain_complete": "INTEGER",
+    "content_key": "TEXT",
+    "category_source": "TEXT",
+    "user_id": "TEXT",
+    "lines_hash": "TEXT",
+}
+
+
+def parse_date(date_header):
+    """Date header -> unix timestamp, None if it cannot be parsed"""
+    if not date_header:
+        return None
+    try:
+        return int(parsedate_to_datetime(date_header).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class MailCatalog:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(INDEXES)
+
+    def _migrate(self):
+        """Add the columns missing from catalogs created by an older version"""
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {definition}")
+        self.conn.commit()
+
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(sql, rows)
+
+    def upsert(self, entry):
+        """
+        Insert or update a message, keeps the category, summary status and
+        counted lines of an existing row
+        """
+        row = {column: entry.get(column) for column in COLUMNS}
+        row["added_at"] = row["added_at"] or int(time.time())
+        row["summary_status"] = row["summary_status"] or "pending"
+        row["body_status"] = row["body_status"] or "fetched"
+        updates = ", ".join(f"{c} = excluded.{c}" for c in COLUMNS
+                            if c not in ("id", "category", "category_source", "summary_status", "added_at",
+                                         "lines_hash"))
+        self.execute(
+            f"INSERT INTO messages ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join(':' + c for c in COLUMNS)}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            row,
+        )
+
+    def get(self, msg_id):
+        rows = self.execute("SELECT * FROM messages WHERE id = ?", (msg_id,))
+        return dict(rows[0]) if rows else None
+
+    def remove(self, msg_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dedup_index WHERE dir IN (SELECT dir FROM messages WHERE id = ?)", (msg_id,))
+            self.conn.execute("DELETE FROM mail_lines WHERE id = ?", (msg_id,))
+            self.conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dedup_index")
+            self.conn.execute("DELETE FROM mail_lines")
+            self.conn.execute("DELETE FROM messages")
+
+    def find_by_content_key(self, content_key):
+        """Id of a message with this content key, None if there is none"""
+        rows = self.execute("SELECT id FROM messages WHERE content_key = ? LIMIT 1", (content_key,))
+        return rows[0]["id"] if rows else None
+
+    def dedup_signatures(self):
+        """{dir: (size, mtime_ns, hash)} of the duplicate detection index"""
+        return {row["dir"]: (row["size"], row["mtime_ns"], row["hash"])
+                for row in self.execute("SELECT * FROM dedup_index")}
+
+    def update_dedup_signatures(self, rows):
+        """rows: [(dir, size, mtime_ns, hash)]"""
+        self.executemany("INSERT OR REPLACE INTO dedup_index (dir, size, mtime_ns, hash) VALUES (?, ?, ?, ?)", rows)
+
+    def cached_classifications(self, keys):
+        """{key: category} for the keys found in the classification cache, marks them as used"""
+        found, now = {}, int(time.time())
+        keys = list(keys)
+        # stay below SQLITE_MAX_VARIABLE_NUMBER
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.execute(
+                f"SELECT key, category FROM classification_cache WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update((row["key"], row["category"]) for row in rows)
+        self.executemany("UPDATE classification_cache SET used_at = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def cache_classifications(self, categories):
+        """categories: {key: category}"""
+        now = int(time.time())
+        self.executemany(
+            "INSERT OR REPLACE INTO classification_cache (key, category, created_at, used_at) VALUES (?, ?, ?, ?)",
+            [(key, category, now, now) for key, category in categories.items()])
+
+    def evict_classifications(self, max_age=None, max_entries=None):
+        """Drop cache entries older than max_age seconds, then the least recently used beyond max_entries"""
+        with self.lock, self.conn:
+            removed = 0
+            if max_age is not None:
+                removed += self.conn.execute("DELETE FROM classification_cache WHERE created_at < ?",
+                                             (int(time.time() - max_age),)).rowcount
+            if max_entries is not None:
+                removed += self.conn.execute(
+                    "DELETE FROM classification_cache WHERE key IN ("
+                    "SELECT key FROM classification_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,)).rowcount
+        return removed
+
+    def cached_summaries(self, keys):
+        """{key: summary} for the keys found in the per-mail summary cache"""
+        found, keys = {}, list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.execute(
+                f"SELECT key, summary FROM summary_cache WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update((row["key"], row["summary"]) for row in rows)
+        return found
+
+    def cache_summary(self, key, summary):
+        self.execute("INSERT OR REPLACE INTO summary_cache (key, summary, created_at) VALUES (?, ?, ?)",
+                     (key, summary, int(time.time())))
+
+    def unindexed_line_entries(self):
+        """Fetched messages whose lines are not counted yet, or were counted for another body"""
+        rows = self.execute("SELECT * FROM messages WHERE body_status = 'fetched' AND lines_hash IS NOT body_hash "
+                            "ORDER BY rowid")
+        return [dict(row) for row in rows]
+
+    def index_lines(self, mails):
+        """mails: [(message_id, body_hash, line hashes)], replaces the lines counted for these messages"""
+        with self.lock, self.conn:
+            for msg_id, body_hash, lines in mails:
+                self.conn.execute("DELETE FROM mail_lines WHERE id = ?", (msg_id,))
+                self.conn.executemany("INSERT OR IGNORE INTO mail_lines (id, line) VALUES (?, ?)",
+                                      [(msg_id, line) for line in lines])
+                self.conn.execute("UPDATE messages SET lines_hash = ? WHERE id = ?", (body_hash, msg_id))
+
+    def frequent_lines(self, fraction, min_messages):
+        """
+        Hashes of the lines found in at least `fraction` of the messages
+        whose lines were counted, and in at least `min_messages` of them
+        """
+        with self.lock, self.conn:
+            counted = self.conn.execute("SELECT COUNT(*) FROM messages WHERE lines_hash IS NOT NULL").fetchone()[0]
+            rows = self.conn.execute("SELECT line FROM mail_lines GROUP BY line HAVING COUNT(*) >= ?",
+                                     (max(min_messages, fraction * counted),)).fetchall()
+        return {row["line"] for row in rows}
+
+    def count(self):
+        return self.execute("SELECT COUNT(*) FROM messages")[0][0]
+
+    def query(self, since=None, until=None, category=None, summary_status=None, uncategorized=False,
+              body_status=None):
+        """
+        Messages ordered by date (then insertion), filtered on the indexed
+        columns. `since`/`until` are unix timestamps.
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("date >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            params.append(until)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if uncategorized:
+            conditions.append("category IS NULL")
+        if summary_status is not None:
+            conditions.append("summary_status = ?")
+            params.append(summary_status)
+        if body_status is not None:
+            conditions.append("body_status = ?")
+            params.append(body_status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.execute(f"SELECT * FROM messages {where} ORDER BY date, rowid", params)
+        return [dict(row) for row in rows]
+
+    def set_categories(self, categories, sources=None):
+        """categories: {message_id: category}, sources: {message_id: tier that chose the category}"""
+        sources = sources or {}
+        self.executemany("UPDATE messages SET category = ?, category_source = ? WHERE id = ?",
+                         [(category, sources.get(msg_id), msg_id) for msg_id, category in categories.items()])
+
+    def labeled_entries(self):
+        """
+        Messages whose category was decided by the LLM or confirmed by the
+        user (rows without a source predate the classification tiers)
+        """
+        rows = self.execute("SELECT * FROM messages WHERE category IS NOT NULL AND "
+                            "(category_source IS NULL OR category_source IN ('llm', 'cache', 'confirmed')) "
+                            "ORDER BY rowid")
+        return [dict(row) for row in rows]
+
+    def set_summary_status(self, msg_ids, status):
+        self.executemany("UPDATE messages SET summary_status = ? WHERE id = ?",
+                         [(status, msg_id) for msg_id in msg_ids])
+
+    def category_mapping(self, categories=CATEGORIES):
+        """{category: [mail name]}, the format of the old category_mapping.json"""
+        mapping = {category: [] for category in categories}
+        for row in self.execute("SELECT category, name FROM messages WHERE category IS NOT NULL ORDER BY date, rowid"):
+            mapping.setdefault(row["category"], []).append(row["name"])
+        return mapping
@@ -1,64 +1,128 @@
 import os
 import hashlib
 from collections import defaultdict
-import shutil
+
+from .mail_store import get_store
+
+def content_key(data):
+    """邮件正文（解码后的 HTML 或纯文本）的哈希, 写入前用于判断是否重复"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def find_duplicate_of(store, key):
+    """返回内容相同的已有邮件 id, 没有则返回 None"""
+    if not key:
+        return None
+    return store.catalog.find_by_content_key(key)
+
+def mail_signature(mail_dir):
+    """邮件文件夹的总大小和最新修改时间（只做 stat, 不读文件）"""
+    total_size, mtime_ns = 0, 0
+    with os.scandir(mail_dir) as it:
+        for item in it:
+            if item.is_file() and not item.name.endswith(".tmp"):
+                stat = item.stat()
+                total_size += stat.st_size
+                mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+    return total_size, mtime_ns
 
 def calculate_mail_hash(mail_dir):
     """计算邮件文件夹内容的哈希值"""
-    hash_md5 = hashlib.md5()
-    
+    hash_blake2b = hashlib.blake2b(digest_size=16)
+
     # 按文件名排序以确保一致性
     files = sorted(os.listdir(mail_dir))
-    
+
     for filename in files:
         filepath = os.path.join(mail_dir, filename)
-        if os.path.isfile(filepath):
+        if os.path.isfile(filepath) and not filename.endswith(".tmp"):
             try:
                 with open(filepath, "rb") as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        hash_md5.update(chunk)
+                    for chunk in iter(lambda: f.read(65536), b""):
+                        hash_blake2b.update(chunk)
             except (IOError, OSError):
                 continue
-    
-    return hash_md5.hexdigest()
+
+    return hash_blake2b.hexdigest()
+
+def calculate_metadata_hash(entry):
+    """只获取了元数据的邮件: 用发件人、主题和摘要计算哈希"""
+    hash_md5 = hashlib.md5()
+    for field in ("sender", "subject", "snippet"):
+        hash_md5.update((entry.get(field) or "").encode("utf-8"))
+        hash_md5.update(b"\0")
+    return "meta:" + hash_md5.hexdigest()
 
 def find_duplicate_mails(base_dir):
-    """查找重复的邮件文件夹"""
+    """
+    查找重复的邮件, 返回 {哈希: [message id]}
+
+    先按文件夹总大小分组, 只有大小相同的邮件才需要计算哈希; 哈希和
+    (大小, 修改时间) 一起保存在邮件目录的 dedup_index 表中, 未改变的邮件不会重新计算
+    """
+    store = get_store(base_dir)
+    cached = store.catalog.dedup_signatures()
     mail_hashes = defaultdict(list)
-    
-    # 遍历所有邮件文件夹
-    for mail_dir in os.listdir(base_dir):
-        full_path = os.path.join(base_dir, mail_dir)
-        if os.path.isdir(full_path):
-            try:
-                mail_hash = calculate_mail_hash(full_path)
-                mail_hashes[mail_hash].append(full_path)
-            except Exception as e:
-                print(f"Error processing {mail_dir}: {e}")
-                continue
-    
-    # 返回有重复的邮件文件夹
-    return {h: paths for h, paths in mail_hashes.items() if len(paths) > 1}
+    by_size = defaultdict(list)
+
+    # 遍历邮件库中的所有邮件, 只读取文件大小
+    for entry in store.entries():
+        if entry["body_status"] == "pending":
+            mail_hashes[calculate_metadata_hash(entry)].append(entry["id"])
+            continue
+        try:
+            size, mtime_ns = mail_signature(store.message_dir(entry["id"]))
+        except OSError as e:
+            print(f"Error processing {entry['name']}: {e}")
+            continue
+        by_size[size].append((entry, mtime_ns))
+
+    # 只对大小相同的邮件计算（或复用）哈希
+    updated, rehashed = [], 0
+    for size, group in by_size.items():
+        if len(group) < 2:
+            continue
+        for entry, mtime_ns in group:
+            signature = cached.get(entry["dir"])
+            if signature and signature[:2] == (size, mtime_ns):
+                mail_hash = signature[2]
+            else:
+                try:
+                    mail_hash = calculate_mail_hash(store.message_dir(entry["id"]))
+                except Exception as e:
+                    print(f"Error processing {entry['name']}: {e}")
+                    continue
+                updated.append((entry["dir"], size, mtime_ns, mail_hash))
+                rehashed += 1
+            mail_hashes[mail_hash].append(entry["id"])
+
+    store.catalog.update_dedup_signatures(updated)
+    print(f"Duplicate check: {len(by_size)} distinct sizes, {rehashed} mails hashed")
+
+    # 返回有重复的邮件
+    return {h: ids for h, ids in mail_hashes.items() if len(ids) > 1}
 
 def delete_duplicate_mails(base_dir):
-    """删除重复的邮件文件夹"""
+    """删除重复的邮件"""
+    store = get_store(base_dir)
     duplicates = find_duplicate_mails(base_dir)
-    
-    for mail_hash, mail_dirs in duplicates.items():
-        # 保留第一个文件夹，删除其他重复的
-        for mail_dir in mail_dirs[1:]:
+
+    for mail_hash, msg_ids in duplicates.items():
+        # 保留最早的邮件，删除其他重复的
+        for msg_id in msg_ids[1:]:
             try:
-                print(f"Deleting duplicate mail folder: {mail_dir}")
-                shutil.rmtree(mail_dir)
+                print(f"Deleting duplicate mail: {store.get(msg_id)['name']} ({msg_id})")
+                store.remove(msg_id)
             except OSError as e:
-                print(f"Error deleting {mail_dir}: {e}")
+                print(f"Error deleting {msg_id}: {e}")
 
 if __name__ == "__main__":
-    from email_fetcher.email_fetcher_api import fetcher_temp_path
-    
+    from ..email_fetcher.email_fetcher_api import fetcher_temp_path
+
     if os.path.exists(fetcher_temp_path):
         print(f"Cleaning duplicate mails in: {fetcher_temp_path}")
         delete_duplicate_mails(fetcher_temp_path)
         print("Duplicate mail cleaning completed.")
     else:
-        print(f"Temp directory not found: {fetcher_temp_path}") 
\ No newline at end of file
+        print(f"Temp directory not found: {fetcher_temp_path}")
@@ -0,0 +1,176 @@
+# Disk-backed cache of text embeddings
+# 以文本的 sha256 为键缓存向量: 向量按行追加到 float32 文件中并通过内存映射读取,
+# 键按同样的顺序追加到文本文件中; 只有缓存中没有的文本才按批次请求嵌入模型,
+# 在没有变化的邮件上重建索引时不会发出任何嵌入请求
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 每次请求嵌入的文本数量
+EMBED_BATCH_SIZE = 64
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.txt"
+META_FILE = "meta.json"
+
+
+def text_key(text, kind="document"):
+    """Some models embed queries differently, so they get their own keys"""
+    return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only float32 matrix on disk with one row per key. Rows are
+    written before their keys, so after an interruption the rows without
+    a key are ignored and overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.dim = None
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        self.rows = {}
+        keys_path = os.path.join(path, KEYS_FILE)
+        if os.path.exists(keys_path) and self.dim:
+            with open(keys_path, "r+", encoding="utf-8", newline="\n") as f:
+                content = f.read()
+                if not content.endswith("\n"):
+                    # a key was cut off while being written: drop it, its row is overwritten later
+                    content = content[:content.rfind("\n") + 1]
+                    f.seek(0)
+                    f.truncate()
+                    f.write(content)
+            keys = content.split()
+            complete = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            self.rows = {key: row for row, key in enumerate(keys[:complete])}
+        self._matrix = None
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, VECTORS_FILE)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _map(self):
+        if self._matrix is None or self._matrix.shape[0] < len(self.rows):
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return self._matrix
+
+    def get(self, keys):
+        """(rows of the cached keys, {position in keys: row}) as a float32 matrix and an index"""
+        with self.lock:
+            found = {i: self.rows[key] for i, key in enumerate(keys) if key in self.rows}
+            if not found:
+                return np.zeros((0, self.dim or 0), dtype=np.float32), {}
+            matrix = np.asarray(self._map()[np.fromiter(found.values(), dtype=np.int64)])
+        return matrix, {i: n for n, i in enumerate(found)}
+
+    def add(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.rows]
+            if not new:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(os.path.join(self.path, META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            with open(self._vectors_path, "r+b" if os.path.exists(self._vectors_path) else "wb") as f:
+                # drop rows whose keys were never written
+                f.truncate(len(self.rows) * 4 * self.dim)
+                f.seek(0, os.SEEK_END)
+                f.write(np.stack([vector for _, vector in new]).tobytes())
+            with open(os.path.join(self.path, KEYS_FILE), "a", encoding="utf-8", newline="\n") as f:
+                f.write("".join(f"{key}\n" for key, _ in new))
+            for key, _ in new:
+                self.rows[key] = len(self.rows)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path):
+    """One EmbeddingStore per directory, shared by all the embedders that use it"""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path)
+        return _stores[path]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embedder: vectors are looked up by text hash in an
+    EmbeddingStore, the misses are embedded batch_size texts at a time
+    """
+
+    def __init__(self, embeddings, path, batch_size=EMBED_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.store = get_embedding_store(path)
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.embed_seconds = 0.0
+
+    def _embed(self, texts, kind):
+        keys = [text_key(text, kind) for text in texts]
+        cached, positions = self.store.get(keys)
+        self.hits += len(positions)
+        # identical texts in one call are embedded once
+        missing = {}
+        for i, key in enumerate(keys):
+            if i not in positions:
+                missing.setdefault(key, texts[i])
+        self.misses += len(missing)
+
+        embedded = {}
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch = missing_keys[start:start + self.batch_size]
+            begin = time.perf_counter()
+            if kind == "query":
+                vectors = [self.embeddings.embed_query(missing[key]) for key in batch]
+            else:
+                vectors = self.embeddings.embed_documents([missing[key] for key in batch])
+            self.embed_seconds += time.perf_counter() - begin
+            self.requests += 1
+            vectors = np.asarray(vectors, dtype=np.float32)
+            self.store.add(batch, vectors)
+            embedded.update(zip(batch, vectors))
+
+        return [cached[positions[i]].tolist() if i in positions else embedded[key].tolist()
+                for i, key in enumerate(keys)]
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "document")
+
+    def embed_query(self, text):
+        return self._embed([text], "query")[0]
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        throughput = self.misses / self.embed_seconds if self.embed_seconds else 0.0
+        print(f"Embedding cache: {self.hits} hits, {self.misses} embedded in {self.requests} requests "
+              f"({rate:.0%} hit rate, {throughput:.1f} texts/s), {len(self.store)} vectors stored")
+
+
+def cache_dir(root, model):
+    """One store per model, vectors of different models cannot be mixed"""
+    return os.path.join(root, re.sub(r"[^\w.-]", "_", model))
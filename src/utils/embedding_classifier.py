@@ -0,0 +1,107 @@
+# Embedding-centroid classifier over nomic-embed-text vectors
+# 用本地 Ollama 的 nomic-embed-text 对“主题 + 摘要”做批量向量化, 每个类别保存一个质心,
+# 用一次矩阵乘法（余弦相似度）完成分类; 质心从已确认的分类结果增量更新, 完全离线运行
+
+import os
+
+import numpy as np
+
+from . import providers
+
+EMBEDDING_MODEL = "nomic-embed-text"
+
+# 每次请求嵌入的文本数量
+EMBED_BATCH_SIZE = 64
+
+# nomic-embed-text 的任务前缀
+TASK_PREFIX = "classification: "
+
+# 摘要截取的长度
+SNIPPET_CHARS = 300
+
+
+def mail_text(entry):
+    """主题 + 摘要, 没有主题时使用邮件名称"""
+    subject = entry.get("subject") or (entry.get("name") or "").replace("_", " ")
+    snippet = (entry.get("snippet") or "")[:SNIPPET_CHARS]
+    return f"{subject}\n{snippet}".strip()
+
+
+class CentroidClassifier:
+    """
+    Per-category sums of normalized embeddings; a mail goes to the category
+    whose centroid has the highest cosine similarity with it.
+    """
+
+    def __init__(self, categories, model=EMBEDDING_MODEL, batch_size=EMBED_BATCH_SIZE, embeddings=None):
+        self.categories = list(categories)
+        self.model = model
+        self.batch_size = batch_size
+        self._embeddings = embeddings
+        self.sums = None
+        self.counts = np.zeros(len(self.categories), dtype=np.int64)
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = providers.get("ollama_embeddings", model=self.model)
+        return self._embeddings
+
+    @property
+    def trained(self):
+        return bool(self.counts.any())
+
+    def embed(self, texts):
+        """(len(texts), dim) unit vectors, one embedding request per batch_size texts"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [TASK_PREFIX + text for text in texts[start:start + self.batch_size]]
+            vectors.extend(self.embeddings.embed_documents(batch))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def update(self, texts, labels):
+        """Add confirmed labels to the centroids"""
+        pairs = [(text, label) for text, label in zip(texts, labels) if label in self.categories]
+        if not pairs:
+            return
+        vectors = self.embed([text for text, _ in pairs])
+        if self.sums is None:
+            self.sums = np.zeros((len(self.categories), vectors.shape[1]), dtype=np.float32)
+        rows = np.array([self.categories.index(label) for _, label in pairs])
+        np.add.at(self.sums, rows, vectors)
+        np.add.at(self.counts, rows, 1)
+
+    def predict(self, texts):
+        """([category], [cosine similarity]), categories without examples are never chosen"""
+        if not texts:
+            return [], np.zeros(0, dtype=np.float32)
+        vectors = self.embed(texts)
+        norms = np.linalg.norm(self.sums, axis=1, keepdims=True)
+        centroids = self.sums / np.where(norms == 0, 1, norms)
+        similarity = vectors @ centroids.T
+        similarity[:, self.counts == 0] = -np.inf
+        best = similarity.argmax(axis=1)
+        return [self.categories[i] for i in best], similarity[np.arange(len(texts)), best]
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, categories=np.array(self.categories), model=np.array(self.model),
+                     sums=self.sums if self.sums is not None else np.zeros((0, 0), dtype=np.float32),
+                     counts=self.counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, categories, model=EMBEDDING_MODEL, **options):
+        """Centroids saved at path, None if there are none or they belong to other categories or another model"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if list(data["categories"]) != list(categories) or str(data["model"]) != model:
+                return None
+            classifier = cls(categories, model, **options)
+            classifier.sums = data["sums"] if data["sums"].size else None
+            classifier.counts = data["counts"]
+        return classifier
@@ -0,0 +1,197 @@
+# Persistent cache of LLM responses
+# LLM 回复缓存: 以规范化的提示词 + 模型名称 + 采样参数为键, 保存在 temp 目录的 SQLite 文件中;
+# 条目超过保留时间或总大小超过上限时淘汰. 缓存通过 LangChain 模型的 cache 参数接入,
+# invoke/ainvoke 和流式调用（LangGraph 的 "messages" 模式）都先查缓存, 命中时不请求模型
+
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, Generation, GenerationChunk
+
+from .cache_eviction import evict_least_recently_used
+
+warnings.filterwarnings("ignore", message="The function `loads` is in beta")
+
+# the only classes a cached response may contain
+RESPONSE_CLASSES = [Generation, GenerationChunk, ChatGeneration, ChatGenerationChunk, AIMessage, AIMessageChunk]
+
+# 回复保留的时间（秒）和压缩后的总大小
+MAX_AGE = 30 * 24 * 3600
+MAX_CACHE_BYTES = 128 * 1024 * 1024
+
+# 设置 MAILSORA_LLM_CACHE=0 时模型不使用缓存
+ENABLED = os.environ.get("MAILSORA_LLM_CACHE", "1") != "0"
+
+# parameters that change the answer; the rest (timeout, retries, streaming...) do not
+SAMPLING_PARAMS = {"temperature", "top_p", "top_k", "max_tokens", "num_predict", "num_ctx", "seed", "stop",
+                   "presence_penalty", "frequency_penalty", "repeat_penalty", "mirostat", "format", "reasoning"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_responses_created ON llm_responses(created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_responses_used ON llm_responses(used_at);
+"""
+
+
+def _normalize_text(text):
+    return " ".join(text.split())
+
+
+def normalize_prompt(prompt):
+    """
+    Prompts that differ only in whitespace get the same key. Chat models
+    pass their messages serialized as JSON, those are reduced to the
+    message types and contents.
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        messages = None
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and "kwargs" in m for m in messages):
+        return _normalize_text(prompt)
+    parts = []
+    for message in messages:
+        kwargs = message["kwargs"]
+        content = kwargs.get("content", "")
+        content = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, sort_keys=True)
+        parts.append(f"{kwargs.get('type', message['id'][-1])}: {_normalize_text(content)}")
+    return "\n".join(parts)
+
+
+def _call_params(llm_string):
+    """Sampling parameters passed with the call, from LangChain's description of it"""
+    try:
+        pairs = ast.literal_eval(llm_string.rpartition("---")[2])
+        return {key: value for key, value in pairs if key in SAMPLING_PARAMS and value is not None}
+    except (ValueError, SyntaxError, TypeError):
+        return {}
+
+
+def deterministic(options):
+    """Whether a model created with these options always gives the same answer"""
+    return options.get("temperature") == 0
+
+
+class LLMResponseCache:
+    def __init__(self, path, max_age=MAX_AGE, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # per thread and asyncio task, so that bypass() does not affect concurrent callers
+        self._bypassed = ContextVar(f"llm_cache_bypassed_{id(self)}", default=False)
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, model, **params):
+        """The LangChain cache of one model, params are the options the model was created with"""
+        return BoundResponseCache(self, model, {key: value for key, value in params.items()
+                                                if key in SAMPLING_PARAMS and value is not None})
+
+    @staticmethod
+    def key(prompt, model, params):
+        description = json.dumps([model, params], sort_keys=True, default=str)
+        return hashlib.sha256(f"{description}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    @property
+    def bypassed(self):
+        return self._bypassed.get()
+
+    @contextmanager
+    def bypass(self):
+        """
+        Ask the models again inside this block; their answers still replace
+        the cached ones. Applies to the current thread or asyncio task and
+        the tasks it starts, not to other callers of the cache.
+        """
+        token = self._bypassed.set(True)
+        try:
+            yield
+        finally:
+            self._bypassed.reset(token)
+
+    def get(self, key):
+        """The cached generations, None when missing, expired or bypassed"""
+        if self.bypassed:
+            return None
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT response FROM llm_responses WHERE key = ? AND created_at >= ?",
+                                    (key, now - self.max_age)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE llm_responses SET used_at = ? WHERE key = ?", (now, key))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return loads(zlib.decompress(row[0]).decode("utf-8"), allowed_objects=RESPONSE_CLASSES)
+
+    def put(self, key, model, generations):
+        data = zlib.compress(dumps(generations).encode("utf-8"), 6)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO llm_responses (key, model, response, size, created_at, used_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (key, model, data, len(data), now, now))
+            self.conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.max_age,))
+            evict_least_recently_used(self.conn, "llm_responses", self.max_bytes)
+
+    def clear(self, model=None):
+        with self.lock, self.conn:
+            if model is None:
+                self.conn.execute("DELETE FROM llm_responses")
+            else:
+                self.conn.execute("DELETE FROM llm_responses WHERE model = ?", (model,))
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"LLM response cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)")
+
+
+class BoundResponseCache(BaseCache):
+    """
+    LangChain cache interface for one model. The key uses the model name
+    and sampling parameters given here instead of LangChain's llm_string,
+    which leaves them out for some models (OllamaLLM) and includes
+    settings that do not change the answer for others (streaming).
+    """
+
+    def __init__(self, cache, model, params):
+        self.cache = cache
+        self.model = model
+        self.params = params
+
+    def _key(self, prompt, llm_string):
+        return self.cache.key(prompt, self.model, {**self.params, **_call_params(llm_string)})
+
+    def lookup(self, prompt, llm_string):
+        return self.cache.get(self._key(prompt, llm_string))
+
+    def update(self, prompt, llm_string, return_val):
+        self.cache.put(self._key(prompt, llm_string), self.model, return_val)
+
+    def clear(self, **kwargs):
+        self.cache.clear(self.model)
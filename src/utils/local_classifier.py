@@ -0,0 +1,144 @@
+# Local classification tiers in front of the LLM
+# 分类的前两层: 关键词规则和本地朴素贝叶斯模型（哈希 n-gram 特征, NumPy 计算）,
+# 模型从以往 LLM 的分类结果增量训练, 只有置信度不够的邮件才交给 LLM
+
+import os
+import re
+import zlib
+
+import numpy as np
+
+# 与 mails_sorter 中分类规则的关键词一致, 招聘类优先
+KEYWORD_RULES = [
+    ("工作", ["job", "jobs", "招聘", "职位", "engineer", "developer", "工程师", "intern", "internship", "实习",
+              "hiring", "求职"]),
+    ("技术", ["tutorial", "guide", "weekly", "教程", "指南", "框架", "framework", "周报", "月报"]),
+    ("新闻", ["新闻", "早报", "news", "headlines"]),
+]
+
+# 模型给出的最高概率低于该值时交给 LLM
+CONFIDENCE_THRESHOLD = 0.9
+
+# 训练样本少于该数量时不使用模型
+MIN_TRAINING_SAMPLES = 50
+
+N_FEATURES = 1 << 18
+
+_ASCII_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+
+def _keyword_tokens(text):
+    text = text.lower().replace("_", " ")
+    return set(_ASCII_WORD_RE.findall(text)), text
+
+
+def match_keywords(text):
+    """Category of the first rule with a matching keyword, None if no rule matches"""
+    words, lowered = _keyword_tokens(text)
+    for category, keywords in KEYWORD_RULES:
+        for keyword in keywords:
+            # ascii keywords match whole words, chinese keywords match substrings
+            if (keyword in words) if keyword.isascii() else (keyword in lowered):
+                return category
+    return None
+
+
+def text_features(text):
+    """Hashed features: ascii words and word bigrams, chinese character unigrams and bigrams"""
+    text = text.lower().replace("_", " ")
+    words = _ASCII_WORD_RE.findall(text)
+    grams = words + [a + " " + b for a, b in zip(words, words[1:])]
+    for run in _CJK_RE.findall(text):
+        grams.extend(run)
+        grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams), dtype=np.int64, count=len(grams))
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over hashed n-grams, trained with partial_fit"""
+
+    def __init__(self, categories, alpha=0.1):
+        self.categories = list(categories)
+        self.alpha = alpha
+        self.feature_counts = np.zeros((len(self.categories), N_FEATURES), dtype=np.float64)
+        self.class_counts = np.zeros(len(self.categories), dtype=np.float64)
+        self._log_probs = None
+
+    @property
+    def samples(self):
+        return int(self.class_counts.sum())
+
+    def partial_fit(self, texts, labels):
+        for text, label in zip(texts, labels):
+            if label not in self.categories:
+                continue
+            row = self.categories.index(label)
+            np.add.at(self.feature_counts[row], text_features(text), 1)
+            self.class_counts[row] += 1
+        self._log_probs = None
+
+    def predict_proba(self, texts):
+        """(len(texts), len(categories)) class probabilities"""
+        if self._log_probs is None:
+            smoothed = self.feature_counts + self.alpha
+            self._log_probs = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        log_prior = np.log((self.class_counts + 1) / (self.class_counts.sum() + len(self.categories)))
+        scores = np.tile(log_prior, (len(texts), 1))
+        features = [text_features(text) for text in texts]
+        rows = [i for i, f in enumerate(features) if len(f)]
+        if rows:
+            # one gather + reduceat for the whole batch
+            indices = np.concatenate([features[i] for i in rows])
+            offsets = np.cumsum([0] + [len(features[i]) for i in rows[:-1]])
+            scores[rows] += np.add.reduceat(self._log_probs[:, indices], offsets, axis=1).T
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, categories=np.array(self.categories), feature_counts=self.feature_counts,
+                                class_counts=self.class_counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, categories):
+        """Model saved at path, None if there is none or it was trained on other categories"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if list(data["categories"]) != list(categories):
+                return None
+            model = cls(categories)
+            model.feature_counts = data["feature_counts"]
+            model.class_counts = data["class_counts"]
+        return model
+
+
+class TierStats:
+    """How many mails each tier resolved and how long it took"""
+
+    TIERS = ["cache", "rules", "model", "embedding", "llm"]
+
+    def __init__(self):
+        self.counts = {tier: 0 for tier in self.TIERS}
+        self.seconds = {tier: 0.0 for tier in self.TIERS}
+
+    def record(self, tier, count, seconds):
+        self.counts[tier] += count
+        self.seconds[tier] += seconds
+
+    def report(self):
+        total = sum(self.counts.values())
+        if not total:
+            print("分类统计：没有邮件")
+            return
+        parts = []
+        for tier in self.TIERS:
+            count = self.counts[tier]
+            per_mail = self.seconds[tier] / count * 1000 if count else 0.0
+            parts.append(f"{tier} {count} ({count / total:.0%}, {self.seconds[tier]:.2f}s, {per_mail:.1f}ms/封)")
+        print("分类统计：" + ", ".join(parts))
+
@@ -0,0 +1,190 @@
+# Message-id keyed mail store
+# 邮件按 Gmail message id 保存在分片目录 temp/mails/<shard>/<message_id>/ 下,
+# 元数据（主题、发件人、日期、内容哈希、分类等）记录在 SQLite 邮件目录 catalog.sqlite3 中
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from .catalog import MailCatalog, CATALOG_FILE, parse_date
+from .mail_text import is_plain_text_complete
+
+# 获取当前文件所在目录
+current_dir = os.path.dirname(__file__)
+
+# 构建mails目录的完整路径
+mails_dir = os.path.join(current_dir, "..", "..", "temp", "mails")
+
+# JSON index of the previous store layout, imported into the catalog on first use
+LEGACY_INDEX_FILE = "index.json"
+
+
+def atomic_write(path, chunks):
+    """Write an iterable of bytes to path through a temp file + rename, readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+class MailStore:
+    def __init__(self, root=mails_dir):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.catalog = MailCatalog(os.path.join(self.root, CATALOG_FILE))
+        self._import_legacy_index()
+
+    def _import_legacy_index(self):
+        index_path = os.path.join(self.root, LEGACY_INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "r", encoding="utf-8") as f:
+            for entry in json.load(f).values():
+                self.catalog.upsert({
+                    **entry,
+                    "date": parse_date(entry.get("date")),
+                    "date_header": entry.get("date"),
+                    "body_hash": entry.get("content_hash"),
+                })
+        os.remove(index_path)
+
+    def message_dir(self, msg_id):
+        """temp/mails/<first 2 hex digits of sha1(id)>/<id>"""
+        shard = hashlib.sha1(msg_id.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.root, shard, msg_id)
+
+    def path(self, relative_path):
+        """Absolute path of a file location stored in the catalog"""
+        return os.path.join(self.root, relative_path) if relative_path else None
+
+    def write_file(self, msg_id, filename, data):
+        """Atomically write one file of a message, returns its path"""
+        return self.write_chunks(msg_id, filename, [data])
+
+    def write_chunks(self, msg_id, filename, chunks):
+        """Atomically write one file of a message from an iterable of bytes, returns its path"""
+        message_dir = self.message_dir(msg_id)
+        os.makedirs(message_dir, exist_ok=True)
+        path = os.path.join(message_dir, os.path.basename(filename))
+        atomic_write(path, chunks)
+        return path
+
+    def files(self, msg_id):
+        """Paths of the files of a message, sorted by name"""
+        message_dir = self.message_dir(msg_id)
+        if not os.path.isdir(message_dir):
+            return []
+        return [os.path.join(message_dir, f) for f in sorted(os.listdir(message_dir))
+                if not f.endswith(".tmp")]
+
+    def find_file(self, msg_id, suffix):
+        for path in self.files(msg_id):
+            if path.endswith(suffix):
+                return path
+        return None
+
+    def plain_text_complete(self, msg_id):
+        """
+        None if the message has no text/plain alternative, otherwise whether
+        it can be used instead of parsing the html
+        """
+        text_path = self.find_file(msg_id, ".txt")
+        if not text_path:
+            return None
+        html_path = self.find_file(msg_id, ".html")
+        with open(text_path, "r", encoding="utf-8", errors="replace") as f:
+            plain = f.read()
+        html = None
+        if html_path:
+            with open(html_path, "r", encoding="utf-8", errors="replace") as f:
+                html = f.read()
+        return is_plain_text_complete(plain, html)
+
+    def content_hash(self, msg_id):
+        """sha256 over the contents of the message files"""
+        digest = hashlib.sha256()
+        for path in self.files(msg_id):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def add(self, msg_id, subject="", sender="", date="", name=None, thread_id=None, timestamp=None,
+            body_status="fetched", snippet=None, size_estimate=None, body_hash=None, content_key=None,
+            user_id=None):
+        """
+        Record a message whose files were written with write_file in the
+        catalog. `timestamp` (unix seconds) overrides the parsed Date header.
+        With body_status="pending" only the metadata is known, the body is
+        fetched later. `body_hash` saves reading the files back when the
+        caller already hashed them. `content_key` identifies the body for
+        duplicate detection before anything is written (see
+        clean_duplicate_mails.content_key). `user_id` is the Gmail account
+        the message was fetched from, pending bodies are fetched from it.
+        """
+        def relative(path):
+            return os.path.relpath(path, self.root) if path else None
+
+        self.catalog.upsert({
+            "id": msg_id,
+            "thread_id": thread_id,
+            "sender": sender,
+            "subject": subject,
+            "name": name or subject or msg_id,
+            "date": timestamp if timestamp is not None else parse_date(date),
+            "date_header": date,
+            "body_hash": (body_hash or self.content_hash(msg_id)) if body_status == "fetched" else None,
+            "dir": relative(self.message_dir(msg_id)),
+            "html_path": relative(self.find_file(msg_id, ".html")),
+            "text_path": relative(self.find_file(msg_id, ".txt")),
+            "body_status": body_status,
+            "snippet": snippet,
+            "size_estimate": size_estimate,
+            "plain_complete": self.plain_text_complete(msg_id) if body_status == "fetched" else None,
+            "content_key": content_key,
+            "user_id": user_id,
+        })
+        return self.catalog.get(msg_id)
+
+    def get(self, msg_id):
+        return self.catalog.get(msg_id)
+
+    def entries(self, **filters):
+        """Catalog rows ordered by date, see MailCatalog.query for the filters"""
+        return self.catalog.query(**filters)
+
+    def __contains__(self, msg_id):
+        return self.catalog.get(msg_id) is not None
+
+    def __len__(self):
+        return self.catalog.count()
+
+    def remove(self, msg_id):
+        message_dir = self.message_dir(msg_id)
+        if os.path.isdir(message_dir):
+            shutil.rmtree(message_dir)
+        self.catalog.remove(msg_id)
+
+    def clear(self):
+        """Delete every message, keeps the sqlite databases (catalog and caches) and the saved classifier models"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif ".sqlite3" not in name and not name.endswith(".npz"):
+                os.remove(path)
+        self.catalog.clear()
+
+
+_stores = {}
+
+
+def get_store(root=mails_dir):
+    """Shared MailStore instance for a root directory"""
+    root = os.path.abspath(root)
+    if root not in _stores:
+        _stores[root] = MailStore(root)
+    return _stores[root]
@@ -0,0 +1,52 @@
+# Heuristics on the text/plain alternative of a mail
+# 判断邮件的纯文本部分是否完整, 完整时可以跳过代价很高的 HTML 解析
+
+import re
+
+# plain parts shorter than this are usually "view in browser" stubs
+MIN_PLAIN_CHARS = 200
+
+# the plain part must contain at least this fraction of the visible html text
+MIN_PLAIN_RATIO = 0.5
+
+STUB_MARKERS = [
+    "view this email in your browser",
+    "view it in your browser",
+    "view in browser",
+    "does not support html",
+    "html version",
+    "查看网页版",
+    "浏览器中查看",
+]
+
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+_ENTITY_RE = re.compile(r"&#?\w+;")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def visible_html_length(html):
+    """Rough length of the visible text of an html document, without parsing it"""
+    text = _SCRIPT_STYLE_RE.sub(" ", html)
+    text = _TAG_RE.sub(" ", text)
+    text = _ENTITY_RE.sub(" ", text)
+    return len(_SPACE_RE.sub(" ", text).strip())
+
+
+def is_plain_text_complete(plain, html=None):
+    """
+    True if the text/plain alternative carries the content of the mail:
+    long enough, not a "view in browser" stub, and not much shorter than
+    the visible text of the html alternative.
+    """
+    plain = _SPACE_RE.sub(" ", plain or "").strip()
+    if len(plain) < MIN_PLAIN_CHARS:
+        return False
+    lowered = plain.lower()
+    if len(plain) < 2 * MIN_PLAIN_CHARS and any(marker in lowered for marker in STUB_MARKERS):
+        return False
+    if html:
+        html_length = visible_html_length(html)
+        if html_length and len(plain) < MIN_PLAIN_RATIO * html_length:
+            return False
+    return True
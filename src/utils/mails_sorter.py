@@ -1,18 +1,25 @@
 # langchain using ollama/api to sort the fetched emails into different categories
 
-# 思路： 在temp目录下建立一个存储键值对的文件（json），键是分类，值是temp/mails下文件的名称 建立映射关系 
-# 分类时按照temp/mails下文件的名称进行分类, 不读取邮件内容 
+# 思路： 分类结果写入邮件目录（catalog.sqlite3）的 category 列，按分类查询时走索引
+# 分类时按照邮件名称（由主题生成）进行分类, 不读取邮件内容 
 # 类别： 工作，技术，新闻，其他
 
 import os
-import json
+import asyncio
+import contextlib
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+import time
+from typing import Dict, List, Optional
 from langchain_core.documents import Document
-from langchain_ollama import OllamaLLM
-from langchain_deepseek import ChatDeepSeek
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+
+from . import providers
+from .mail_store import get_store
+from .local_classifier import (match_keywords, NaiveBayesClassifier, TierStats, CONFIDENCE_THRESHOLD,
+                               MIN_TRAINING_SAMPLES)
+from .embedding_classifier import CentroidClassifier, mail_text, EMBEDDING_MODEL
 
 # 获取当前文件所在目录
 current_dir = Path(__file__).parent
@@ -24,36 +31,10 @@ tmp_dir = tmp_dir.resolve()  # 解析相对路径为绝对路径
 # 构建mails目录的完整路径
 mails_dir = tmp_dir / "mails"
 
-class MailSorter:
-    def __init__(self, model_name: str = "deepseek-chat"):
-        self.llm = ChatDeepSeek(model=model_name)
-        self.categories = ["工作", "技术", "新闻", "其他"]
-        self.temp_dir = tmp_dir
-        self.mails_dir = mails_dir
-        self.mapping_file = self.temp_dir / "category_mapping.json"
-        
-        # 确保必要的目录存在
-        self.temp_dir.mkdir(exist_ok=True)
-        self.mails_dir.mkdir(exist_ok=True)
-        
-    def _load_mapping(self) -> Dict[str, List[str]]:
-        """加载现有的分类映射"""
-        if self.mapping_file.exists():
-            with open(self.mapping_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return {category: [] for category in self.categories}
-    
-    def _save_mapping(self, mapping: Dict[str, List[str]]):
-        """保存分类映射到文件"""
-        with open(self.mapping_file, "w", encoding="utf-8") as f:
-            json.dump(mapping, f, ensure_ascii=False, indent=2)
-            
-    def classify_email(self, filename: str) -> str:
-        """使用 LLM 对单个邮件进行分类"""
-        prompt = PromptTemplate(
-            template="""你是一个邮件分类助手。请根据邮件文件名判断其属于哪个类别。
+# 一次请求中分类的邮件数量, 越大请求越少, 但单次请求延迟越高
+BATCH_SIZE = 25
 
-类别必须是以下四个之一：工作、技术、新闻、其他
+CLASSIFICATION_RULES = """类别必须是以下四个之一：工作、技术、新闻、其他
 
 分类规则：
 1. 工作：
@@ -75,48 +56,374 @@ class MailSorter:
 3. 新闻：时事新闻、重大事件、社会动态等
 4. 其他：不属于以上类别的内容
 
-重要提示：如果文件名包含招聘相关信息（比如职位名称），即使同时包含技术内容，也应优先归类为"工作"类。
+重要提示：如果文件名包含招聘相关信息（比如职位名称），即使同时包含技术内容，也应优先归类为"工作"类。"""
+
+SINGLE_PROMPT_TEMPLATE = """你是一个邮件分类助手。请根据邮件文件名判断其属于哪个类别。
+
+""" + CLASSIFICATION_RULES + """
 
 文件名: {filename}
 
-直接返回类别名称（工作/技术/新闻/其他），不要有任何额外解释。""",
-            input_variables=["filename"]
-        )
+直接返回类别名称（工作/技术/新闻/其他），不要有任何额外解释。"""
+
+BATCH_PROMPT_TEMPLATE = """你是一个邮件分类助手。请根据邮件文件名判断每封邮件属于哪个类别。
+
+""" + CLASSIFICATION_RULES + """
+
+文件名（每行一个，前面是编号）:
+{filenames}
+
+返回一个 JSON 数组，按编号顺序为每个文件名给出一个对象，例如：
+[{{"index": 1, "category": "技术"}}, {{"index": 2, "category": "工作"}}]
+数组长度必须等于文件名数量，不要有任何额外解释。"""
+
+# 同时进行的 LLM 请求数量和单个请求的超时时间（秒）
+CONCURRENCY = 16
+REQUEST_TIMEOUT = 60
+
+# 分类缓存的键包含提示词版本, 修改提示词后旧的缓存自动失效
+PROMPT_VERSION = hashlib.sha1((SINGLE_PROMPT_TEMPLATE + BATCH_PROMPT_TEMPLATE).encode("utf-8")).hexdigest()[:12]
+
+# 分类缓存保留的时间（秒）和最大条数
+CACHE_MAX_AGE = 90 * 24 * 3600
+CACHE_MAX_ENTRIES = 50000
+
+# 本地分类模型的保存位置
+LOCAL_MODEL_FILE = "local_classifier.npz"
+
+# 类别质心的保存位置（classifier="embedding" 时使用）
+CENTROIDS_FILE = "embedding_centroids.npz"
+
+# sort_emails 的事件循环, 在多次调用之间保留: 共享的聊天模型的异步 HTTP 客户端
+# 绑定在第一次使用它的循环上, 每次 asyncio.run 新建并关闭循环会让下一次调用失败（Event loop is closed）
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run_in_sorter_loop(coroutine):
+    """在分类使用的事件循环中运行 coroutine 直到完成, 同一时间只运行一个"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+        return _loop.run_until_complete(coroutine)
+
+
+class MailSorter:
+    def __init__(self, model_name: str = "deepseek-chat", batch_size: int = BATCH_SIZE,
+                 use_local_tiers: bool = True, confidence_threshold: float = CONFIDENCE_THRESHOLD,
+                 concurrency: int = CONCURRENCY, request_timeout: float = REQUEST_TIMEOUT,
+                 classifier: str = "llm", embedding_model: str = EMBEDDING_MODEL):
+        """
+        classifier: 最后一层使用的分类方式, "llm" 请求聊天模型,
+        "embedding" 用本地 embedding 模型和类别质心分类（没有质心时仍然请求 LLM）
+        """
+        self._llm = None
+        self.model_name = model_name
+        self.batch_size = batch_size
+        from langchain_core.output_parsers import JsonOutputParser
+        self.parser = JsonOutputParser()
+        self.use_local_tiers = use_local_tiers
+        self.confidence_threshold = confidence_threshold
+        self.concurrency = concurrency
+        self.request_timeout = request_timeout
+        self.classifier = classifier
+        self.embedding_model = embedding_model
+        self.categories = ["工作", "技术", "新闻", "其他"]
+        self.temp_dir = tmp_dir
+        self.mails_dir = mails_dir
+        
+        # 确保必要的目录存在
+        self.temp_dir.mkdir(exist_ok=True)
+        self.mails_dir.mkdir(exist_ok=True)
+        self.store = get_store(self.mails_dir)
+        self.model_path = self.mails_dir / LOCAL_MODEL_FILE
+        self._local_model = None
+        self.centroids_path = self.mails_dir / CENTROIDS_FILE
+        self._centroids = None
         
+    def _load_mapping(self) -> Dict[str, List[str]]:
+        """从邮件目录加载现有的分类映射"""
+        return self.store.catalog.category_mapping(self.categories)
+    
+    def _save_mapping(self, categories: Dict[str, str], sources: Optional[Dict[str, str]] = None):
+        """保存分类结果 {message id: 类别} 和给出结果的分类层 {message id: 层} 到邮件目录"""
+        self.store.catalog.set_categories(categories, sources)
+
+    def _cache_key(self, filename: str) -> str:
+        """分类缓存的键: 分类内容（邮件名称）的哈希 + 模型 + 提示词版本"""
+        key = "\0".join([self.model_name, PROMPT_VERSION, filename])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @property
+    def llm(self):
+        """聊天模型, 第一次请求 LLM 时才创建（本地分类层能处理的邮件不需要它）"""
+        if self._llm is None:
+            # temperature 0: 同样的提示词得到同样的类别, 回复可以缓存
+            self._llm = providers.get("deepseek", model=self.model_name, temperature=0)
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    @property
+    def local_model(self) -> NaiveBayesClassifier:
+        """本地模型, 第一次使用时加载; 还没有保存过的模型用邮件目录中以往 LLM 的分类结果训练"""
+        if self._local_model is None:
+            model = NaiveBayesClassifier.load(self.model_path, self.categories)
+            if model is None:
+                model = NaiveBayesClassifier(self.categories)
+                labeled = self.store.catalog.labeled_entries()
+                model.partial_fit([entry["name"] for entry in labeled], [entry["category"] for entry in labeled])
+                model.save(self.model_path)
+            self._local_model = model
+        return self._local_model
+
+    @property
+    def centroids(self) -> CentroidClassifier:
+        """类别质心, 第一次使用时加载; 还没有保存过时用邮件目录中已确认的分类结果计算"""
+        if self._centroids is None:
+            centroids = CentroidClassifier.load(self.centroids_path, self.categories, self.embedding_model)
+            if centroids is None:
+                centroids = CentroidClassifier(self.categories, self.embedding_model)
+                labeled = self.store.catalog.labeled_entries()
+                centroids.update([mail_text(entry) for entry in labeled], [entry["category"] for entry in labeled])
+                centroids.save(self.centroids_path)
+            self._centroids = centroids
+        return self._centroids
+
+    def _learn(self, entries: List[dict], categories: Dict[str, str]):
+        """用 LLM 或用户确认的分类结果更新本地模型和类别质心"""
+        entries = [entry for entry in entries if entry["id"] in categories]
+        if not entries:
+            return
+        labels = [categories[entry["id"]] for entry in entries]
+        if self.use_local_tiers:
+            self.local_model.partial_fit([entry["name"] for entry in entries], labels)
+            self.local_model.save(self.model_path)
+        if self.classifier == "embedding":
+            self.centroids.update([mail_text(entry) for entry in entries], labels)
+            self.centroids.save(self.centroids_path)
+
+    def confirm_categories(self, categories: Dict[str, str]):
+        """保存用户确认（或修正）的分类 {message id: 类别}, 并用它们更新本地模型和类别质心"""
+        categories = {msg_id: category for msg_id, category in categories.items() if category in self.categories}
+        self._save_mapping(categories, {msg_id: "confirmed" for msg_id in categories})
+        self._learn([self.store.get(msg_id) for msg_id in categories if msg_id in self.store], categories)
+
+    def select_emails(self, category: str, since_hours: Optional[float] = None) -> List[dict]:
+        """按类别（和时间）从邮件目录中查询邮件，例如最近 24 小时的技术邮件"""
+        since = int(time.time() - since_hours * 3600) if since_hours is not None else None
+        return self.store.entries(category=category, since=since)
+            
+    def _check_category(self, filename: str, predicted_category: str) -> str:
+        """不在类别列表中的结果归类为'其他'"""
+        if predicted_category not in self.categories:
+            print(f"警告：文件 '{filename}' 的预测类别 '{predicted_category}' 无效，归类为'其他'")
+            return "其他"
+        return predicted_category
+
+    def classify_email(self, filename: str) -> Optional[str]:
+        """使用 LLM 对单个邮件进行分类, 请求失败时返回 None（不是模型给出的类别, 不能缓存或用于训练）"""
         try:
-            result = self.llm.invoke(prompt.format(filename=filename))
+            result = self.llm.invoke(providers.prompt(SINGLE_PROMPT_TEMPLATE).format(filename=filename))
             # 从 AIMessage 中获取内容
-            predicted_category = result.content.strip()
-            if predicted_category not in self.categories:
-                print(f"警告：文件 '{filename}' 的预测类别 '{predicted_category}' 无效，归类为'其他'")
-                return "其他"
-            return predicted_category
+            return self._check_category(filename, result.content.strip())
         except Exception as e:
-            print(f"警告：处理文件 '{filename}' 时出错：{str(e)}，归类为'其他'")
-            return "其他"
-    
-    def sort_emails(self):
-        """对 temp/mails 目录下的所有邮件进行分类"""
-        mapping = self._load_mapping()
-        
-        # 获取所有邮件文件
-        email_files = [f.name for f in self.mails_dir.iterdir() if f.is_file() or f.is_dir()]  # 同时包含文件和目录
-        
-        if not email_files:
-            print("警告：temp/mails 目录下没有找到任何文件")
-            return mapping
-            
-        # 清空现有映射
-        mapping = {category: [] for category in self.categories}
+            print(f"警告：处理文件 '{filename}' 时出错：{str(e)}，下次重新分类")
+            return None
+
+    def _parse_batch(self, filenames: List[str], content: str) -> List[str]:
+        """解析批量分类返回的 JSON 数组, 格式不对时抛出 ValueError"""
+        items = self.parser.parse(content)
+        if not isinstance(items, list) or len(items) != len(filenames):
+            raise ValueError(f"expected a JSON array of {len(filenames)} items")
+        categories = [None] * len(filenames)
+        for position, item in enumerate(items):
+            if isinstance(item, str):
+                index, category = position + 1, item
+            elif isinstance(item, dict):
+                index, category = item.get("index", position + 1), item.get("category")
+            else:
+                raise ValueError(f"unexpected item {item!r}")
+            if not isinstance(index, int) or not 1 <= index <= len(filenames) or categories[index - 1] is not None:
+                raise ValueError(f"bad index {index!r}")
+            categories[index - 1] = str(category).strip()
+        return [self._check_category(f, c) for f, c in zip(filenames, categories)]
+
+    def classify_batch(self, filenames: List[str]) -> List[Optional[str]]:
+        """
+        一次请求对多封邮件进行分类, 返回与 filenames 顺序一致的类别列表（失败的为 None）。
+        返回的 JSON 无法解析或数量不对时, 把这一批拆成两半分别重试,
+        只剩一封时退回 classify_email
+        """
+        if not filenames:
+            return []
+        if len(filenames) == 1:
+            return [self.classify_email(filenames[0])]
+        numbered = "\n".join(f"{i}. {filename}" for i, filename in enumerate(filenames, 1))
+        try:
+            result = self.llm.invoke(providers.prompt(BATCH_PROMPT_TEMPLATE).format(filenames=numbered))
+            return self._parse_batch(filenames, result.content)
+        except Exception as e:
+            print(f"警告：批量分类 {len(filenames)} 封邮件失败（{str(e)}），拆分后重试")
+            middle = len(filenames) // 2
+            return self.classify_batch(filenames[:middle]) + self.classify_batch(filenames[middle:])
+
+    async def _ainvoke(self, text: str, semaphore: asyncio.Semaphore):
+        """限制同时进行的请求数量, 超过 request_timeout 抛出 TimeoutError"""
+        async with semaphore:
+            return await asyncio.wait_for(self.llm.ainvoke(text), self.request_timeout)
+
+    async def aclassify_email(self, filename: str, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """classify_email 的异步版本, 超时或出错时返回 None（这封邮件留到下次分类）"""
+        try:
+            result = await self._ainvoke(providers.prompt(SINGLE_PROMPT_TEMPLATE).format(filename=filename), semaphore)
+            return self._check_category(filename, result.content.strip())
+        except asyncio.TimeoutError:
+            print(f"警告：分类文件 '{filename}' 超时，下次重新分类")
+            return None
+        except Exception as e:
+            print(f"警告：处理文件 '{filename}' 时出错：{str(e)}，下次重新分类")
+            return None
+
+    async def aclassify_batch(self, filenames: List[str], semaphore: asyncio.Semaphore) -> List[Optional[str]]:
+        """classify_batch 的异步版本, 失败或超时时拆成两半并发重试"""
+        if not filenames:
+            return []
+        if len(filenames) == 1:
+            return [await self.aclassify_email(filenames[0], semaphore)]
+        numbered = "\n".join(f"{i}. {filename}" for i, filename in enumerate(filenames, 1))
+        try:
+            result = await self._ainvoke(providers.prompt(BATCH_PROMPT_TEMPLATE).format(filenames=numbered), semaphore)
+            return self._parse_batch(filenames, result.content)
+        except Exception as e:
+            print(f"警告：批量分类 {len(filenames)} 封邮件失败（{type(e).__name__}: {str(e)}），拆分后重试")
+            middle = len(filenames) // 2
+            first, second = await asyncio.gather(self.aclassify_batch(filenames[:middle], semaphore),
+                                                 self.aclassify_batch(filenames[middle:], semaphore))
+            return first + second
+
+    async def _aclassify_with_llm(self, entries: List[dict], batch_size: int, concurrency: int,
+                                  results: Dict[str, str]):
+        """
+        每 batch_size 封邮件一个请求, 最多 concurrency 个请求同时进行。
+        每批完成后立即写入 results, 被取消时已完成的结果仍然保留在 results 中
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_batch(batch):
+            predicted = await self.aclassify_batch([entry["name"] for entry in batch], semaphore)
+            for entry, category in zip(batch, predicted):
+                if category is not None:
+                    results[entry["id"]] = category
+
+        await asyncio.gather(*(run_batch(entries[start:start + batch_size])
+                               for start in range(0, len(entries), batch_size)))
+
+    def sort_emails(self, batch_size: Optional[int] = None, use_cache: bool = True,
+                    concurrency: Optional[int] = None):
+        """asort_emails 的同步接口, main_gradio 的 display_sorted_emails 通过它分类"""
+        coroutine = self.asort_emails(batch_size, use_cache, concurrency)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return run_in_sorter_loop(coroutine)
+        # 已经在事件循环中（例如异步的 Gradio 回调）: 在单独的线程中运行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(run_in_sorter_loop, coroutine).result()
+
+    async def asort_emails(self, batch_size: Optional[int] = None, use_cache: bool = True,
+                           concurrency: Optional[int] = None):
+        """
+        对邮件目录中的所有邮件进行分类, batch_size=1 时逐封分类。
+        依次经过: 分类缓存 -> 关键词规则 -> 本地模型 -> LLM, 前一层不能确定的邮件才进入下一层,
+        用户通过 confirm_categories 确认过的邮件保持原来的类别。
+        已经用相同模型和提示词分类过的内容直接从分类缓存读取。
+        LLM 请求并发进行; 任务被取消时, 已经完成的分类结果仍会保存
+        """
+        batch_size = batch_size or self.batch_size
+        concurrency = concurrency or self.concurrency
+        # 从邮件目录获取所有邮件（名称由主题生成）
+        entries = self.store.entries()
         
-        # 对每个文件进行分类
-        for filename in email_files:
-            category = self.classify_email(filename)
-            mapping[category].append(filename)
+        if not entries:
+            print("警告：邮件目录中没有找到任何邮件")
+            return self._load_mapping()
         
-        # 保存映射结果
-        self._save_mapping(mapping)
-        return mapping
+        # 用户确认的分类优先于任何分类层, 不再重新分类
+        entries = [entry for entry in entries if entry.get("category_source") != "confirmed"]
+        catalog = self.store.catalog
+        stats = TierStats()
+        categories, sources = {}, {}
+
+        start = time.perf_counter()
+        keys = {entry["id"]: self._cache_key(entry["name"]) for entry in entries}
+        cached = catalog.cached_classifications(set(keys.values())) if use_cache else {}
+        for msg_id, key in keys.items():
+            if key in cached:
+                categories[msg_id], sources[msg_id] = cached[key], "cache"
+        remaining = [entry for entry in entries if entry["id"] not in categories]
+        stats.record("cache", len(categories), time.perf_counter() - start)
+
+        if self.use_local_tiers and remaining:
+            # 关键词规则
+            start, unmatched = time.perf_counter(), []
+            for entry in remaining:
+                category = match_keywords(entry["name"])
+                if category in self.categories:
+                    categories[entry["id"]], sources[entry["id"]] = category, "rules"
+                else:
+                    unmatched.append(entry)
+            stats.record("rules", len(remaining) - len(unmatched), time.perf_counter() - start)
+            remaining = unmatched
+
+            # 本地模型, 只接受置信度足够高的结果
+            if remaining and self.local_model.samples >= MIN_TRAINING_SAMPLES:
+                start, uncertain = time.perf_counter(), []
+                probs = self.local_model.predict_proba([entry["name"] for entry in remaining])
+                for entry, row in zip(remaining, probs):
+                    if row.max() >= self.confidence_threshold:
+                        categories[entry["id"]] = self.local_model.categories[int(row.argmax())]
+                        sources[entry["id"]] = "model"
+                    else:
+                        uncertain.append(entry)
+                stats.record("model", len(remaining) - len(uncertain), time.perf_counter() - start)
+                remaining = uncertain
+
+        if self.classifier == "embedding" and remaining:
+            # 一次批量 embedding + 一次矩阵乘法, 代替逐封请求聊天模型
+            if self.centroids.trained:
+                start = time.perf_counter()
+                predicted, _ = self.centroids.predict([mail_text(entry) for entry in remaining])
+                for entry, category in zip(remaining, predicted):
+                    categories[entry["id"]], sources[entry["id"]] = category, "embedding"
+                stats.record("embedding", len(remaining), time.perf_counter() - start)
+                remaining = []
+            else:
+                print("警告：还没有任何已确认的分类，无法计算类别质心，使用 LLM 分类")
+
+        start, llm_categories = time.perf_counter(), {}
+        # use_cache=False 时也不使用 LLM 回复缓存, 重新请求模型
+        bypass = providers.get("llm_cache").bypass() if not use_cache and remaining else contextlib.nullcontext()
+        try:
+            with bypass:
+                await self._aclassify_with_llm(remaining, batch_size, concurrency, llm_categories)
+        finally:
+            stats.record("llm", len(llm_categories), time.perf_counter() - start)
+            categories.update(llm_categories)
+            sources.update({msg_id: "llm" for msg_id in llm_categories})
+            stats.report()
+            providers.report_llm_cache()
+
+            # 保存分类结果（被取消时保存已完成的部分）
+            self._save_mapping(categories, sources)
+            catalog.cache_classifications({keys[msg_id]: category for msg_id, category in llm_categories.items()})
+            catalog.evict_classifications(CACHE_MAX_AGE, CACHE_MAX_ENTRIES)
+        # LLM 的结果用于继续训练本地模型（和类别质心）
+        self._learn(remaining, llm_categories)
+        return self._load_mapping()
 
 def main():
     sorter = MailSorter()
@@ -0,0 +1,148 @@
+# Near-duplicate detection with MinHash + LSH banding
+# 找出只在追踪像素、时间戳、退订链接等细节上不同的邮件（例如两封几乎相同的 LinkedIn 职位提醒）,
+# 每个相似簇只保留一封交给总结
+
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# estimated Jaccard similarity above which two mails are near-duplicates
+DEFAULT_THRESHOLD = 0.8
+
+NUM_PERM = 128
+
+# words per shingle
+SHINGLE_SIZE = 5
+
+# Mersenne prime 2^31 - 1: (a * x + b) stays below 2^63 for 32-bit shingles
+_PRIME = np.uint64((1 << 31) - 1)
+
+# upper bound of the hash matrix size (num_perm x shingles) computed at once
+_MAX_CELLS = 1 << 24
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_EMAIL_RE = re.compile(r"\S+@\S+")
+# tracking ids, unsubscribe tokens, long hex/base64 strings
+_TOKEN_RE = re.compile(r"\b[\w-]{24,}\b")
+_DIGITS_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text):
+    """Lowercase words with links, addresses, long tokens and numbers masked"""
+    text = text.lower()
+    text = _URL_RE.sub(" ", text)
+    text = _EMAIL_RE.sub(" ", text)
+    text = _TOKEN_RE.sub(" ", text)
+    text = _DIGITS_RE.sub("0", text)
+    return _WORD_RE.findall(text)
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """Distinct crc32 hashes of the word `size`-grams of the normalized text"""
+    words = normalize_text(text)
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def _permutations(num_perm, seed=1):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM):
+    """
+    (len(texts), num_perm) MinHash signature matrix. The shingles of many
+    texts are hashed in one matrix operation and reduced per text with
+    np.minimum.reduceat. Empty texts get a signature that matches nothing.
+    """
+    a, b = _permutations(num_perm)
+    a, b = a[:, None], b[:, None]
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    shingles = [shingle_hashes(text) for text in texts]
+
+    start = 0
+    while start < len(texts):
+        # group texts so that the hash matrix stays below _MAX_CELLS
+        end, cells = start, 0
+        while end < len(texts) and (end == start or cells + len(shingles[end]) * num_perm <= _MAX_CELLS):
+            cells += len(shingles[end]) * num_perm
+            end += 1
+        group = [i for i in range(start, end) if len(shingles[i])]
+        if group:
+            values = np.concatenate([shingles[i] for i in group])
+            offsets = np.cumsum([0] + [len(shingles[i]) for i in group[:-1]])
+            hashed = (a * values[None, :] + b) % _PRIME
+            signatures[group] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        start = end
+    return signatures
+
+
+def lsh_parameters(threshold, num_perm=NUM_PERM):
+    """(bands, rows) with bands * rows == num_perm whose S-curve midpoint is closest to threshold"""
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+
+def find_near_duplicate_clusters(texts, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM):
+    """
+    Cluster texts whose estimated Jaccard similarity is >= threshold.
+    Returns clusters as lists of indices, every text is in exactly one
+    cluster, clusters and their members are in input order.
+    """
+    signatures = minhash_signatures(texts, num_perm)
+    bands, rows = lsh_parameters(threshold, num_perm)
+    empty = np.all(signatures == np.iinfo(np.uint64).max, axis=1)
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_rows = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i in range(len(texts)):
+            if not empty[i]:
+                buckets[band_rows[i].tobytes()].append(i)
+        for members in buckets.values():
+            for j in members[1:]:
+                i = members[0]
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                # verify the LSH candidate on the full signature
+                if np.mean(signatures[i] == signatures[j]) >= threshold:
+                    parent[find(j)] = find(i)
+
+    clusters = defaultdict(list)
+    for i in range(len(texts)):
+        clusters[find(i)].append(i)
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+def select_representatives(documents, threshold=DEFAULT_THRESHOLD):
+    """
+    Keep one Document per near-duplicate cluster: the last one, i.e. the
+    most recent when the documents are ordered by date. The representative
+    gets the number of mails it stands for in metadata["duplicates"].
+    Returns (representatives, clusters).
+    """
+    clusters = find_near_duplicate_clusters([doc.page_content for doc in documents], threshold)
+    representatives = []
+    for members in clusters:
+        doc = documents[members[-1]]
+        doc.metadata["duplicates"] = len(members)
+        representatives.append(doc)
+    return representatives, clusters
@@ -0,0 +1,148 @@
+# Lazily built models, API clients, prompts and indexes
+# 模型、API 客户端、提示词和向量索引在第一次使用时才创建, 之后按名称和参数缓存复用;
+# 重量级依赖（langchain_deepseek, langchain_ollama, FAISS, langchain hub...）在工厂函数里导入,
+# 因此导入任何模块都不会连接服务、读取索引或询问 API key
+
+import getpass
+import os
+import threading
+
+current_dir = os.path.dirname(__file__)
+
+# LLM 回复缓存的位置, 见 llm_cache.py
+llm_cache_path = os.path.join(current_dir, "..", "..", "temp", "llm_cache.sqlite3")
+
+# 向量缓存的位置（每个嵌入模型一个子目录）, 见 embedding_cache.py
+embedding_cache_path = os.path.join(current_dir, "..", "..", "temp", "embedding_cache")
+
+_factories = {}
+_instances = {}
+# guards the dicts only; a factory runs under the lock of its own key, so a slow one
+# (asking for an API key, loading a TTS model) does not block the other objects
+_lock = threading.Lock()
+_key_locks = {}
+
+
+def provider(name):
+    """Register the decorated function as the factory of `name`"""
+    def register(factory):
+        _factories[name] = factory
+        return factory
+    return register
+
+
+def get(name, **options):
+    """
+    The object built by the factory of `name` with these options. It is
+    built on the first call and the same object is returned afterwards;
+    a factory that raises is retried on the next call.
+    """
+    key = (name, tuple(sorted(options.items())))
+    with _lock:
+        if key in _instances:
+            return _instances[key]
+        if name not in _factories:
+            raise KeyError(f"Unknown provider: {name}")
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _lock:
+            if key in _instances:
+                # built by another thread while this one waited
+                return _instances[key]
+        instance = _factories[name](**options)
+        with _lock:
+            return _instances.setdefault(key, instance)
+
+
+def put(name, instance, **options):
+    """Use instance for get(name, **options), e.g. a fake model in tests"""
+    with _lock:
+        _instances[(name, tuple(sorted(options.items())))] = instance
+
+
+def reset(name=None):
+    """Forget the built objects (of `name` only if given), they are rebuilt on the next get()"""
+    with _lock:
+        for key in [key for key in _instances if name is None or key[0] == name]:
+            del _instances[key]
+
+
+def built():
+    """Names of the objects built so far"""
+    with _lock:
+        return sorted({name for name, _ in _instances})
+
+
+def prompt(template):
+    """The PromptTemplate of a template string"""
+    return get("prompt", template=template)
+
+
+def response_cache(model, cache=None, **options):
+    """
+    The `cache` argument of a LangChain model: the LLM response cache bound
+    to this model, or False. cache=None caches deterministic models only
+    (temperature 0), MAILSORA_LLM_CACHE=0 turns the cache off.
+    """
+    from .llm_cache import ENABLED, deterministic
+    if cache is None:
+        cache = deterministic(options)
+    if not cache or not ENABLED:
+        return False
+    return get("llm_cache").bind(model, **options)
+
+
+def report_llm_cache():
+    """Print the hit rate of the LLM response cache, if a model has used it"""
+    with _lock:
+        cache = _instances.get(("llm_cache", ()))
+    if cache is not None:
+        cache.report()
+
+
+@provider("llm_cache")
+def llm_cache(path=llm_cache_path):
+    from .llm_cache import LLMResponseCache
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return LLMResponseCache(path)
+
+
+@provider("deepseek")
+def deepseek_chat(model="deepseek-chat", cache=None, **options):
+    from langchain_deepseek import ChatDeepSeek
+    if not os.environ.get("DEEPSEEK_API_KEY"):
+        os.environ["DEEPSEEK_API_KEY"] = getpass.getpass("Enter API key for Deepseek: ")
+    return ChatDeepSeek(model=model, cache=response_cache(model, cache, **options), **options)
+
+
+@provider("ollama")
+def ollama_llm(model, cache=None, **options):
+    from langchain_ollama import OllamaLLM
+    return OllamaLLM(model=model, cache=response_cache(model, cache, **options), **options)
+
+
+@provider("ollama_embeddings")
+def ollama_embeddings(model="nomic-embed-text", cache=True, batch_size=None):
+    """
+    Ollama embeddings behind the disk-backed vector cache (cache=False for
+    the bare model); batch_size texts are sent per embedding request
+    """
+    from langchain_ollama import OllamaEmbeddings
+    embeddings = OllamaEmbeddings(model=model)
+    if not cache:
+        return embeddings
+    from .embedding_cache import CachedEmbeddings, cache_dir, EMBED_BATCH_SIZE
+    return CachedEmbeddings(embeddings, cache_dir(embedding_cache_path, model), batch_size or EMBED_BATCH_SIZE)
+
+
+@provider("prompt")
+def prompt_template(template):
+    # langchain_core.prompts pulls in langsmith, which alone takes most of a second to import
+    from langchain_core.prompts import PromptTemplate
+    return PromptTemplate.from_template(template)
+
+
+@provider("hub_prompt")
+def hub_prompt(name):
+    from langchain import hub
+    return hub.pull(name)
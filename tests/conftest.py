@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.email_fetcher import email_fetcher_api, sync_state
+from src.utils import providers
+from src.utils.llm_cache import LLMResponseCache
+from src.utils.mail_store import get_store
+
+
+@pytest.fixture(autouse=True)
+def llm_cache(tmp_path):
+    """Models built by the tests cache their responses under tmp_path"""
+    providers.reset()
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    providers.put("llm_cache", cache)
+    yield cache
+    providers.reset()
+
+
+@pytest.fixture
+def mails_dir(tmp_path, monkeypatch):
+    """An empty mail store and sync state for the fetcher, under tmp_path"""
+    path = str(tmp_path / "mails")
+    monkeypatch.setattr(email_fetcher_api, "fetcher_temp_path", path)
+    monkeypatch.setattr(sync_state, "sync_state_dir", str(tmp_path / "sync_state"))
+    # backoff between retried batch items
+    monkeypatch.setattr(email_fetcher_api.time, "sleep", lambda seconds: None)
+    return path
+
+
+@pytest.fixture
+def store(mails_dir):
+    return get_store(mails_dir)
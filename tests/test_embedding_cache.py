@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.utils.embedding_cache import KEYS_FILE, VECTORS_FILE, CachedEmbeddings, EmbeddingStore, text_key
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: list = []
+    queries: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def as_stored(vectors):
+    return np.asarray(vectors, dtype=np.float32).tolist()
+
+
+def fake_embeddings():
+    return CountingEmbeddings(size=8, embedded=[], queries=[])
+
+
+def test_only_missing_texts_are_embedded(tmp_path):
+    model = fake_embeddings()
+    cached = CachedEmbeddings(model, str(tmp_path), batch_size=2)
+    texts = ["alpha", "beta", "alpha", "gamma"]
+
+    vectors = cached.embed_documents(texts)
+    assert vectors == as_stored(model.embed_documents(texts))
+    # the duplicate is embedded once, in batches of two
+    assert model.embedded[:2] == [["alpha", "beta"], ["gamma"]]
+    assert (cached.hits, cached.misses, cached.requests) == (0, 3, 2)
+
+    model.embedded.clear()
+    assert cached.embed_documents(["gamma", "delta", "alpha"]) == as_stored(model.embed_documents(["gamma", "delta", "alpha"]))
+    assert model.embedded[0] == ["delta"]
+    assert (cached.hits, cached.misses) == (2, 4)
+
+
+def test_queries_have_their_own_keys(tmp_path):
+    model = fake_embeddings()
+    cached = CachedEmbeddings(model, str(tmp_path))
+    cached.embed_documents(["podcast"])
+    cached.embed_query("podcast")
+    cached.embed_query("podcast")
+    assert model.queries == ["podcast"]
+    assert len(cached.store) == 2
+
+
+def test_vectors_are_reloaded_from_disk(tmp_path):
+    model = fake_embeddings()
+    vectors = CachedEmbeddings(model, str(tmp_path)).embed_documents(["one", "two"])
+
+    store = EmbeddingStore(str(tmp_path))
+    matrix, positions = store.get([text_key("two"), text_key("three"), text_key("one")])
+    assert positions == {0: 0, 2: 1}
+    assert matrix.tolist() == [vectors[1], vectors[0]]
+
+
+def test_interrupted_write_is_recovered(tmp_path):
+    model = fake_embeddings()
+    CachedEmbeddings(model, str(tmp_path)).embed_documents(["one", "two"])
+    # a row was written but its key was cut off
+    with open(os.path.join(tmp_path, VECTORS_FILE), "ab") as f:
+        f.write(b"\0" * 4 * 8)
+    with open(os.path.join(tmp_path, KEYS_FILE), "a", encoding="utf-8", newline="\n") as f:
+        f.write(text_key("three")[:10])
+
+    store = EmbeddingStore(str(tmp_path))
+    assert len(store) == 2
+    three = model.embed_documents(["three"])
+    store.add([text_key("three")], three)
+
+    store = EmbeddingStore(str(tmp_path))
+    matrix, positions = store.get([text_key("three")])
+    assert positions == {0: 0}
+    assert matrix.tolist() == as_stored(three)
+    assert os.path.getsize(os.path.join(tmp_path, VECTORS_FILE)) == 3 * 4 * 8
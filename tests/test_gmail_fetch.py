@@ -0,0 +1,155 @@
+import os
+
+import pytest
+
+from src.email_fetcher import email_fetcher_api, sync_state
+from src.email_fetcher.fake_service import FakeGmailService, make_fake_mailbox
+
+
+def test_batched_fetch_saves_messages_and_attachments(store):
+    service = FakeGmailService(make_fake_mailbox(120, attachment_every=10))
+    email_fetcher_api.gmail_fetch("me", "newer_than:3d", service=service, incremental=False)
+
+    assert len(store) == 120
+    # 120 gets in batches of 50, then the 12 attachments in one batch
+    assert service.batches == 3 + 1
+    entry = store.get(f"{10:016x}")
+    assert entry["subject"] == "Job alert 10"
+    assert entry["body_status"] == "fetched"
+    assert "report_10.pdf" in [os.path.basename(path) for path in store.files(entry["id"])]
+
+
+def test_throttled_batch_items_are_retried(store):
+    mailbox = make_fake_mailbox(10)
+    throttled = {m["id"] for m in mailbox[:4]}
+    service = FakeGmailService(mailbox, throttle_ids=throttled)
+
+    saved, errors = email_fetcher_api.read_messages_batched(service, "me", [{"id": m["id"]} for m in mailbox])
+
+    assert errors == {}
+    assert set(saved) == {m["id"] for m in mailbox}
+    assert len(store) == 10
+
+
+def test_failing_batch_items_are_reported(store):
+    mailbox = make_fake_mailbox(5)
+    service = FakeGmailService(mailbox, fail_ids={mailbox[0]["id"]})
+
+    saved, errors = email_fetcher_api.read_messages_batched(service, "me", [{"id": m["id"]} for m in mailbox])
+
+    assert set(errors) == {mailbox[0]["id"]}
+    assert len(saved) == 4
+
+
+def test_sync_fetches_only_new_messages(store):
+    mailbox = make_fake_mailbox(30)
+    service = FakeGmailService(mailbox[:20])
+    assert email_fetcher_api.sync_messages(service, "me", "q") == 20
+
+    for message in mailbox[20:]:
+        service.add_message(message)
+    service.delete_message(mailbox[0]["id"])
+    assert email_fetcher_api.sync_messages(service, "me", "q") == 10
+    assert mailbox[0]["id"] not in store
+    assert len(store) == 29
+
+    # nothing changed: one history.list call, no search and no gets
+    calls = service.calls
+    assert email_fetcher_api.sync_messages(service, "me", "q") == 0
+    assert service.calls == calls + 1
+
+
+def test_sync_fetches_failed_messages_again(store):
+    mailbox = make_fake_mailbox(10)
+    broken = mailbox[3]["id"]
+    service = FakeGmailService(mailbox, fail_ids={broken})
+    assert email_fetcher_api.sync_messages(service, "me", "q") == 9
+    assert sync_state.load_sync_state("me")["failed"] == [broken]
+
+    # the history is empty, only the failed message is fetched
+    service.fail_ids.clear()
+    assert email_fetcher_api.sync_messages(service, "me", "q") == 1
+    assert broken in store
+    assert sync_state.load_sync_state("me")["failed"] == []
+
+
+def test_lazy_bodies_are_fetched_from_the_same_account(store, monkeypatch):
+    service = FakeGmailService(make_fake_mailbox(5, attachment_every=2))
+    email_fetcher_api.gmail_fetch("alice@example.com", "q", service=service, lazy_bodies=True)
+    entries = store.entries()
+    assert {entry["body_status"] for entry in entries} == {"pending"}
+    assert {entry["user_id"] for entry in entries} == {"alice@example.com"}
+
+    accounts = []
+    fetch_bodies = email_fetcher_api.fetch_bodies
+
+    def record_account(user_id, msg_ids, service=None):
+        accounts.append(user_id)
+        return fetch_bodies(user_id, msg_ids, service)
+
+    monkeypatch.setattr(email_fetcher_api, "fetch_bodies", record_account)
+    entries = email_fetcher_api.fetch_pending_bodies(store, entries[:3], service=service)
+
+    assert accounts == ["alice@example.com"]
+    assert [entry["body_status"] for entry in entries] == ["fetched"] * 3
+    assert entries[0]["html_path"]
+    assert len(store.entries(body_status="pending")) == 2
+
+
+def test_lazy_duplicate_is_dropped_when_its_body_is_fetched(store):
+    original, copy = make_fake_mailbox(2)
+    copy["payload"]["parts"] = original["payload"]["parts"]
+    service = FakeGmailService([original, copy])
+    email_fetcher_api.gmail_fetch("me", "q", service=service, lazy_bodies=True)
+    assert len(store) == 2
+
+    entries = email_fetcher_api.fetch_pending_bodies(store, store.entries(), service=service)
+
+    assert [entry["id"] for entry in entries] == [original["id"]]
+    assert copy["id"] not in store
+    assert store.entries(body_status="pending") == []
+
+
+def test_worker_pool_retries_throttled_messages_and_isolates_failures(store):
+    mailbox = make_fake_mailbox(12, attachment_every=4)
+    broken = mailbox[5]["id"]
+    service = FakeGmailService(mailbox, fail_ids={broken}, throttle_ids={m["id"] for m in mailbox[:6]})
+    services = []
+
+    def service_factory():
+        services.append(service)
+        return service
+
+    saved = email_fetcher_api.read_messages_concurrently(service_factory, "me", [{"id": m["id"]} for m in mailbox],
+                                                         workers=3, quota_units=10000)
+
+    assert set(saved) == {m["id"] for m in mailbox} - {broken}
+    assert broken not in store
+    assert len(store) == 11
+    assert "report_8.pdf" in [os.path.basename(path) for path in store.files(mailbox[8]["id"])]
+    # one service per worker thread
+    assert 1 <= len(services) <= 3
+
+
+def test_workers_need_a_service_factory(store, monkeypatch):
+    mailbox = make_fake_mailbox(6)
+    service = FakeGmailService(mailbox)
+    monkeypatch.setattr(email_fetcher_api, "read_messages_concurrently",
+                        lambda *args, **kwargs: pytest.fail("a shared service was handed to the workers"))
+
+    email_fetcher_api.gmail_fetch("me", "q", service=service, incremental=False, workers=4)
+
+    assert len(store) == 6
+    assert service.batches == 1
+
+
+def test_metadata_fetch_keeps_fetched_bodies(store):
+    service = FakeGmailService(make_fake_mailbox(10))
+    email_fetcher_api.gmail_fetch("me", "q", service=service, incremental=False)
+    fetched = {entry["id"]: entry for entry in store.entries()}
+    assert all(entry["content_key"] for entry in fetched.values())
+
+    # e.g. the Gradio pipeline after the query changed
+    email_fetcher_api.gmail_fetch("me", "q", service=service, incremental=False, lazy_bodies=True)
+
+    assert {entry["id"]: entry for entry in store.entries()} == fetched
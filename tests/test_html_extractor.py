@@ -0,0 +1,20 @@
+from src.summarizer.html_extractor import html_to_text
+
+
+def test_hidden_elements_are_dropped():
+    html = """<html><body>
+    <div class="preheader">Preview of the mail</div>
+    <span class="Hidden">padding</span>
+    <div style="display: none">tracking</div>
+    <p>Main story</p>
+    </body></html>"""
+    assert html_to_text(html) == "Main story"
+
+
+def test_class_names_containing_hidden_are_kept():
+    html = """<html><body>
+    <div class="mobile-hidden">Desktop column</div>
+    <div class="col hidden-xs">Sidebar</div>
+    <div class="overflow-hidden">Card text</div>
+    </body></html>"""
+    assert html_to_text(html) == "Desktop column\nSidebar\nCard text"
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from langchain_core.outputs import Generation
+
+from src.utils.llm_cache import LLMResponseCache
+
+
+def response(text):
+    return [Generation(text=text)]
+
+
+def test_responses_are_cached_by_normalized_prompt(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    bound = cache.bind("deepseek-chat", temperature=0, timeout=30)
+
+    bound.update("Summarize  this\nmail", "", response("summary"))
+
+    assert bound.lookup("Summarize this mail", "")[0].text == "summary"
+    assert cache.bind("deepseek-chat", temperature=0.7).lookup("Summarize this mail", "") is None
+    assert cache.bind("deepseek-reasoner", temperature=0).lookup("Summarize this mail", "") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_eviction_keeps_the_newest_response(tmp_path, monkeypatch):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"), max_bytes=3_000)
+    # every response is saved at the same time
+    monkeypatch.setattr("src.utils.llm_cache.time.time", lambda: 1_700_000_000.0)
+    keys = [f"key{i}" for i in range(10)]
+    for key in keys:
+        cache.put(key, "deepseek-chat", response(os.urandom(300).hex()))
+        assert cache.get(key) is not None
+
+    kept = [key for key in keys if cache.get(key) is not None]
+    assert len(kept) < 10
+    assert kept == keys[-len(kept):]
+
+
+def test_bypass_applies_to_the_current_task_only(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    cache.put("key", "deepseek-chat", response("cached"))
+    inside, outside = asyncio.Event(), asyncio.Event()
+
+    async def lookup():
+        return cache.get("key")
+
+    async def bypassing():
+        with cache.bypass():
+            inside.set()
+            # tasks started inside the block bypass the cache too
+            child = await asyncio.create_task(lookup())
+            await outside.wait()
+            return cache.get("key"), child
+
+    async def reading():
+        await inside.wait()
+        try:
+            return await lookup()
+        finally:
+            outside.set()
+
+    async def main():
+        return await asyncio.gather(bypassing(), reading())
+
+    (bypassed, child), read = asyncio.run(main())
+    assert bypassed is None and child is None
+    assert read[0].text == "cached"
+    assert cache.get("key")[0].text == "cached"
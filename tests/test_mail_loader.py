@@ -0,0 +1,22 @@
+import os
+
+from src.summarizer import mail_loader
+
+
+def crashing_loader(path):
+    if path.endswith("bad"):
+        os._exit(1)  # like a segfault in the parser
+    return f"text of {path}"
+
+
+def test_worker_crash_fails_only_the_crashing_mail(monkeypatch):
+    monkeypatch.setitem(mail_loader.HTML_LOADERS, "crashing", crashing_loader)
+    jobs = [("html", f"mail/{i}" + ("/bad" if i == 25 else ""), "crashing") for i in range(40)]
+
+    results = list(mail_loader._run_jobs_parallel(jobs, 2, 4))
+
+    assert len(results) == 40
+    assert results[25][0] is None
+    assert results[25][3] == "the worker process crashed"
+    assert [text for text, _, _, _ in results[:25]] == [f"text of mail/{i}" for i in range(25)]
+    assert [text for text, _, _, _ in results[26:]] == [f"text of mail/{i}" for i in range(26, 40)]
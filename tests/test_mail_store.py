@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+
+from src.utils.catalog import CATALOG_FILE, MailCatalog
+from src.utils.mail_store import LEGACY_INDEX_FILE, MailStore
+
+DATE = "Mon, 06 Jan 2025 10:00:00 +0000"
+TEXT = "Hello world, this is the weekly digest. " * 10
+
+
+def test_message_round_trip(tmp_path):
+    store = MailStore(str(tmp_path))
+    store.write_file("m1", "m1.html", f"<p>{TEXT}</p>".encode("utf-8"))
+    store.write_file("m1", "m1.txt", TEXT.encode("utf-8"))
+    entry = store.add("m1", subject="Hello", sender="a@example.com", date=DATE, thread_id="t1", user_id="me")
+
+    assert entry["date"] == 1736157600
+    assert entry["html_path"] == os.path.join(os.path.relpath(store.message_dir("m1"), store.root), "m1.html")
+    assert store.path(entry["text_path"]) == store.find_file("m1", ".txt")
+    assert entry["body_hash"] == store.content_hash("m1")
+    assert entry["plain_complete"] == 1
+    assert (entry["summary_status"], entry["body_status"], entry["user_id"]) == ("pending", "fetched", "me")
+
+    reopened = MailStore(str(tmp_path))
+    assert reopened.get("m1") == entry
+    assert "m1" in reopened and len(reopened) == 1
+
+    reopened.remove("m1")
+    assert "m1" not in reopened
+    assert not os.path.exists(store.message_dir("m1"))
+
+
+def test_update_keeps_category_and_summary_status(tmp_path):
+    store = MailStore(str(tmp_path))
+    store.write_file("m1", "m1.html", b"<p>v1</p>")
+    store.add("m1", subject="v1", date=DATE)
+    store.catalog.set_categories({"m1": "技术"}, {"m1": "confirmed"})
+    store.catalog.set_summary_status(["m1"], "done")
+
+    store.write_file("m1", "m1.html", b"<p>v2</p>")
+    entry = store.add("m1", subject="v2", date=DATE)
+    assert (entry["subject"], entry["category"], entry["category_source"], entry["summary_status"]) == \
+        ("v2", "技术", "confirmed", "done")
+
+
+def test_query_filters(tmp_path):
+    store = MailStore(str(tmp_path))
+    for n, (category, body_status) in enumerate([("工作", "fetched"), (None, "fetched"), ("工作", "pending")]):
+        store.add(f"m{n}", subject=f"s{n}", timestamp=1000 + n, body_status=body_status)
+        if category:
+            store.catalog.set_categories({f"m{n}": category})
+
+    ids = lambda rows: [row["id"] for row in rows]
+    assert ids(store.entries()) == ["m0", "m1", "m2"]
+    assert ids(store.entries(since=1001)) == ["m1", "m2"]
+    assert ids(store.entries(until=1001)) == ["m0"]
+    assert ids(store.entries(category="工作")) == ["m0", "m2"]
+    assert ids(store.entries(uncategorized=True)) == ["m1"]
+    assert ids(store.entries(body_status="pending")) == ["m2"]
+    assert store.catalog.category_mapping()["工作"] == ["s0", "s2"]
+
+
+def test_legacy_index_is_imported(tmp_path):
+    with open(tmp_path / LEGACY_INDEX_FILE, "w", encoding="utf-8") as f:
+        json.dump({"m1": {"id": "m1", "subject": "Old", "date": DATE, "content_hash": "abc"}}, f)
+
+    entry = MailStore(str(tmp_path)).get("m1")
+    assert (entry["subject"], entry["date"], entry["date_header"], entry["body_hash"]) == ("Old", 1736157600, DATE, "abc")
+    assert not os.path.exists(tmp_path / LEGACY_INDEX_FILE)
+
+
+def test_old_catalog_is_migrated(tmp_path):
+    path = str(tmp_path / CATALOG_FILE)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id TEXT PRIMARY KEY, thread_id TEXT, sender TEXT, subject TEXT, name TEXT, "
+                 "date INTEGER, date_header TEXT, body_hash TEXT, category TEXT, "
+                 "summary_status TEXT NOT NULL DEFAULT 'pending', dir TEXT, html_path TEXT, text_path TEXT, "
+                 "added_at INTEGER)")
+    conn.execute("INSERT INTO messages (id, subject, category) VALUES ('m1', 'Old', '新闻')")
+    conn.commit()
+    conn.close()
+
+    catalog = MailCatalog(path)
+    entry = catalog.get("m1")
+    assert (entry["subject"], entry["category"], entry["body_status"], entry["user_id"]) == \
+        ("Old", "新闻", "fetched", None)
+    catalog.upsert({"id": "m2", "content_key": "k2"})
+    assert catalog.find_by_content_key("k2") == "m2"
+
+
+def test_line_counts_follow_the_messages(tmp_path):
+    store = MailStore(str(tmp_path))
+    for n in range(4):
+        store.write_file(f"m{n}", "mail.txt", f"mail {n}".encode("utf-8"))
+        store.add(f"m{n}", subject=f"s{n}")
+    catalog = store.catalog
+    assert [entry["id"] for entry in catalog.unindexed_line_entries()] == ["m0", "m1", "m2", "m3"]
+
+    catalog.index_lines([(entry["id"], entry["body_hash"], {"footer", entry["id"]})
+                         for entry in catalog.unindexed_line_entries()[:3]])
+    assert [entry["id"] for entry in catalog.unindexed_line_entries()] == ["m3"]
+    assert catalog.frequent_lines(0.3, 3) == {"footer"}
+
+    # a new body is counted again
+    store.write_file("m0", "mail.txt", b"new body")
+    store.add("m0", subject="s0")
+    assert [entry["id"] for entry in catalog.unindexed_line_entries()] == ["m0", "m3"]
+
+    store.remove("m1")
+    assert catalog.frequent_lines(0.3, 3) == set()
+    assert catalog.execute("SELECT COUNT(*) FROM mail_lines WHERE id = 'm1'")[0][0] == 0
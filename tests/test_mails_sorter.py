@@ -0,0 +1,194 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.utils import mails_sorter
+from src.utils.mails_sorter import MailSorter
+
+
+class FakeChatModel:
+    """Answers every classification prompt with `category`, or raises `error`"""
+
+    def __init__(self, category="技术", error=None):
+        self.category = category
+        self.error = error
+        self.classified = []
+        self.loops = set()
+
+    async def ainvoke(self, prompt):
+        self.loops.add(asyncio.get_running_loop())
+        if self.error is not None:
+            raise self.error
+        if "文件名（每行一个" not in prompt:
+            self.classified.append(prompt.split("文件名: ")[1].split("\n")[0])
+            return AIMessage(content=self.category)
+        lines = prompt.split("前面是编号）:\n")[1].split("\n\n")[0].splitlines()
+        self.classified += [line.split(". ", 1)[1] for line in lines]
+        return AIMessage(content=json.dumps([{"index": i, "category": self.category}
+                                             for i in range(1, len(lines) + 1)], ensure_ascii=False))
+
+
+@pytest.fixture
+def sorter(tmp_path, monkeypatch):
+    monkeypatch.setattr(mails_sorter, "tmp_dir", tmp_path)
+    monkeypatch.setattr(mails_sorter, "mails_dir", tmp_path / "mails")
+    sorter = MailSorter(use_local_tiers=False)
+    sorter.llm = FakeChatModel()
+    return sorter
+
+
+def add_mails(store, names):
+    for i, name in enumerate(names):
+        msg_id = f"m{i}"
+        store.write_file(msg_id, f"{name}.html", f"<p>{name}</p>".encode("utf-8"))
+        store.add(msg_id, subject=name, name=name, timestamp=1700000000 + i)
+
+
+def test_llm_results_are_cached(sorter):
+    add_mails(sorter.store, ["Python_weekly", "Rust_tutorial", "Go_digest"])
+
+    assert sorter.sort_emails()["技术"] == ["Python_weekly", "Rust_tutorial", "Go_digest"]
+    assert {entry["category_source"] for entry in sorter.store.entries()} == {"llm"}
+
+    sorter.llm = FakeChatModel(category="其他")
+    add_mails(sorter.store, ["Python_weekly", "Rust_tutorial", "Go_digest", "Daily_news"])
+    result = sorter.sort_emails()
+
+    # only the new mail reaches the model, the others come from the classification cache
+    assert sorter.llm.classified == ["Daily_news"]
+    assert result["技术"] == ["Python_weekly", "Rust_tutorial", "Go_digest"]
+    assert result["其他"] == ["Daily_news"]
+
+
+def test_failed_requests_are_not_cached_or_learned(sorter):
+    sorter.use_local_tiers = True
+    # no keyword rule matches these names
+    add_mails(sorter.store, ["Quarterly_update", "Hello_from_Anna"])
+    sorter.llm = FakeChatModel(error=ConnectionError("offline"))
+
+    result = sorter.sort_emails()
+
+    assert all(not names for names in result.values())
+    assert [entry["category"] for entry in sorter.store.entries()] == [None, None]
+    assert sorter.local_model.samples == 0
+
+    # the mails are classified by the next run
+    sorter.llm = FakeChatModel()
+    assert sorter.sort_emails()["技术"] == ["Quarterly_update", "Hello_from_Anna"]
+    assert sorter.local_model.samples == 2
+
+
+def test_classify_email_returns_none_on_failure(sorter):
+    class BrokenModel:
+        def invoke(self, prompt):
+            raise ConnectionError("offline")
+
+    sorter.llm = BrokenModel()
+    assert sorter.classify_email("Python_weekly") is None
+    assert sorter.classify_batch(["Python_weekly", "Rust_tutorial"]) == [None, None]
+
+
+def test_sort_emails_reuses_its_event_loop(sorter):
+    # the async HTTP client of a shared chat model is bound to the loop of its first request
+    add_mails(sorter.store, ["Python_weekly"])
+    sorter.sort_emails(use_cache=False)
+
+    async def from_a_running_loop():
+        return sorter.sort_emails(use_cache=False)
+
+    asyncio.run(from_a_running_loop())
+    assert len(sorter.llm.classified) == 2
+    assert len(sorter.llm.loops) == 1
+
+
+def test_confirmed_categories_are_kept(sorter):
+    sorter.use_local_tiers = True
+    # the keyword rules would put this one into 技术
+    add_mails(sorter.store, ["Python_weekly", "Quarterly_update"])
+    sorter.confirm_categories({"m0": "新闻", "m1": "工作"})
+
+    result = sorter.sort_emails(use_cache=False)
+
+    assert result["新闻"] == ["Python_weekly"]
+    assert result["工作"] == ["Quarterly_update"]
+    assert sorter.llm.classified == []
+    assert {entry["category_source"] for entry in sorter.store.entries()} == {"confirmed"}
+
+
+CATEGORY_OF = {"Python_weekly": "技术", "Job_offer_Berlin": "工作", "Daily_news": "新闻", "Hello_from_Anna": "其他"}
+NAMES = list(CATEGORY_OF)
+
+
+def answer(names):
+    return [{"index": i, "category": CATEGORY_OF[name]} for i, name in enumerate(names, 1)]
+
+
+class ScriptedChatModel:
+    """Classifies by name, `batch_reply(names)` writes the answers to batch prompts"""
+
+    def __init__(self, batch_reply, failing=()):
+        self.batch_reply = batch_reply
+        self.failing = set(failing)
+        self.requests = []
+
+    def invoke(self, prompt):
+        if "文件名（每行一个" in prompt:
+            lines = prompt.split("前面是编号）:\n")[1].split("\n\n")[0].splitlines()
+            names = [line.split(". ", 1)[1] for line in lines]
+            self.requests.append(names)
+            return AIMessage(content=self.batch_reply(names))
+        name = prompt.split("文件名: ")[1].split("\n")[0]
+        self.requests.append([name])
+        if name in self.failing:
+            raise ConnectionError("offline")
+        return AIMessage(content=CATEGORY_OF[name])
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def broken_when_longer_than(size, broken_reply):
+    return lambda names: broken_reply(names) if len(names) > size else json.dumps(answer(names), ensure_ascii=False)
+
+
+@pytest.mark.parametrize("broken_reply", [
+    lambda names: "Sure! Here are the categories: 技术, 工作...",
+    # an id is missing
+    lambda names: json.dumps(answer(names)[:-1], ensure_ascii=False),
+    # the right length, but id 1 twice and the last id missing
+    lambda names: json.dumps(answer(names)[:1] + answer(names)[:-1], ensure_ascii=False),
+], ids=["malformed", "missing", "repeated"])
+def test_a_bad_batch_answer_is_split_and_retried(sorter, broken_reply):
+    sorter.llm = ScriptedChatModel(broken_when_longer_than(2, broken_reply))
+    assert sorter.classify_batch(NAMES) == list(CATEGORY_OF.values())
+    assert sorter.llm.requests == [NAMES, NAMES[:2], NAMES[2:]]
+
+    add_mails(sorter.store, NAMES)
+    sorter.llm = ScriptedChatModel(broken_when_longer_than(2, broken_reply))
+    result = sorter.sort_emails(batch_size=4)
+
+    assert {name: category for category, names in result.items() for name in names} == CATEGORY_OF
+    assert sorted(sorter.llm.requests) == sorted([NAMES, NAMES[:2], NAMES[2:]])
+
+
+def test_partial_batches_fall_back_to_one_request_per_mail(sorter):
+    always_broken = lambda names: "[]"
+    sorter.llm = ScriptedChatModel(always_broken, failing={"Daily_news"})
+    assert sorter.classify_batch(NAMES) == ["技术", "工作", None, "其他"]
+    assert [names for names in sorter.llm.requests if len(names) == 1] == [[name] for name in NAMES]
+
+    add_mails(sorter.store, NAMES)
+    sorter.llm = ScriptedChatModel(always_broken, failing={"Daily_news"})
+    sorter.sort_emails(batch_size=4)
+
+    categories = {entry["name"]: entry["category"] for entry in sorter.store.entries()}
+    assert categories == {**CATEGORY_OF, "Daily_news": None}
+    assert len(sorter.llm.requests) == 1 + 2 + 4
+
+    # only the failed mail is asked again
+    sorter.llm = ScriptedChatModel(always_broken)
+    sorter.sort_emails(batch_size=4)
+    assert sorter.llm.requests == [["Daily_news"]]
+    assert sorter.store.get("m2")["category"] == "新闻"
@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+
+from src.utils.near_duplicates import (NUM_PERM, find_near_duplicate_clusters, lsh_parameters,
+                                       select_representatives)
+
+JOB_ALERT = (
+    "Hi Alex, {n} new jobs match your alert for software engineer in Berlin. "
+    "Senior Backend Engineer at Acme Cloud, hybrid, posted {hours} hours ago, be an early applicant. "
+    "Platform Engineer at Northwind Logistics, on-site, Kubernetes and Go, easy apply. "
+    "Machine Learning Engineer at Contoso Health, remote within Germany, Python and PyTorch. "
+    "Site Reliability Engineer at Fabrikam Energy, on-call rotation, Terraform and AWS. "
+    "See all jobs: https://www.linkedin.com/comm/jobs/search?trk={token} "
+    "You are receiving job alert emails, unsubscribe: https://www.linkedin.com/unsub/{token} "
+    "Sent to alex+{n}@example.com at {hours}:{n} UTC"
+)
+
+NEWS = [
+    "Rust 1.80 stabilizes lazy cells and exclusive ranges in patterns, the release notes also cover "
+    "new lints for unsafe code, faster incremental compilation and changes to the cargo lockfile format.",
+    "The Python steering council accepted the proposal to make the global interpreter lock optional, "
+    "free-threaded builds ship as experimental in 3.13 and extension authors are asked to test them.",
+    "PostgreSQL 17 adds incremental backups, a new memory management for vacuum and JSON_TABLE, "
+    "benchmarks show higher write throughput on busy servers with many concurrent connections.",
+]
+
+
+def job_alert(n, hours, token):
+    return JOB_ALERT.format(n=n, hours=hours, token=token)
+
+
+def test_near_identical_mails_collapse():
+    texts = [
+        job_alert(4, 2, "a1b2c3d4e5f6a1b2c3d4e5f6a1b2"),
+        NEWS[0],
+        job_alert(7, 5, "ffffeeeeddddccccbbbbaaaa9999"),
+        NEWS[1],
+        job_alert(4, 9, "0123456789abcdef0123456789ab"),
+        NEWS[2],
+    ]
+    assert find_near_duplicate_clusters(texts) == [[0, 2, 4], [1], [3], [5]]
+
+
+def test_distinct_mails_stay_separate():
+    # same sender and layout, different jobs
+    other_jobs = JOB_ALERT.replace("Acme Cloud", "Globex Games").replace("Kubernetes and Go", "Unity and C#") \
+        .replace("Contoso Health", "Initech Finance").replace("Python and PyTorch", "Scala and Spark") \
+        .replace("Fabrikam Energy", "Umbrella Biotech").replace("Terraform and AWS", "Ansible and GCP")
+    texts = NEWS + [job_alert(3, 1, "x" * 30), other_jobs.format(n=3, hours=1, token="x" * 30), "", ""]
+    assert find_near_duplicate_clusters(texts) == [[i] for i in range(len(texts))]
+
+
+def test_threshold_one_keeps_only_identical_texts():
+    texts = [job_alert(4, 2, "a" * 30), job_alert(4, 2, "a" * 30), NEWS[0] + " Updated."]
+    assert find_near_duplicate_clusters(texts + [NEWS[0]], threshold=1.0) == [[0, 1], [2], [3]]
+
+
+def test_lsh_parameters_cover_the_signature():
+    for threshold in (0.5, 0.8, 0.95):
+        bands, rows = lsh_parameters(threshold)
+        assert bands * rows == NUM_PERM
+    # a higher threshold needs longer bands
+    assert lsh_parameters(0.95)[1] > lsh_parameters(0.5)[1]
+
+
+def test_the_most_recent_mail_represents_its_cluster():
+    docs = [Document(page_content=text, metadata={"id": f"m{i}"}) for i, text in
+            enumerate([job_alert(4, 2, "a" * 30), NEWS[0], job_alert(5, 3, "b" * 30)])]
+
+    representatives, clusters = select_representatives(docs)
+
+    assert clusters == [[0, 2], [1]]
+    assert [(doc.metadata["id"], doc.metadata["duplicates"]) for doc in representatives] == [("m2", 2), ("m1", 1)]
@@ -0,0 +1,53 @@
+import threading
+
+from src.utils import providers
+
+
+def test_objects_are_built_once_per_options():
+    built = []
+
+    @providers.provider("test_counter")
+    def counter(start=0):
+        built.append(start)
+        return [start]
+
+    assert providers.get("test_counter") is providers.get("test_counter")
+    assert providers.get("test_counter", start=1) == [1]
+    assert built == [0, 1]
+    assert "test_counter" in providers.built()
+
+    providers.reset("test_counter")
+    providers.get("test_counter")
+    assert built == [0, 1, 0]
+
+
+def test_slow_factory_does_not_block_other_objects():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    @providers.provider("test_slow")
+    def slow():
+        calls.append("slow")
+        started.set()
+        release.wait(5)
+        return "slow"
+
+    @providers.provider("test_fast")
+    def fast():
+        return "fast"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(providers.get("test_slow"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    # another object is built while the slow factory runs
+    fast_built = threading.Event()
+    threading.Thread(target=lambda: providers.get("test_fast") == "fast" and fast_built.set(), daemon=True).start()
+    assert fast_built.wait(2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["slow", "slow"]
+    assert calls == ["slow"]
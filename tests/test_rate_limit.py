@@ -0,0 +1,69 @@
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src.email_fetcher import rate_limit
+from src.email_fetcher.rate_limit import FetchStats, TokenBucket, execute_with_retry, is_retryable
+
+
+def http_error(status, content=b""):
+    return HttpError(httplib2.Response({"status": str(status)}), content)
+
+
+class ScriptedRequest:
+    """Raises the given errors one per call, then returns "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(rate_limit.time, "sleep", delays.append)
+    return delays
+
+
+def test_token_bucket_waits_for_the_refill():
+    bucket = TokenBucket(rate=200, capacity=10)
+    assert bucket.acquire(10) == 0.0
+    waited = bucket.acquire(5)
+    # 5 tokens at 200 per second
+    assert 0.02 <= waited < 0.2
+
+
+def test_retryable_errors():
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert is_retryable(http_error(403, b'{"reason": "rateLimitExceeded"}'))
+    assert not is_retryable(http_error(403, b'{"reason": "forbidden"}'))
+    assert not is_retryable(http_error(404))
+    assert not is_retryable(ValueError())
+
+
+def test_throttled_requests_are_retried(no_sleep):
+    stats = FetchStats()
+    request = ScriptedRequest(http_error(429), http_error(500))
+
+    assert execute_with_retry(request, TokenBucket(), 5, stats) == "ok"
+    assert (request.calls, stats.requests, stats.retries, stats.quota_units) == (3, 3, 2, 15)
+    assert len(no_sleep) == 2
+
+
+def test_other_errors_and_exhausted_retries_are_raised(no_sleep):
+    request = ScriptedRequest(http_error(404))
+    with pytest.raises(HttpError):
+        execute_with_retry(request, TokenBucket(), 5, FetchStats())
+    assert request.calls == 1
+
+    request = ScriptedRequest(*[http_error(429)] * 3)
+    with pytest.raises(HttpError):
+        execute_with_retry(request, TokenBucket(), 5, FetchStats(), max_retries=2)
+    assert request.calls == 3
@@ -0,0 +1,74 @@
+import mailbox
+from email.message import EmailMessage
+
+import pytest
+
+from src.email_fetcher.fake_service import FakeGmailService, make_fake_mailbox
+from src.email_fetcher.sources import EmlDirSource, GmailSource, LocalMailSource, MailSource, MboxSource
+from src.summarizer.html_extractor import extract_file
+
+
+def write_eml(path, subject, html, plain, message_id):
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = "newsletter@example.com"
+    message["Date"] = "Mon, 1 Jan 2024 08:00:00 +0000"
+    message["Message-ID"] = message_id
+    message.set_content(plain, charset="iso-8859-1")
+    message.add_alternative(html, subtype="html", charset="gb2312")
+    path.write_bytes(bytes(message))
+
+
+def test_text_parts_are_stored_as_utf8(tmp_path, store):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    html = '<html><head><meta charset="gb2312"></head><body><p>联合早报 新闻</p></body></html>'
+    write_eml(archive / "a.eml", "News", html, "Café news", "<a@example.com>")
+    write_eml(archive / "b.eml", "News", html, "Café news", "<a@example.com>")
+
+    assert EmlDirSource(str(archive), processes=1).ingest(store) == 1
+
+    entry = store.entries()[0]
+    with open(store.path(entry["text_path"]), encoding="utf-8") as f:
+        assert f.read().strip() == "Café news"
+    assert extract_file(store.path(entry["html_path"])) == "联合早报 新闻"
+
+
+def test_local_sources_must_read_raw_messages():
+    with pytest.raises(TypeError):
+        LocalMailSource("archive")
+    assert MboxSource("archive.mbox").path == "archive.mbox"
+
+
+def test_mbox_from_lines_are_unescaped(tmp_path, store):
+    path = str(tmp_path / "archive.mbox")
+    archive = mailbox.mbox(path)
+    for n in range(2):
+        message = EmailMessage()
+        message["Subject"] = f"Digest {n}"
+        message["Message-ID"] = f"<{n}@example.com>"
+        message.set_content(f"Issue {n}\nFrom the editor: hello\n")
+        archive.add(message)
+    archive.close()
+    with open(path, "rb") as f:
+        assert b"\n>From the editor" in f.read()
+
+    assert MboxSource(path, processes=1).ingest(store) == 2
+
+    for n, entry in enumerate(store.entries()):
+        with open(store.path(entry["text_path"]), encoding="utf-8") as f:
+            assert f.read().rstrip() == f"Issue {n}\nFrom the editor: hello"
+
+
+def test_gmail_is_a_mail_source(store):
+    mailbox_messages = make_fake_mailbox(8)
+    service = FakeGmailService(mailbox_messages[:5])
+    source = GmailSource("me", "q", service=service)
+    assert isinstance(source, MailSource)
+
+    assert source.ingest(store) == 5
+    for message in mailbox_messages[5:]:
+        service.add_message(message)
+    service.delete_message(mailbox_messages[0]["id"])
+    assert source.ingest(store) == 3
+    assert len(store) == 7
@@ -0,0 +1,86 @@
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.summarizer import summarizer
+from src.utils import providers
+from src.utils.mail_store import get_store
+
+FOOTER = "You are receiving this email because you subscribed. Unsubscribe at any time."
+
+
+class FakeChatModel:
+    model_name = "fake-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        if prompt.startswith("Summarize the following email"):
+            return AIMessage(content="- one fact")
+        return AIMessage(content="Host 1: Hello\nHost 2: Hi")
+
+
+@pytest.fixture
+def llm(tmp_path, monkeypatch):
+    monkeypatch.setattr(summarizer, "base_dir", str(tmp_path / "mails"))
+    llm = FakeChatModel()
+    providers.put("deepseek", llm, model="deepseek-chat", temperature=0, max_tokens=None, timeout=None,
+                  max_retries=2, streaming=True)
+    return llm
+
+
+def add_mails(store, bodies):
+    for i, body in enumerate(bodies):
+        msg_id = f"m{i}"
+        store.write_file(msg_id, f"mail_{i}.html", f"<p>{body}</p><p>{FOOTER}</p>".encode("utf-8"))
+        store.add(msg_id, subject=f"Mail {i}", name=f"mail_{i}", timestamp=1700000000 + i)
+
+
+def map_prompts(llm):
+    return [prompt for prompt in llm.prompts if prompt.startswith("Summarize the following email")]
+
+
+def test_boilerplate_is_stripped_before_the_map_step(llm, tmp_path):
+    store = get_store(summarizer.base_dir)
+    add_mails(store, ["Rust 2.0 released with a new borrow checker",
+                      "Python drops the GIL in the next release",
+                      "Local elections are held on Sunday"])
+    store.catalog.set_categories({"m0": "技术"})
+    script = tmp_path / "script.txt"
+
+    assert summarizer.run_summarizer("news", file_path=str(script)) == "Host 1: Hello\nHost 2: Hi"
+    assert len(map_prompts(llm)) == 3
+    assert "Rust 2.0 released" in map_prompts(llm)[0]
+    assert not any(FOOTER in prompt for prompt in map_prompts(llm))
+    # the summaries are not stripped: the same bullet in every summary is kept
+    assert llm.prompts[-1].count("- one fact") == 3
+    assert store.catalog.unindexed_line_entries() == []
+
+    summarizer.run_summarizer("news", mode="stuff", file_path=str(script))
+    assert "Rust 2.0 released" in llm.prompts[-1]
+    assert FOOTER not in llm.prompts[-1]
+
+    # one of the mails alone: the footer is still boilerplate of the catalog, the summary is cached
+    summarizer.run_summarizer("news", category="技术", file_path=str(script))
+    assert len(map_prompts(llm)) == 3
+    summarizer.run_summarizer("news", category="技术", mode="stuff", file_path=str(script))
+    assert "Rust 2.0 released" in llm.prompts[-1]
+    assert FOOTER not in llm.prompts[-1]
+    assert {entry["summary_status"] for entry in store.entries()} == {"summarized"}
+
+
+def test_summary_cache_key_ignores_the_boilerplate_table(llm, tmp_path):
+    store = get_store(summarizer.base_dir)
+    add_mails(store, ["Rust 2.0 released", "Python drops the GIL"])
+    script = tmp_path / "script.txt"
+
+    # two mails: the footer is not boilerplate yet
+    summarizer.run_summarizer("news", file_path=str(script))
+    assert all(FOOTER in prompt for prompt in map_prompts(llm))
+
+    # a third mail makes it boilerplate, only the new mail is summarized
+    add_mails(store, ["Rust 2.0 released", "Python drops the GIL", "Local elections are held on Sunday"])
+    summarizer.run_summarizer("news", file_path=str(script))
+    assert len(map_prompts(llm)) == 3
+    assert FOOTER not in map_prompts(llm)[-1]
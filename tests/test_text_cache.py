@@ -0,0 +1,46 @@
+import os
+
+from src.summarizer.text_cache import TextCache
+
+
+def texts(prefix, n):
+    # random hex compresses to about half its size
+    return {f"{prefix}{i}": os.urandom(500).hex() for i in range(n)}
+
+
+def cache_size(cache):
+    return cache.conn.execute("SELECT COALESCE(SUM(size), 0) FROM parsed_text").fetchone()[0]
+
+
+def test_round_trip(tmp_path):
+    cache = TextCache(str(tmp_path / "text_cache.sqlite3"))
+    cache.put_many({"a": "first mail", "b": "第二封邮件"})
+    assert cache.get_many(["a", "b", "c"]) == {"a": "first mail", "b": "第二封邮件"}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_eviction_keeps_part_of_a_single_batch(tmp_path):
+    cache = TextCache(str(tmp_path / "text_cache.sqlite3"), max_bytes=10_000)
+    batch = texts("new", 40)
+
+    cache.put_many(batch)
+
+    kept = cache.get_many(batch)
+    assert 0 < len(kept) < 40
+    assert cache_size(cache) <= 8_000
+    # the first entries of the batch go first
+    assert set(kept) == {f"new{i}" for i in range(40 - len(kept), 40)}
+
+
+def test_eviction_drops_least_recently_used_first(tmp_path):
+    cache = TextCache(str(tmp_path / "text_cache.sqlite3"))
+    cache.put_many(texts("old", 10))
+    cache.put_many(texts("used", 10))
+    cache.get_many([f"old{i}" for i in range(5)])
+    cache.max_bytes = int(cache_size(cache) * 1.2)
+
+    cache.put_many(texts("new", 10))
+
+    assert len(cache.get_many([f"new{i}" for i in range(10)])) == 10
+    assert len(cache.get_many([f"old{i}" for i in range(5)])) == 5
+    assert cache.get_many([f"old{i}" for i in range(5, 10)]) == {}
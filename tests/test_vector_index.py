@@ -0,0 +1,60 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.summarizer import document_loader
+from src.summarizer.vector_index import EMBEDDING_MODEL, load_index, update_index
+from src.utils import providers
+from src.utils.mail_store import get_store
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def mail(msg_id, text):
+    return Document(page_content=text, metadata={"id": msg_id, "subject": msg_id})
+
+
+def test_only_new_and_changed_mails_are_embedded(tmp_path):
+    path = str(tmp_path / "index")
+    embeddings = CountingEmbeddings(size=16, embedded=[])
+    mails = [mail("a", "First mail " * 300), mail("b", "Second mail"), mail("c", "Third mail")]
+
+    vector_store, report = update_index(mails, path, embeddings)
+    assert report["added"] == 3
+    first_chunks = report["embedded_chunks"]
+    assert first_chunks > 3  # the long mail is split
+    assert len(embeddings.embedded) == first_chunks
+
+    _, report = update_index(mails, path, embeddings)
+    assert report["embedded_chunks"] == 0
+    assert report["unchanged"] == 3
+
+    embedded = len(embeddings.embedded)
+    mails = [mails[0], mail("b", "Second mail, corrected"), mail("d", "Fourth mail")]
+    vector_store, report = update_index(mails, path, embeddings)
+    assert (report["added"], report["updated"], report["removed"], report["unchanged"]) == (1, 1, 1, 1)
+    assert embeddings.embedded[embedded:] == ["Second mail, corrected", "Fourth mail"]
+
+    reloaded = load_index(path, embeddings)
+    ids = {doc.metadata["id"] for doc in reloaded.get_by_ids(list(reloaded.index_to_docstore_id.values()))}
+    assert ids == {"a", "b", "d"}
+    assert report["chunks"] == first_chunks
+
+
+def test_load_and_prepare_documents_indexes_the_store(tmp_path):
+    store = get_store(str(tmp_path / "mails"))
+    for msg_id, text in [("m0", "Rust 2.0 released"), ("m1", "Python drops the GIL")]:
+        store.write_file(msg_id, f"{msg_id}.html", f"<p>{text}</p>".encode("utf-8"))
+        store.add(msg_id, subject=text, name=msg_id)
+    embeddings = CountingEmbeddings(size=16, embedded=[])
+    providers.put("ollama_embeddings", embeddings, model=EMBEDDING_MODEL)
+
+    vector_store = document_loader.load_and_prepare_documents(store.root, str(tmp_path / "index"))
+
+    assert sorted(embeddings.embedded) == ["Python drops the GIL", "Rust 2.0 released"]
+    assert sorted(vector_store.index_to_docstore_id.values()) == ["m0:0", "m1:0"]